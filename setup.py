@@ -54,7 +54,6 @@ setup (
         'ping==0.2',
         'pysnmp==4.2.2',
         'PyYAML==3.10',
-        'python-graph-core==1.8.2',
         'pytz==2013b',
         'pyzabbix>=0.1',
         'requests>=0.14.2',
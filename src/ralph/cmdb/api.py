@@ -39,6 +39,7 @@ from ralph.cmdb.models import (
 from ralph.cmdb import models as db
 from ralph.cmdb.models_ci import CIOwner, CIOwnershipType, CIOwnership
 from ralph.cmdb.models_audits import get_login_from_owner_name
+from ralph.discovery.api import ChangedSinceMixin
 
 THROTTLE_AT = settings.API_THROTTLING['throttle_at']
 TIMEFRAME = settings.API_THROTTLING['timeframe']
@@ -170,7 +171,7 @@ class CIRelationResource(MResource):
                     setattr(bundle.obj, field, hydro_fields[0])
         return bundle
 
-class CIResource(MResource):
+class CIResource(ChangedSinceMixin, MResource):
     class Meta:
         queryset = CI.objects.all()
         authentication = ApiKeyAuthentication()
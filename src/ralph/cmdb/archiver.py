@@ -6,9 +6,16 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import datetime
+import logging
+import time
+
+from django.core.exceptions import ValidationError
 from django.db import connection
+from django.db.models import Max, Q
 from lck.django.common import nested_commit_on_success
 
+from ralph.cmdb.counters import uncount_changes
 from ralph.cmdb.models import (
     ArchivedCIChange,
     ArchivedCIChangeCMDBHistory,
@@ -16,6 +23,7 @@ from ralph.cmdb.models import (
     ArchivedCIChangePuppet,
     ArchivedCIChangeZabbixTrigger,
     ArchivedPuppetLog,
+    ArchivizationCheckpoint,
     CI_CHANGE_TYPES,
     CIChange,
     CIChangeCMDBHistory,
@@ -23,24 +31,21 @@ from ralph.cmdb.models import (
     CIChangePuppet,
     CIChangeZabbixTrigger,
     PuppetLog,
+    month_bucket,
 )
 
 
-def _get_used_db_backend_name():
-    """
-    Return used database backend name or None.
-    """
-    cursor = connection.cursor()
-    backend_str = str(cursor.db).lower()  # `ENGINE` part of database
-                                          # configuration is substring
-                                          # of string representation
-                                          # for `cursor.db` object
-    if 'mysql' in backend_str:
-        return 'mysql'
-    elif 'postgresql' in backend_str:
-        return 'postgresql'
-    elif 'sqlite' in backend_str:
-        return 'sqlite'
+logger = logging.getLogger(__name__)
+
+# number of consecutive change ids moved in one transaction
+WINDOW_SIZE = 1000
+# the tables bucketed by month
+BUCKETED_MODELS = (
+    CIChange,
+    CIChangePuppet,
+    CIChangeZabbixTrigger,
+    PuppetLog,
+)
 
 
 def _get_db_columns_for_model(model):
@@ -57,313 +62,249 @@ def _get_db_table_for_model(model):
     return model._meta.db_table
 
 
-def _make_base_insert_query(model, archived_model):
+def _make_window_insert_query(model, archived_model, column, count):
     """
-    Create moved data SQL query with simple conditions.
+    Create a query copying the rows which have one of `count` values in
+    `column` to the archive.
     """
     db_columns = _get_db_columns_for_model(model)
     sql = """
         INSERT INTO {archived_table_name} ({columns})
         SELECT {columns} FROM {table_name}
-        WHERE created<=%s AND type=%s
+        WHERE {column} IN ({values})
     """.format(
         archived_table_name=_get_db_table_for_model(archived_model),
         columns=','.join(db_columns),
         table_name=_get_db_table_for_model(model),
+        column=column,
+        values=','.join(['%s'] * count),
     )
     return sql.strip()
 
 
-def _make_advanced_insert_query(
-    model,
-    archived_model,
-    joined_model,
-    join_by=('id', 'object_id'),
-):
+def _make_window_delete_query(model, column, count):
     """
-    Create not trivial moved data SQL query with advanced conditions.
-    Not trivial means that we have two linked tables and we should move data
-    using `JOIN` syntax.
+    Create a query deleting the rows which have one of `count` values in
+    `column`.
     """
-    db_columns = _get_db_columns_for_model(model)
-    first_table_name = _get_db_table_for_model(model)
-    sql = """
-        INSERT INTO {archived_table_name} ({columns})
-        SELECT {source_columns}
-        FROM {first_table_name} JOIN {second_table_name}
-            ON {second_table_name}.{r_id}={first_table_name}.{l_id}
-        WHERE
-            {second_table_name}.created<=%s AND
-            {second_table_name}.type=%s
-    """.format(
-        archived_table_name=_get_db_table_for_model(archived_model),
-        columns=','.join(db_columns),
-        source_columns=','.join([
-            '`%s`.`%s`' % (first_table_name, col) for col in db_columns
-        ]),
-        first_table_name=first_table_name,
-        second_table_name=_get_db_table_for_model(joined_model),
-        l_id=join_by[0],
-        r_id=join_by[1],
+    return 'DELETE FROM {} WHERE {} IN ({})'.format(
+        _get_db_table_for_model(model),
+        column,
+        ','.join(['%s'] * count),
     )
-    return sql.strip()
 
 
-def _make_base_delete_query(model):
+@nested_commit_on_success
+def _archive_window(change_type, details, archivable, first_id, last_id):
     """
-    Create simple delete query.
+    Move the changes of `change_type` matching the `archivable` condition
+    with ids from `first_id` to `last_id` to the archive, together with
+    their details. `details` is a list of `(model, archived_model, column)`,
+    referenced models first, where `column` holds the id of the change
+    content object. Returns the id of the first change in the window which
+    was too recent to be archived, or None.
     """
-    return 'DELETE FROM {} WHERE created<=%s AND type=%s'.format(
-        _get_db_table_for_model(model),
+    changes = CIChange.objects.filter(
+        id__gte=first_id,
+        id__lte=last_id,
+        type=change_type,
     )
-
-
-def _make_advanced_delete_query(
-    model,
-    joined_model,
-    join_by=('id', 'object_id'),
-):
+    recent = list(changes.exclude(
+        archivable,
+    ).order_by('id').values_list('id', flat=True)[:1])
+    rows = list(changes.filter(archivable).values_list('id', 'object_id'))
+    change_ids = [change_id for change_id, object_id in rows]
+    object_ids = [object_id for change_id, object_id in rows if object_id]
+    tables = [(CIChange, ArchivedCIChange, 'id', change_ids)]
+    tables.extend(
+        (model, archived_model, column, object_ids)
+        for model, archived_model, column in details
+    )
+    tables = [table for table in tables if table[3]]
+    if change_ids:
+        uncount_changes(CIChange.objects.filter(id__in=change_ids))
+    cursor = connection.cursor()
+    # the referenced rows are copied first and deleted last
+    for model, archived_model, column, values in tables:
+        cursor.execute(
+            _make_window_insert_query(
+                model, archived_model, column, len(values),
+            ),
+            values,
+        )
+    for model, archived_model, column, values in reversed(tables):
+        cursor.execute(
+            _make_window_delete_query(model, column, len(values)),
+            values,
+        )
+    checkpoint = ArchivizationCheckpoint.objects.get(change_type=change_type)
+    checkpoint.last_id = last_id
+    checkpoint.save()
+    return recent[0] if recent else None
+
+
+def _run_archivization(change_type, details, older_than,
+                       window_size=WINDOW_SIZE, pause=0, by_month=False):
     """
-    Create advanced delete query with not trivial conditions.
-    Not trivial means that we have two linked tables and we should
-    delete (if db backend have this possibility) data using `JOIN` syntax.
+    Move the changes of `change_type` older than `older_than` and their
+    details to the archive, in windows of `window_size` consecutive change
+    ids, each in its own transaction, sleeping `pause` seconds between them.
+    The progress is stored in `ArchivizationCheckpoint`, so an interrupted
+    run continues where it stopped, and the next run starts from the first
+    change which was too recent. The run stops after the first window with
+    such a change, as the changes after it are mostly recent too.
+
+    With `by_month`, whole months of changes before the month of
+    `older_than` are archived, found by their month bucket, and the windows
+    stop at the last change of those months.
     """
-    backend_name = _get_used_db_backend_name()
-    if backend_name == 'mysql':
-        sql = """
-            DELETE {first_table_name}.* FROM {first_table_name}
-            JOIN {second_table_name}
-                ON {second_table_name}.{r_id}={first_table_name}.{l_id}
-            WHERE
-                {second_table_name}.created<=%s AND
-                {second_table_name}.type=%s
-        """
-    elif backend_name == 'postgresql':
-        sql = """
-            DELETE FROM {first_table_name}
-            USING {second_table_name}
-            WHERE
-                {second_table_name}.{r_id}={first_table_name}.{l_id}
-                AND {second_table_name}.created<=%s
-                AND {second_table_name}.type=%s
-        """
+    checkpoint, created = ArchivizationCheckpoint.objects.get_or_create(
+        change_type=change_type,
+    )
+    # the changes too recent for the interrupted part of a resumed run
+    # are unknown, so it can't move the start of the next run
+    resumed = checkpoint.older_than is not None
+    if not resumed:
+        checkpoint.older_than = older_than
+        checkpoint.last_id = checkpoint.start_id
+        checkpoint.save()
+    if by_month:
+        archivable = Q(month__lt=month_bucket(older_than))
+        max_id = CIChange.objects.filter(
+            archivable,
+            type=change_type,
+        ).aggregate(Max('id'))['id__max'] or 0
     else:
-        sql = """
-            DELETE FROM {first_table_name}
-            WHERE {first_table_name}.{l_id} IN (
-                SELECT {second_table_name}.{r_id}
-                FROM {second_table_name}
-                WHERE
-                    {second_table_name}.created<=%s AND
-                    {second_table_name}.type=%s
-            )
-        """
-    return sql.format(
-        first_table_name=_get_db_table_for_model(model),
-        second_table_name=_get_db_table_for_model(joined_model),
-        l_id=join_by[0],
-        r_id=join_by[1],
-    ).strip()
-
-
-def _get_query_params_list(older_than, change_type):
-    """
-    Create a formatted params list.
+        archivable = Q(created__lte=older_than)
+        max_id = CIChange.objects.aggregate(Max('id'))['id__max'] or 0
+    first_recent_id = None
+    while checkpoint.last_id < max_id:
+        recent_id = _archive_window(
+            change_type,
+            details,
+            archivable,
+            checkpoint.last_id + 1,
+            checkpoint.last_id + window_size,
+        )
+        checkpoint = ArchivizationCheckpoint.objects.get(
+            change_type=change_type,
+        )
+        if recent_id is not None:
+            first_recent_id = recent_id
+            break
+        if pause:
+            time.sleep(pause)
+    if not resumed:
+        if first_recent_id is None:
+            checkpoint.start_id = checkpoint.last_id
+        else:
+            checkpoint.start_id = first_recent_id - 1
+    checkpoint.last_id = checkpoint.start_id
+    checkpoint.older_than = None
+    checkpoint.save()
+
+
+def fill_month_buckets(model, chunk_size=WINDOW_SIZE):
     """
-    return [
-        older_than.strftime('%Y-%m-%d %H:%M:%S'),
-        int(change_type),
-    ]
-
-
-def _run_archivization(
-    model,
-    archived_model,
-    older_than,
-    change_type,
-    parent_model=None
-):
+    Set the month bucket of the rows of `model` which don't have one yet,
+    e.g. the ones stored before the buckets were introduced or updated
+    in bulk. The rows with dates which can't be read are logged and left
+    without a bucket. Returns the number of updated rows.
     """
-    Execute archivization process for data older than `older_than`, which type
-    is specified in `change_type` variable. If `parent_model` is passed it
-    will be used to make `WHERE` conditions. Otherwise conditions are
-    build on `model` variable.
-
-    :param model: The archived model
-    :param archived_model: Model to store archived data
-    :param older_than: Query condition
-    :param change_type: Query condition
-    :param parent_model: Empty or model to construct `WHERE` conditions.
-        This model is connected with archived model with a foreign key.
-    """
-    cursor = connection.cursor()
-    if not parent_model:
-        sql = _make_base_insert_query(model, archived_model)
-    else:
-        sql = _make_advanced_insert_query(model, archived_model, parent_model)
-    params = _get_query_params_list(older_than, change_type)
-    cursor.execute(sql, params)
-
-
-def _remove_old_data(model, older_than, change_type, parent_model=None):
+    source = model._meta.get_field('month').source
+    count = 0
+    last_id = 0
+    while True:
+        rows = list(model.objects.filter(
+            month=None,
+            id__gt=last_id,
+        ).exclude(
+            **{source: None}
+        ).order_by('id').values_list('id', source)[:chunk_size])
+        if not rows:
+            return count
+        last_id = rows[-1][0]
+        buckets = {}
+        for row_id, value in rows:
+            try:
+                bucket = month_bucket(value)
+            except (AttributeError, TypeError, ValidationError):
+                logger.warning(
+                    'Skipping %s %s with an invalid %s: %r.',
+                    model._meta.object_name, row_id, source, value,
+                )
+                continue
+            buckets.setdefault(bucket, []).append(row_id)
+        for bucket, row_ids in buckets.iteritems():
+            model.objects.filter(id__in=row_ids).update(month=bucket)
+            count += len(row_ids)
+
+
+def run_month_roll(keep_months, **kwargs):
     """
-    Remove data older than `older_than`, which type is specified
-    in `change_type` variable. If parent_model is passed it will be used to
-    make `WHERE` conditions. Otherwise conditions are build on `model`
-    variable.
-
-    :param model: The archived model
-    :param older_than: Query condition
-    :param change_type: Query condition
-    :param parent_model: Empty or model to construct `WHERE` conditions.
-        This model is connected with archived model with a foreign key.
+    Fill in the missing month buckets and move all the changes from before
+    the last `keep_months` months (including the current one) to the
+    archive, as whole months.
     """
-    cursor = connection.cursor()
-    if not parent_model:
-        sql = _make_base_delete_query(model)
-    else:
-        sql = _make_advanced_delete_query(model, parent_model)
-    params = _get_query_params_list(older_than, change_type)
-    cursor.execute(sql, params)
-
-
-@nested_commit_on_success
-def run_cichange_git_archivization(older_than):
+    for model in BUCKETED_MODELS:
+        fill_month_buckets(model)
+    today = datetime.date.today()
+    month = today.year * 12 + today.month - keep_months
+    older_than = datetime.datetime(month // 12, month % 12 + 1, 1)
+    for run_archivization in (
+        run_cichange_git_archivization,
+        run_cichange_zabbix_archivization,
+        run_cichange_cmdb_history_archivization,
+        run_cichange_device_archivization,
+        run_cichange_puppet_archivization,
+    ):
+        run_archivization(older_than, by_month=True, **kwargs)
+
+
+def run_cichange_git_archivization(older_than, **kwargs):
     _run_archivization(
-        CIChange,
-        ArchivedCIChange,
+        CI_CHANGE_TYPES.CONF_GIT.id,
+        [(CIChangeGit, ArchivedCIChangeGit, 'id')],
         older_than,
-        CI_CHANGE_TYPES.CONF_GIT,
-    )
-    _run_archivization(
-        CIChangeGit,
-        ArchivedCIChangeGit,
-        older_than,
-        CI_CHANGE_TYPES.CONF_GIT,
-        parent_model=CIChange,
-    )
-    _remove_old_data(
-        CIChangeGit,
-        older_than,
-        CI_CHANGE_TYPES.CONF_GIT,
-        parent_model=CIChange,
-    )
-    _remove_old_data(
-        CIChange,
-        older_than,
-        CI_CHANGE_TYPES.CONF_GIT,
+        **kwargs
     )
 
 
-@nested_commit_on_success
-def run_cichange_zabbix_archivization(older_than):
-    _run_archivization(
-        CIChange,
-        ArchivedCIChange,
-        older_than,
-        CI_CHANGE_TYPES.ZABBIX_TRIGGER,
-    )
+def run_cichange_zabbix_archivization(older_than, **kwargs):
     _run_archivization(
-        CIChangeZabbixTrigger,
-        ArchivedCIChangeZabbixTrigger,
-        older_than,
-        CI_CHANGE_TYPES.ZABBIX_TRIGGER,
-        parent_model=CIChange,
-    )
-    _remove_old_data(
-        CIChangeZabbixTrigger,
-        older_than,
-        CI_CHANGE_TYPES.ZABBIX_TRIGGER,
-        parent_model=CIChange
-    )
-    _remove_old_data(
-        CIChange,
+        CI_CHANGE_TYPES.ZABBIX_TRIGGER.id,
+        [(CIChangeZabbixTrigger, ArchivedCIChangeZabbixTrigger, 'id')],
         older_than,
-        CI_CHANGE_TYPES.ZABBIX_TRIGGER,
+        **kwargs
     )
 
 
-@nested_commit_on_success
-def run_cichange_cmdb_history_archivization(older_than):
-    _run_archivization(
-        CIChange,
-        ArchivedCIChange,
-        older_than,
-        CI_CHANGE_TYPES.CI,
-    )
+def run_cichange_cmdb_history_archivization(older_than, **kwargs):
     _run_archivization(
-        CIChangeCMDBHistory,
-        ArchivedCIChangeCMDBHistory,
+        CI_CHANGE_TYPES.CI.id,
+        [(CIChangeCMDBHistory, ArchivedCIChangeCMDBHistory, 'id')],
         older_than,
-        CI_CHANGE_TYPES.CI,
-        parent_model=CIChange,
-    )
-    _remove_old_data(
-        CIChangeCMDBHistory,
-        older_than,
-        CI_CHANGE_TYPES.CI,
-        parent_model=CIChange,
-    )
-    _remove_old_data(
-        CIChange,
-        older_than,
-        CI_CHANGE_TYPES.CI,
+        **kwargs
     )
 
 
-@nested_commit_on_success
-def run_cichange_device_archivization(older_than):
+def run_cichange_device_archivization(older_than, **kwargs):
     _run_archivization(
-        CIChange,
-        ArchivedCIChange,
+        CI_CHANGE_TYPES.DEVICE.id,
+        [],
         older_than,
-        CI_CHANGE_TYPES.DEVICE,
-    )
-    _remove_old_data(
-        CIChange,
-        older_than,
-        CI_CHANGE_TYPES.DEVICE,
+        **kwargs
     )
 
 
-@nested_commit_on_success
-def run_cichange_puppet_archivization(older_than):
-    _run_archivization(
-        CIChange,
-        ArchivedCIChange,
-        older_than,
-        CI_CHANGE_TYPES.CONF_AGENT,
-    )
+def run_cichange_puppet_archivization(older_than, **kwargs):
     _run_archivization(
-        CIChangePuppet,
-        ArchivedCIChangePuppet,
-        older_than,
-        CI_CHANGE_TYPES.CONF_AGENT,
-        parent_model=CIChange,
-    )
-    cursor = connection.cursor()
-    params = _get_query_params_list(older_than, CI_CHANGE_TYPES.CONF_AGENT)
-    sql = _make_advanced_insert_query(
-        PuppetLog,
-        ArchivedPuppetLog,
-        CIChange,
-        join_by=('cichange_id', 'object_id'),
-    )
-    cursor.execute(sql, params)
-    sql = _make_advanced_delete_query(
-        PuppetLog,
-        CIChange,
-        join_by=('cichange_id', 'object_id'),
-    )
-    cursor.execute(sql, params)
-    _remove_old_data(
-        CIChangePuppet,
-        older_than,
-        CI_CHANGE_TYPES.CONF_AGENT,
-        parent_model=CIChange,
-    )
-    _remove_old_data(
-        CIChange,
+        CI_CHANGE_TYPES.CONF_AGENT.id,
+        [
+            (CIChangePuppet, ArchivedCIChangePuppet, 'id'),
+            # the logs refer to the puppet changes
+            (PuppetLog, ArchivedPuppetLog, 'cichange_id'),
+        ],
         older_than,
-        CI_CHANGE_TYPES.CONF_AGENT,
+        **kwargs
     )
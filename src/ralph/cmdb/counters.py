@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Monthly counters of the CI changes, problems and incidents.
+
+The dashboard and the reports read ``CIChangeCount`` and ``CIEventCount``
+instead of counting the rows of the change and event tables. The counters
+are updated by the signals of single objects, by the bulk creation of the
+changes and by the archiver, and `rebuild_counts` computes them again from
+scratch, e.g. after the changes were removed without any of those.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from lck.django.common import nested_commit_on_success
+
+from ralph.cmdb.models_changes import (
+    CI_EVENT_TYPES,
+    CIChange,
+    CIChangeCount,
+    CIEventCount,
+    CIIncident,
+    CIProblem,
+    month_bucket,
+)
+
+
+# number of counters created in one query by `rebuild_counts`
+BATCH_SIZE = 1000
+CHANGE_KEY = ('ci_id', 'type', 'priority', 'month')
+EVENT_KEY = ('ci_id', 'type', 'month')
+
+
+def _add(model, key, delta):
+    """Add `delta` to the counter with the given `key`."""
+    counters = model.objects.filter(**key)
+    if counters.update(count=F('count') + delta):
+        if delta < 0:
+            counters.filter(count__lte=0).delete()
+        return
+    if delta < 0:
+        # the counter is gone together with its CI or the counted rows
+        # were never counted
+        return
+    sid = transaction.savepoint()
+    try:
+        model.objects.create(count=delta, **key)
+    except IntegrityError:
+        # created by someone else in the meantime
+        transaction.savepoint_rollback(sid)
+        counters.update(count=F('count') + delta)
+    else:
+        transaction.savepoint_commit(sid)
+
+
+def _apply(model, fields, deltas):
+    for values, delta in deltas.iteritems():
+        if delta:
+            _add(model, dict(zip(fields, values)), delta)
+
+
+def count_changes(changes, sign=1):
+    """
+    Add the ``CIChange`` objects to the counters, or subtract them with
+    `sign` equal to -1. The changes without a CI aren't counted.
+    """
+    deltas = defaultdict(int)
+    for change in changes:
+        if change.ci_id and change.time:
+            deltas[
+                change.ci_id,
+                change.type,
+                change.priority,
+                month_bucket(change.time),
+            ] += sign
+    _apply(CIChangeCount, CHANGE_KEY, deltas)
+
+
+def uncount_changes(changes):
+    """
+    Subtract the changes selected by a ``CIChange`` query from the counters,
+    counting them in the database. Call it before the changes are removed.
+    """
+    deltas = {}
+    for ci_id, type_, priority, month, count in changes.exclude(
+        ci=None,
+    ).exclude(
+        month=None,
+    ).values_list(
+        'ci', 'type', 'priority', 'month',
+    ).annotate(Count('id')).order_by():
+        deltas[ci_id, type_, priority, month] = -count
+    _apply(CIChangeCount, CHANGE_KEY, deltas)
+
+
+def change_saved(change, created):
+    """Update the counters after a ``CIChange`` was saved."""
+    if created:
+        count_changes([change])
+        return
+    dirty = change.dirty_fields
+    if not {'ci_id', 'type', 'priority', 'time'} & set(dirty):
+        return
+    old = CIChange(
+        ci_id=dirty.get('ci_id', change.ci_id),
+        type=dirty.get('type', change.type),
+        priority=dirty.get('priority', change.priority),
+        time=dirty.get('time', change.time),
+    )
+    count_changes([old], sign=-1)
+    count_changes([change])
+
+
+def get_event_type(event):
+    if isinstance(event, CIProblem):
+        return CI_EVENT_TYPES.PROBLEM.id
+    if isinstance(event, CIIncident):
+        return CI_EVENT_TYPES.INCIDENT.id
+    return None
+
+
+def count_event(event, sign=1, ci_id=None, created_date=None):
+    """
+    Add the problem or incident to the counters, or subtract it with `sign`
+    equal to -1. Events are counted in the month they were created in the
+    issue tracker, or stored here if that's unknown.
+    """
+    ci_id = ci_id or event.ci_id
+    date = created_date or event.created_date or event.created
+    if not ci_id or not date:
+        return
+    _add(CIEventCount, {
+        'ci_id': ci_id,
+        'type': get_event_type(event),
+        'month': month_bucket(date),
+    }, sign)
+
+
+def event_saved(event, created):
+    """Update the counters after a problem or incident was saved."""
+    if created:
+        count_event(event)
+        return
+    dirty = event.dirty_fields
+    if not {'ci_id', 'created_date'} & set(dirty):
+        return
+    count_event(
+        event,
+        sign=-1,
+        ci_id=dirty.get('ci_id', event.ci_id),
+        created_date=dirty.get('created_date', event.created_date),
+    )
+    count_event(event)
+
+
+@nested_commit_on_success
+def rebuild_counts():
+    """Count all the changes, problems and incidents again."""
+    CIChangeCount.objects.all().delete()
+    counters = []
+    for ci_id, type_, priority, month, count in CIChange.objects.exclude(
+        ci=None,
+    ).exclude(
+        month=None,
+    ).values_list(
+        'ci', 'type', 'priority', 'month',
+    ).annotate(Count('id')).order_by().iterator():
+        counters.append(CIChangeCount(
+            ci_id=ci_id,
+            type=type_,
+            priority=priority,
+            month=month,
+            count=count,
+        ))
+        if len(counters) >= BATCH_SIZE:
+            CIChangeCount.objects.bulk_create(counters)
+            counters = []
+    CIChangeCount.objects.bulk_create(counters)
+    CIEventCount.objects.all().delete()
+    counts = defaultdict(int)
+    for model, type_ in (
+        (CIProblem, CI_EVENT_TYPES.PROBLEM.id),
+        (CIIncident, CI_EVENT_TYPES.INCIDENT.id),
+    ):
+        for ci_id, created_date, created in model.objects.exclude(
+            ci=None,
+        ).values_list('ci', 'created_date', 'created').iterator():
+            date = created_date or created
+            if date:
+                counts[ci_id, type_, month_bucket(date)] += 1
+    CIEventCount.objects.bulk_create([
+        CIEventCount(ci_id=ci_id, type=type_, month=month, count=count)
+        for (ci_id, type_, month), count in counts.iteritems()
+    ])
@@ -7,13 +7,10 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from collections import defaultdict
-from itertools import chain
 
-import pygraph
-from pygraph.algorithms.searching import breadth_first_search
-from pygraph.classes.exceptions import AdditionError
-
-from ralph.cmdb.models import CI, CIRelation, CI_TYPES, CI_RELATION_TYPES
+from ralph.cmdb.models import CI_RELATION_TYPES, CI_TYPES
+from ralph.cmdb.relation_graph import RelationGraph
+from ralph.util.graph import breadth_first_search
 
 
 class ImpactCalculator(object):
@@ -29,46 +26,33 @@ class ImpactCalculator(object):
             self.relation_types = default_relation_types
         else:
             self.relation_types = relation_types
+        self.relations = RelationGraph.get()
         self.build_graph()
 
-    def cache_relations(self):
-        """Pre-load cache of all contains-relations, to be more effective
-        across instances than querysets"""
-        self.cached_relations = defaultdict(list)
-        for relation in CIRelation.objects.values(
-                'parent_id', 'child_id', 'type', 'id').filter(
-                type=CI_RELATION_TYPES.CONTAINS.id):
-            self.cached_relations[relation.get('parent_id')].append({
-                'parent': relation.get('parent_id'),
-                'child': relation.get('child_id'),
-                'type': relation.get('type'),
-                'id': relation.get('id'),
-            })
-
     def get_all_children(self):
         """Returns all down-level children that matches CONTAINS relation"""
-        self.cache_relations()
-        self.visited_nodes = set()
         return self.get_all_children_rec(self.root_ci.id)
 
     def get_all_children_rec(self, node):
+        graph = self.relations.graph
         stack = [node]
         visited = {node}
         while stack:
             node = stack.pop()
-            for child in self.cached_relations[node]:
-                if child['id'] in visited:
+            for child, type_ in graph.successors(node):
+                if type_ != CI_RELATION_TYPES.CONTAINS.id:
                     continue
-                yield child
-                visited.add(node)
-                stack.append(child['id'])
+                yield {'parent': node, 'child': child, 'type': type_}
+                if child not in visited:
+                    visited.add(child)
+                    stack.append(child)
 
     def find_affected_nodes(self, ci_id):
-        try:
-            search_tree, pre = breadth_first_search(self.graph, ci_id)
-        except KeyError:
+        if ci_id not in self.adjacency:
+            if self.relations.has_ci(ci_id):
+                return ({ci_id: None}, [ci_id])
             return []
-        return (search_tree, pre)
+        return breadth_first_search(ci_id, self.adjacency.__getitem__)
 
     def add_edge(self, type_, parent_id, child_id):
         if type_ == CI_RELATION_TYPES.CONTAINS.id:
@@ -79,59 +63,73 @@ class ImpactCalculator(object):
             # opposite direction for graph traversal.
             from_ = child_id
             to = parent_id
-        try:
-            # the only relation which we can traverse going straight
-            self.graph.add_edge((from_, to), attrs=(type_,))
-        except AdditionError:
+        if (from_, to) in self.edge_types:
             # ignore duplicated relations(types) in graph
-            pass
+            return
+        self.edge_types[from_, to] = type_
+        self.edge_types[to, from_] = type_
+        self.adjacency[from_].append(to)
+        if from_ != to:
+            self.adjacency[to].append(from_)
+
+    def _relations(self, edges, root, is_parent, type_=None):
+        for other, relation_type in edges:
+            if type_ is not None and relation_type != type_:
+                continue
+            if is_parent:
+                yield relation_type, root, other
+            else:
+                yield relation_type, other, root
 
     def build_graph(self):
+        """
+        Build the undirected graph of the relations around the root CI,
+        out of the relation graph cached in memory instead of the database.
+        """
+        graph = self.relations.graph
+        root = self.root_ci.id
+        self.adjacency = defaultdict(list)
+        self.edge_types = {}
+        if self.relations.has_ci(root):
+            self.adjacency[root]
         # get all down-level children
-        ci_contains = self.get_all_children()
-        # get one level up parents
-        ci_is_part_of = CIRelation.objects.filter(child__id=self.root_ci.id)
-        ci_is_required = CIRelation.objects.filter(
-            # get children and parent one level up/down.
-            type=CI_RELATION_TYPES.REQUIRES.id,
-            child=self.root_ci,
-        )
-        ci_requires = CIRelation.objects.filter(
+        for relation in self.get_all_children():
+            self.add_edge(
+                relation['type'],
+                relation['parent'],
+                relation['child'],
+            )
+        parents = graph.predecessors(root)
+        children = graph.successors(root)
+        # get venture node belongs to, and service venture belongs to.
+        services = []
+        for venture, type_ in parents:
+            if (type_ != CI_RELATION_TYPES.CONTAINS.id or
+                    self.relations.get_ci_type(venture) !=
+                    CI_TYPES.VENTURE.id):
+                continue
+            for service, type_ in graph.predecessors(venture):
+                if (type_ == CI_RELATION_TYPES.CONTAINS.id and
+                        self.relations.get_ci_type(service) ==
+                        CI_TYPES.SERVICE.id):
+                    services.append((type_, service, venture))
+        for relations in (
+            # get one level up parents
+            self._relations(parents, root, False),
             # get children and parent one level up/down.
-            type=CI_RELATION_TYPES.REQUIRES.id,
-            parent=self.root_ci,
-        )
-        ci_is_role = CIRelation.objects.filter(
-            type=CI_RELATION_TYPES.HASROLE.id,
-            child=self.root_ci,
-        )
-        ci_has_role = CIRelation.objects.filter(
-            type=CI_RELATION_TYPES.HASROLE.id,
-            parent=self.root_ci,
-        )
-        ci_service = CIRelation.objects.filter(
-            # get venture node belongs to, and service venture belongs to.
-            type=CI_RELATION_TYPES.CONTAINS.id,
-            child__child=self.root_ci,
-            parent__type=CI_TYPES.SERVICE.id,
-            child__type=CI_TYPES.VENTURE.id,
-        )
-        self.graph = pygraph.classes.graph.graph()
-        self.graph.add_nodes(CI.objects.values_list('pk', flat=True))
-
-        for relation in ci_contains:
-            parent = relation['parent']
-            child = relation['child']
-            type_ = relation['type']
-            self.add_edge(type_, parent, child)
-
-        for relation in chain(
-            ci_is_part_of,
-            ci_is_required,
-            ci_requires,
-            ci_is_role,
-            ci_has_role,
-            ci_service,
+            self._relations(
+                parents, root, False, CI_RELATION_TYPES.REQUIRES.id,
+            ),
+            self._relations(
+                children, root, True, CI_RELATION_TYPES.REQUIRES.id,
+            ),
+            self._relations(
+                parents, root, False, CI_RELATION_TYPES.HASROLE.id,
+            ),
+            self._relations(
+                children, root, True, CI_RELATION_TYPES.HASROLE.id,
+            ),
+            services,
         ):
-            self.add_edge(relation.type, relation.parent_id, relation.child_id)
-
+            for type_, parent_id, child_id in relations:
+                self.add_edge(type_, parent_id, child_id)
@@ -41,6 +41,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from collections import defaultdict
+import datetime
 import os
 os.environ['DJANGO_SETTINGS_MODULE'] = "ralph.settings"
 
@@ -48,7 +50,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
+from django.db.models import Max, Q
 
 import ralph.discovery.models as db
 import ralph.discovery.models_network as ndb
@@ -56,6 +58,13 @@ import ralph.business.models as bdb
 import ralph.cmdb.models as cdb
 from django.db import IntegrityError
 from lck.django.common import nested_commit_on_success
+from ralph.cmdb.counters import uncount_changes
+from ralph.cmdb.models_signals import buffered_changes, create_changes
+from ralph.cmdb.relation_graph import RelationGraph
+from ralph.util.models import bulk_delete
+
+
+BULK_CHUNK_SIZE = 1000
 
 
 def get_layers_for_ci_type(ci_type_id):
@@ -138,31 +147,235 @@ class CIImporter(object):
         logger.info('Finished.')
         return ret
 
+    def bulk_import_assets_by_contenttype(self, asset_class, type_, layers,
+                                          asset_id=None):
+        """
+        Store the assets as CIs like ``import_assets_by_contenttype`` does,
+        but compare them with the existing CIs in memory, a chunk at a time,
+        and only write the new and the changed ones. Returns the number of
+        stored assets.
+        """
+        logger.info('Importing devices in bulk.')
+        content_type = ContentType.objects.get_for_model(asset_class)
+        uid_prefix = cdb.CIContentTypePrefix.get_prefix_by_object(
+            asset_class, None,
+        )
+        if not uid_prefix:
+            raise TypeError(
+                'Unknown prefix for Content Type %s.%s' % (
+                    content_type.app_label, content_type.model,
+                ),
+            )
+        fields = ['id', 'name']
+        if 'barcode' in asset_class._meta.get_all_field_names():
+            fields.append('barcode')
+        assets = asset_class.objects.order_by('id')
+        if asset_id:
+            assets = assets.filter(id=asset_id)
+        layer_ids = [layer.id for layer in layers or []]
+        count = 0
+        last_id = 0
+        while True:
+            chunk = list(assets.filter(
+                id__gt=last_id,
+            ).values(*fields)[:BULK_CHUNK_SIZE])
+            if not chunk:
+                break
+            last_id = chunk[-1]['id']
+            self.store_assets(
+                asset_class, chunk, content_type, type_, layer_ids,
+                uid_prefix,
+            )
+            count += len(chunk)
+        logger.info('Finished.')
+        return count
+
+    @nested_commit_on_success
+    def store_assets(self, asset_class, assets, content_type, type_,
+                     layer_ids, uid_prefix):
+        """
+        Store a chunk of assets, given as dicts of their ``id``, ``name`` and
+        optional ``barcode``, with a few queries for the whole chunk.
+        """
+        now = datetime.datetime.now()
+        uids = ['%s-%s' % (uid_prefix, asset['id']) for asset in assets]
+        existing = dict(
+            (uid, {'id': ci_id, 'name': name, 'barcode': barcode})
+            for uid, ci_id, name, barcode in cdb.CI.objects.filter(
+                uid__in=uids,
+            ).values_list('uid', 'id', 'name', 'barcode')
+        )
+        new_cis = []
+        changed = {}
+        history = []
+        for uid, asset in zip(uids, assets):
+            name = asset['name']
+            if not name:
+                name = unicode(asset_class.objects.get(id=asset['id']))
+            values = {'name': name}
+            if 'barcode' in asset:
+                values['barcode'] = asset['barcode'] or None
+            ci = existing.get(uid)
+            if ci is None:
+                new_cis.append(cdb.CI(
+                    uid=uid,
+                    content_type=content_type,
+                    object_id=asset['id'],
+                    type_id=type_,
+                    **values
+                ))
+                continue
+            for field, value in values.iteritems():
+                if ci[field] != value:
+                    changed.setdefault(ci['id'], {})[field] = value
+                    history.append(cdb.CIChangeCMDBHistory(
+                        ci_id=ci['id'],
+                        time=now,
+                        field_name=field,
+                        old_value=unicode(ci[field]),
+                        new_value=unicode(value),
+                        comment='Record updated.',
+                    ))
+        for ci_id, values in changed.iteritems():
+            cdb.CI.objects.filter(id=ci_id).update(modified=now, **values)
+        new_ids = []
+        if new_cis:
+            cdb.CI.objects.bulk_create(new_cis)
+            new_uids = dict(cdb.CI.objects.filter(
+                uid__in=[ci.uid for ci in new_cis],
+            ).values_list('uid', 'id'))
+            new_ids = [new_uids[ci.uid] for ci in new_cis]
+            through = cdb.CI.layers.through
+            through.objects.bulk_create([
+                through(ci_id=ci_id, cilayer_id=layer_id)
+                for ci_id in new_ids for layer_id in layer_ids
+            ])
+            for ci_id, ci in zip(new_ids, new_cis):
+                history.append(cdb.CIChangeCMDBHistory(
+                    ci_id=ci_id,
+                    time=now,
+                    field_name='name',
+                    new_value=ci.name,
+                    comment='Record created',
+                ))
+
+            def update(relations):
+                for ci_id in new_ids:
+                    relations.set_ci_type(ci_id, type_)
+            RelationGraph.changed(update)
+        self.store_history(history)
+        if changed or new_ids:
+            db.ChangeFeedEntry.touch_many(cdb.CI, new_ids + changed.keys())
+
+    def store_history(self, history):
+        """
+        Save the ``CIChangeCMDBHistory`` entries in bulk, together with the
+        ``CIChange`` entries which are normally created by their ``post_save``
+        signal. The saved entries are found by their ids, which come after
+        the last id from before the insert.
+        """
+        if not history:
+            return
+        last_id = cdb.CIChangeCMDBHistory.objects.aggregate(
+            last_id=Max('id'),
+        )['last_id'] or 0
+        cdb.CIChangeCMDBHistory.objects.bulk_create(history)
+        create_changes(cdb.CIChangeCMDBHistory.objects.filter(
+            id__gt=last_id,
+            ci__in={entry.ci_id for entry in history},
+        ))
+
     def purge_all_ci(self, content_type=None):
+        """
+        Delete the CIs of the given content types, or all of them, a chunk
+        at a time with everything depending on them.
+        """
         logger.info('Purging CIs')
+        cis = cdb.CI.objects.order_by('id')
         if content_type:
-            for x in cdb.CI.objects.filter(
-                    content_type__in=content_type).all().iterator():
-                        x.delete()
-        else:
-            # very very slow.
-            for x in cdb.CI.objects.all().iterator():
-                x.delete()
+            cis = cis.filter(content_type__in=content_type)
+        last_id = 0
+        while True:
+            ci_ids = list(cis.filter(
+                id__gt=last_id,
+            ).values_list('id', flat=True)[:BULK_CHUNK_SIZE])
+            if not ci_ids:
+                break
+            last_id = ci_ids[-1]
+            self.purge_ci_chunk(ci_ids)
+        RelationGraph.invalidate()
+
+    @nested_commit_on_success
+    def purge_ci_chunk(self, ci_ids):
+        relations = cdb.CIRelation.objects.filter(
+            Q(parent__in=ci_ids) | Q(child__in=ci_ids),
+        )
+        related_ci_ids = set()
+        for parent_id, child_id in relations.values_list(
+            'parent_id', 'child_id',
+        ):
+            related_ci_ids.update((parent_id, child_id))
+        related_ci_ids.difference_update(ci_ids)
+        # each change and its CIChange record are removed together by the
+        # post_delete signals, even if only one of them belongs to the CI
+        changes = cdb.CIChange.objects.filter(ci__in=ci_ids)
+        for change_model in (
+            cdb.CIChangeGit,
+            cdb.CIChangeZabbixTrigger,
+            cdb.CIChangeCMDBHistory,
+            cdb.CIChangePuppet,
+        ):
+            content_type = ContentType.objects.get_for_model(change_model)
+            bulk_delete(change_model, changes.filter(
+                content_type=content_type,
+            ).values_list('object_id', flat=True))
+            orphaned = cdb.CIChange.objects.filter(
+                content_type=content_type,
+                object_id__in=change_model.objects.filter(
+                    ci__in=ci_ids,
+                ).values('id'),
+            )
+            # the counters of the deleted CIs go away with them
+            uncount_changes(orphaned.exclude(ci__in=ci_ids))
+            bulk_delete(cdb.CIChange, orphaned.values_list('id', flat=True))
+        bulk_delete(cdb.CI, ci_ids)
+        db.ChangeFeedEntry.touch_many(cdb.CI, ci_ids, deleted=True)
+        db.ChangeFeedEntry.touch_many(cdb.CI, related_ci_ids)
+
+    def purge_relations(self, relations):
+        """Delete the given relations a chunk at a time."""
+        relations = relations.order_by('id')
+        last_id = 0
+        while True:
+            chunk = list(relations.filter(
+                id__gt=last_id,
+            ).values_list('id', 'parent_id', 'child_id')[:BULK_CHUNK_SIZE])
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            self.purge_relation_chunk(chunk)
+        RelationGraph.invalidate()
+
+    @nested_commit_on_success
+    def purge_relation_chunk(self, relations):
+        bulk_delete(cdb.CIRelation, [
+            relation_id for relation_id, parent_id, child_id in relations
+        ])
+        db.ChangeFeedEntry.touch_many(cdb.CI, {
+            ci_id for relation in relations for ci_id in relation[1:]
+        })
 
     def purge_all_relations(self):
         logger.info('Puring Relations')
-        for x in cdb.CIRelation.objects.all().iterator():
-            x.delete()
+        self.purge_relations(cdb.CIRelation.objects.all())
 
     def purge_system_relations(self):
         logger.info('Purging relations')
-        for x in cdb.CIRelation.objects.filter(readonly=True).iterator():
-            x.delete()
+        self.purge_relations(cdb.CIRelation.objects.filter(readonly=True))
 
     def purge_user_relations(self):
         logger.info('Purging relations')
-        for x in cdb.CIRelation.objects.filter(readonly=False).iterator():
-            x.delete()
+        self.purge_relations(cdb.CIRelation.objects.filter(readonly=False))
 
     def cache_content_types(self):
         self.venture_content_type = ContentType.objects.get(
@@ -194,201 +407,296 @@ class CIImporter(object):
             model='businessline',
         )
 
-    def import_relations(self, content_type, asset_id=None):
-        """ Importing relations parent/child from Ralph """
-        self.cache_content_types()
-        additional_params = {}
-        if asset_id is not None:
-            additional_params['object_id'] = asset_id
-        for ci in cdb.CI.objects.filter(
-            content_type=content_type,
-            **additional_params
-        ).order_by('id'):
-            used_relations = []
-            obj = ci.content_object
-            if content_type == self.network_content_type:
-                self.import_network_relations(
-                    network=ci,
-                    used_relations=used_relations,
-                )
-            elif content_type == self.device_content_type:
-                self.import_device_relations(
-                    obj=obj,
-                    ci=ci,
-                    used_relations=used_relations,
-                )
-            elif content_type == self.venture_content_type:
-                self.import_venture_relations(
-                    obj=obj,
-                    ci=ci,
-                    used_relations=used_relations,
-                )
-            elif content_type == self.venture_role_content_type:
-                self.import_role_relations(
-                    obj=obj,
-                    ci=ci,
-                    used_relations=used_relations,
-                )
-            elif content_type == self.business_line_content_type:
-                # top level Ci without parent relations.
-                pass
-            elif content_type == self.datacenter_content_type:
-                # top level Ci without parent relations.
-                pass
-            elif content_type == self.service_content_type:
-                self.import_service_relations(
-                    obj=obj,
-                    ci=ci,
-                    used_relations=used_relations,
-                )
-            else:
-                raise UnknownCTException(content_type)
-            for relation in cdb.CIRelation.objects.exclude(
-                id__in=used_relations,
-            ).filter(Q(parent=ci) | Q(child=ci)):
-                relation.delete()
-
-    @nested_commit_on_success
-    def import_service_relations(self, obj, ci, used_relations):
-        if obj.business_line:
-            try:
-                bline = cdb.CI.objects.get(
-                    content_type=self.business_line_content_type,
-                    name=obj.business_line,
-                )
-                used_relations.append(_create_or_update_relation(
-                    parent=bline,
-                    child=ci,
-                    relation_type=cdb.CI_RELATION_TYPES.CONTAINS,
-                ).id)
-            except cdb.CI.DoesNotExist:
-                pass
+    def get_relation_rules(self):
+        """
+        Return ``{content type id: (relations, parent_side, related_types)}``
+        describing the relations imported for every content type.
+        ``relations(object_ids)`` returns the ``(object_id, related content
+        type, related object id, relation type)`` tuples of the relations
+        which should exist for the given assets. They go from the related CI
+        to the CI of the asset, or the other way round if ``parent_side`` is
+        set. Any other relation between those CIs and the CIs of the
+        ``related_types`` is removed.
+        """
+        return {
+            self.device_content_type.id: (
+                self.get_device_relations,
+                False,
+                [
+                    self.venture_content_type,
+                    self.venture_role_content_type,
+                    self.device_content_type,
+                ],
+            ),
+            self.venture_content_type.id: (
+                self.get_venture_relations,
+                False,
+                [self.datacenter_content_type, self.venture_content_type],
+            ),
+            self.venture_role_content_type.id: (
+                self.get_role_relations,
+                False,
+                [self.venture_content_type, self.venture_role_content_type],
+            ),
+            self.service_content_type.id: (
+                self.get_service_relations,
+                False,
+                [self.business_line_content_type],
+            ),
+            self.network_content_type.id: (
+                self.get_network_relations,
+                True,
+                [self.device_content_type],
+            ),
+            # top level CIs without parent relations.
+            self.business_line_content_type.id: (lambda ids: [], False, []),
+            self.datacenter_content_type.id: (lambda ids: [], False, []),
+        }
 
-    @nested_commit_on_success
-    def import_venture_relations(self, obj, ci, used_relations):
+    def get_device_relations(self, object_ids):
+        """ Must be called after ventures """
+        relations = []
+        devices = db.Device.admin_objects.filter(id__in=object_ids)
+        for device_id, venture_id, role_id, parent_id in devices.values_list(
+            'id', 'venture_id', 'venture_role_id', 'parent_id',
+        ):
+            if venture_id:
+                relations.append((
+                    device_id, self.venture_content_type, venture_id,
+                    cdb.CI_RELATION_TYPES.CONTAINS.id,
+                ))
+            if role_id:
+                relations.append((
+                    device_id, self.venture_role_content_type, role_id,
+                    cdb.CI_RELATION_TYPES.HASROLE.id,
+                ))
+            if parent_id:
+                relations.append((
+                    device_id, self.device_content_type, parent_id,
+                    cdb.CI_RELATION_TYPES.CONTAINS.id,
+                ))
+        return relations
+
+    def get_venture_relations(self, object_ids):
         """ Must be called after datacenter """
-        if obj.data_center_id:
-            try:
-                datacenter_ci = cdb.CI.objects.filter(
-                    content_type=self.datacenter_content_type,
-                    object_id=obj.data_center_id,
-                )[0]
-                used_relations.append(_create_or_update_relation(
-                    parent=datacenter_ci,
-                    child=ci,
-                    relation_type=cdb.CI_RELATION_TYPES.REQUIRES,
-                ).id)
-            except IndexError:
-                pass
-        if obj.parent:
-            logger.info('Saving relation: %s' % obj)
-            try:
-                used_relations.append(_create_or_update_relation(
-                    parent=cdb.CI.objects.filter(
-                        content_type_id=self.venture_content_type,
-                        object_id=obj.parent.id,
-                    )[0],
-                    child=ci,
-                    relation_type=cdb.CI_RELATION_TYPES.CONTAINS,
-                ).id)
-            except IndexError:
-                pass
-
-    @nested_commit_on_success
-    def import_role_relations(self, obj, ci, used_relations):
-        if obj.venture_id:
-            # first venturerole in hierarchy, connect it to venture
-            try:
-                venture_ci = cdb.CI.objects.get(
-                    content_type=self.venture_content_type,
-                    object_id=obj.venture_id,
-                )
-                used_relations.append(_create_or_update_relation(
-                    parent=venture_ci,
-                    child=ci,
-                    relation_type=cdb.CI_RELATION_TYPES.HASROLE,
-                ).id)
-            except cdb.CI.DoesNotExist:
-                pass
-        if obj.parent:
-            try:
-                used_relations.append(_create_or_update_relation(
-                    parent=cdb.CI.objects.filter(
-                        content_type_id=self.venture_role_content_type,
-                        object_id=obj.parent.id,
-                    )[0],
-                    child=ci,
-                    relation_type=cdb.CI_RELATION_TYPES.CONTAINS,
-                ).id)
-            except IndexError:
-                pass
+        relations = []
+        ventures = bdb.Venture.objects.filter(id__in=object_ids)
+        for venture_id, data_center_id, parent_id in ventures.values_list(
+            'id', 'data_center_id', 'parent_id',
+        ):
+            if data_center_id:
+                relations.append((
+                    venture_id, self.datacenter_content_type, data_center_id,
+                    cdb.CI_RELATION_TYPES.REQUIRES.id,
+                ))
+            if parent_id:
+                relations.append((
+                    venture_id, self.venture_content_type, parent_id,
+                    cdb.CI_RELATION_TYPES.CONTAINS.id,
+                ))
+        return relations
+
+    def get_role_relations(self, object_ids):
+        relations = []
+        for role_id, venture_id, parent_id in bdb.VentureRole.objects.filter(
+            id__in=object_ids,
+        ).values_list('id', 'venture_id', 'parent_id'):
+            if venture_id:
+                relations.append((
+                    role_id, self.venture_content_type, venture_id,
+                    cdb.CI_RELATION_TYPES.HASROLE.id,
+                ))
+            if parent_id:
+                relations.append((
+                    role_id, self.venture_role_content_type, parent_id,
+                    cdb.CI_RELATION_TYPES.CONTAINS.id,
+                ))
+        return relations
+
+    def get_service_relations(self, object_ids):
+        services = bdb.Service.objects.filter(
+            id__in=object_ids,
+        ).exclude(
+            business_line='',
+        ).values_list('id', 'business_line')
+        # business lines are matched by the names of their CIs
+        business_lines = dict(cdb.CI.objects.filter(
+            content_type=self.business_line_content_type,
+            name__in={name for service_id, name in services},
+        ).values_list('name', 'object_id'))
+        return [
+            (
+                service_id, self.business_line_content_type,
+                business_lines[name], cdb.CI_RELATION_TYPES.CONTAINS.id,
+            ) for service_id, name in services if name in business_lines
+        ]
+
+    def get_network_relations(self, object_ids):
+        """
+        Must be called after device_relations!
+        Make relations using network->ipaddresses->device
+        """
+        return [
+            (
+                network_id, self.device_content_type, device_id,
+                cdb.CI_RELATION_TYPES.CONTAINS.id,
+            ) for network_id, device_id in ndb.IPAddress.objects.filter(
+                device__isnull=False,
+                network__in=object_ids,
+            ).values_list('network_id', 'device_id').distinct()
+        ]
 
-    @nested_commit_on_success
-    def import_device_relations(self, obj, ci, used_relations):
-        """ Must be called after ventures """
-        if obj.venture_id:
-            try:
-                venture_ci = cdb.CI.objects.get(
-                    content_type=self.venture_content_type,
-                    object_id=obj.venture_id,
-                )
-                used_relations.append(_create_or_update_relation(
-                    parent=venture_ci,
-                    child=ci,
-                    relation_type=cdb.CI_RELATION_TYPES.CONTAINS,
-                ).id)
-            except cdb.CI.DoesNotExist:
-                pass
-        if obj.venture_role_id:
-            try:
-                venture_role_ci = cdb.CI.objects.get(
-                    content_type=self.venture_role_content_type,
-                    object_id=obj.venture_role_id,
+    def import_relations(self, content_type, asset_id=None):
+        """
+        Import relations parent/child from Ralph. The relations which should
+        exist are computed for a chunk of CIs at a time, compared with the
+        existing ones and only the difference is written.
+        """
+        self.cache_content_types()
+        try:
+            relations, parent_side, related_types = self.get_relation_rules(
+            )[content_type.id]
+        except KeyError:
+            raise UnknownCTException(content_type)
+        model = content_type.model_class()
+        cis = cdb.CI.objects.filter(content_type=content_type).order_by('id')
+        if asset_id is not None:
+            cis = cis.filter(object_id=asset_id)
+        last_id = 0
+        while True:
+            chunk = list(cis.filter(
+                id__gt=last_id,
+            ).values_list('id', 'object_id')[:BULK_CHUNK_SIZE])
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            # skip CIs of assets which don't exist anymore
+            object_ids = set(model._default_manager.filter(
+                id__in=[object_id for ci_id, object_id in chunk],
+            ).values_list('id', flat=True))
+            ci_ids = dict(
+                (object_id, ci_id) for ci_id, object_id in chunk
+                if object_id in object_ids
+            )
+            if ci_ids:
+                self.sync_relations(
+                    ci_ids, relations(object_ids), parent_side,
+                    related_types,
                 )
-                used_relations.append(_create_or_update_relation(
-                    parent=venture_role_ci,
-                    child=ci,
-                    relation_type=cdb.CI_RELATION_TYPES.HASROLE,
-                ).id)
-            except cdb.CI.DoesNotExist:
-                pass
-        if obj.parent:
-            logger.info('Saving relation: %s' % obj)
-            try:
-                used_relations.append(_create_or_update_relation(
-                    parent=cdb.CI.objects.get(
-                        content_type=self.device_content_type,
-                        object_id=obj.parent.id,
-                    ),
-                    child=ci,
-                    relation_type=cdb.CI_RELATION_TYPES.CONTAINS,
-                ).id)
-            except cdb.CI.DoesNotExist:
-                pass
 
     @nested_commit_on_success
-    def import_network_relations(self, network, used_relations):
+    def sync_relations(self, ci_ids, relations, parent_side, related_types):
         """
-        Must be called after device_relations!
-        Make relations using network->ipaddresses->device
+        Make the relations between the CIs of ``ci_ids`` (a dict of
+        ``{object_id: ci_id}``) and the CIs of ``related_types`` match the
+        ``relations`` returned by one of the ``get_*_relations`` methods.
         """
-        for ip in ndb.IPAddress.objects.filter(
-            device__isnull=False,
-            network=network.content_object,
-        ).all():
-            # make relations network->device
-            try:
-                ci_device = cdb.CI.objects.get(
-                    content_type=self.device_content_type,
-                    object_id=ip.device.id,
+        related_ids = defaultdict(set)
+        for object_id, related_type, related_id, type_ in relations:
+            related_ids[related_type].add(related_id)
+        related_cis = {}
+        for related_type, object_ids in related_ids.iteritems():
+            for object_id, ci_id in cdb.CI.objects.filter(
+                content_type=related_type,
+                object_id__in=object_ids,
+            ).values_list('object_id', 'id'):
+                related_cis[related_type.id, object_id] = ci_id
+        desired = set()
+        for object_id, related_type, related_id, type_ in relations:
+            related_ci_id = related_cis.get((related_type.id, related_id))
+            if related_ci_id is None:
+                continue
+            if parent_side:
+                desired.add((ci_ids[object_id], related_ci_id, type_))
+            else:
+                desired.add((related_ci_id, ci_ids[object_id], type_))
+        if parent_side:
+            scope = {
+                'parent__in': ci_ids.values(),
+                'child__content_type__in': related_types,
+            }
+        else:
+            scope = {
+                'child__in': ci_ids.values(),
+                'parent__content_type__in': related_types,
+            }
+        existing = {}
+        if related_types:
+            for relation_id, parent_id, child_id, type_, readonly in (
+                cdb.CIRelation.objects.filter(**scope).values_list(
+                    'id', 'parent_id', 'child_id', 'type', 'readonly',
                 )
-                used_relations.append(_create_or_update_relation(
-                    parent=network,
-                    child=ci_device,
-                    relation_type=cdb.CI_RELATION_TYPES.CONTAINS,
-                ).id)
-            except cdb.CI.DoesNotExist:
-                pass
+            ):
+                existing[parent_id, child_id, type_] = relation_id, readonly
+        # sorted, so the relations are created in the same order every time
+        removed = sorted(
+            relation for relation in existing if relation not in desired
+        )
+        added = sorted(
+            relation for relation in desired if relation not in existing
+        )
+        not_readonly = [
+            relation_id for relation, (relation_id, readonly)
+            in existing.iteritems() if relation in desired and not readonly
+        ]
+        if not_readonly:
+            cdb.CIRelation.objects.filter(
+                id__in=not_readonly,
+            ).update(readonly=True)
+        if removed:
+            # bulk delete, the signals are replaced with the updates below
+            bulk_delete(
+                cdb.CIRelation,
+                [existing[relation][0] for relation in removed],
+            )
+        if added:
+            try:
+                cdb.CIRelation.objects.bulk_create([
+                    cdb.CIRelation(
+                        parent_id=parent_id,
+                        child_id=child_id,
+                        type=type_,
+                        readonly=True,
+                    ) for parent_id, child_id, type_ in added
+                ])
+            except IntegrityError:
+                # created concurrently in the meantime
+                for parent_id, child_id, type_ in added:
+                    _create_or_update_relation(
+                        parent=cdb.CI(id=parent_id),
+                        child=cdb.CI(id=child_id),
+                        relation_type=type_,
+                    )
+            self.store_relations_history(added)
+        if not (added or removed):
+            return
+
+        def update(relation_graph):
+            for relation in removed:
+                relation_graph.remove_relation(*relation)
+            for relation in added:
+                relation_graph.add_relation(*relation)
+        RelationGraph.changed(update)
+        db.ChangeFeedEntry.touch_many(cdb.CI, {
+            ci_id for relation in added + removed for ci_id in relation[:2]
+        })
+
+    def store_relations_history(self, relations):
+        """Add a history entry to the parent CI of every new relation."""
+        now = datetime.datetime.now()
+        names = dict(cdb.CI.objects.filter(
+            id__in={child_id for parent_id, child_id, type_ in relations},
+        ).values_list('id', 'name'))
+        self.store_history([
+            cdb.CIChangeCMDBHistory(
+                ci_id=parent_id,
+                time=now,
+                field_name='child',
+                old_value='None',
+                new_value=names.get(child_id, ''),
+                comment='Record created',
+            ) for parent_id, child_id, type_ in relations
+        ])
 
     def import_single_object_relations(self, content_object):
         """Facade for single Asset"""
@@ -402,8 +710,12 @@ class CIImporter(object):
         object_id = content_object.id
         return self.import_all_ci([ct], asset_id=object_id)
 
-    def import_all_ci(self, content_types, asset_id=None):
-        ret = []
+    def import_all_ci(self, content_types, asset_id=None, bulk=False):
+        """
+        Import the assets of the given content types as CIs. Returns the list
+        of stored CIs, or only their number in the ``bulk`` mode.
+        """
+        ret = 0 if bulk else []
         content_to_import = {
             db.Device: cdb.CI_TYPES.DEVICE.id,
             bdb.Venture: cdb.CI_TYPES.VENTURE.id,
@@ -420,9 +732,15 @@ class CIImporter(object):
             logger.info('Importing content type : %s' % assetContentType)
             type_ = content_to_import[assetClass]
             layers = get_layers_for_ci_type(type_)
-            ret.extend(self.import_assets_by_contenttype(
-                assetClass, type_, layers, asset_id)
-            )
+            if bulk:
+                ret += self.bulk_import_assets_by_contenttype(
+                    assetClass, type_, layers, asset_id,
+                )
+            else:
+                with buffered_changes():
+                    ret.extend(self.import_assets_by_contenttype(
+                        assetClass, type_, layers, asset_id)
+                    )
         return ret
 
     def update_single_object(self, ci, instance):
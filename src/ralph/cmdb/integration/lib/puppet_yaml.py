@@ -1,30 +1,69 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+"""Puppet reports in YAML.
+
+`parse_report` reads a report from the stream of YAML events, using the
+libyaml C parser when it's available. Only the fields we store are
+constructed; the other sections of the report (`resource_statuses`,
+`metrics`) are skipped event by event, without building any objects, which
+makes it much faster than loading the whole document with `load`.
+
+Puppet anchors repeated values (``&id002``) wherever they first appear,
+often inside the skipped sections, and refers to them later (``*id002``).
+The anchored scalars are remembered while skipping, so these aliases are
+resolved. An alias to anything else makes `parse_report` fall back to
+`load`.
+"""
+
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
 import yaml
+from yaml.events import (
+    AliasEvent,
+    CollectionEndEvent,
+    CollectionStartEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    SequenceStartEvent,
+)
+from yaml.nodes import ScalarNode
+
+
+try:
+    BaseLoader = yaml.CBaseLoader
+except AttributeError:
+    BaseLoader = yaml.BaseLoader
+
+REPORT_FIELDS = {'configuration_version', 'host', 'kind', 'status', 'time'}
+LOG_FIELDS = {'level', 'message', 'source', 'tags', 'time'}
+
 
 class PuppetReport(yaml.YAMLObject):
-  yaml_tag = u'!ruby/object:Puppet::Transaction::Report'
-  def __init__(self, host, logs, metrics, records, time, resource_statuses):
-    self.host = host
-    self.logs = logs
-    self.metrics = metrics
-    self.resource_statuses = resource_statuses
-    self.records = records
-    self.time = time
+    yaml_tag = u'!ruby/object:Puppet::Transaction::Report'
+
+    def __init__(self, host, logs, metrics, records, time, resource_statuses):
+        self.host = host
+        self.logs = logs
+        self.metrics = metrics
+        self.resource_statuses = resource_statuses
+        self.records = records
+        self.time = time
+
 
 class PuppetResourceStatus(yaml.YAMLObject):
-    yaml_tag=u'!ruby/object:Puppet::Resource::Status'
+    yaml_tag = u'!ruby/object:Puppet::Resource::Status'
+
     def __init__(self, *args, **kwargs):
         pass
 
+
 class PuppetLog(yaml.YAMLObject):
     yaml_tag = u'!ruby/object:Puppet::Util::Log'
+
     def __init__(self, source, message, tags, time, level):
         self.source = source
         self.message = message
@@ -32,26 +71,209 @@ class PuppetLog(yaml.YAMLObject):
         self.time = time
         self.level = level
 
+
 class PuppetMetric(yaml.YAMLObject):
     yaml_tag = u'!ruby/object:Puppet::Util::Metric'
+
     def __init__(self, values, name, label):
         self.values = values
         self.name = name
         self.label = label
 
+
 class PuppetTransactionEvent(yaml.YAMLObject):
-    yaml_tag=u"!ruby/object:Puppet::Transaction::Event"
+    yaml_tag = u"!ruby/object:Puppet::Transaction::Event"
+
 
 def construct_ruby_object(loader, suffix, node):
     return loader.construct_yaml_map(node)
 
+
 def construct_ruby_sym(loader, node):
     return loader.construct_yaml_str(node)
 
+
 def load(contents):
-    #example
+    """Load the whole report, with all of its sections."""
     yaml.add_multi_constructor(u"!ruby/object:", construct_ruby_object)
     yaml.add_constructor(u"!ruby/sym", construct_ruby_sym)
-    stream = contents
-    mydata = yaml.load(stream)
-    return mydata
+    return yaml.load(contents)
+
+
+class _ScalarConstructor(yaml.constructor.SafeConstructor,
+                         yaml.resolver.Resolver):
+    """Builds the values of scalars the same way `load` does."""
+
+    def construct_scalar_event(self, event):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = self.resolve(ScalarNode, event.value, event.implicit)
+        elif not tag.startswith('tag:yaml.org,2002:'):
+            # `!ruby/sym` and the like are plain strings for us
+            tag = 'tag:yaml.org,2002:str'
+        node = ScalarNode(tag, event.value, style=event.style)
+        constructor = self.yaml_constructors.get(
+            tag,
+            self.yaml_constructors[None],
+        )
+        return constructor(self, node)
+
+
+_scalars = _ScalarConstructor()
+
+
+class _UnresolvedAlias(Exception):
+    """An alias to a node which wasn't a scalar."""
+
+
+class _EventStream(object):
+    """Iterate over YAML events, remembering the anchored scalars."""
+
+    def __init__(self, events):
+        self.events = iter(events)
+        self.anchors = {}
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        event = next(self.events)
+        if isinstance(event, ScalarEvent) and event.anchor is not None:
+            self.anchors[event.anchor] = event
+        return event
+
+    def alias_value(self, event):
+        try:
+            anchored = self.anchors[event.anchor]
+        except KeyError:
+            raise _UnresolvedAlias(event.anchor)
+        return _scalars.construct_scalar_event(anchored)
+
+
+def _make(cls, fields):
+    """Create `cls` without calling its ``__init__``, like `load` does."""
+    instance = cls.__new__(cls)
+    for name, value in fields.iteritems():
+        setattr(instance, name, value)
+    return instance
+
+
+def _skip(events, event):
+    """Skip the node which starts with `event`."""
+    if not isinstance(event, CollectionStartEvent):
+        return
+    depth = 1
+    for event in events:
+        if isinstance(event, CollectionStartEvent):
+            depth += 1
+        elif isinstance(event, CollectionEndEvent):
+            depth -= 1
+            if not depth:
+                return
+
+
+def _read_value(events, event):
+    """
+    Return the value of a scalar, or the list of scalar values of
+    a sequence. Aliases are resolved with `events`. Other nodes are skipped
+    and read as None.
+    """
+    if isinstance(event, ScalarEvent):
+        return _scalars.construct_scalar_event(event)
+    if isinstance(event, AliasEvent):
+        return events.alias_value(event)
+    if isinstance(event, SequenceStartEvent):
+        values = []
+        for event in events:
+            if isinstance(event, CollectionEndEvent):
+                return values
+            if isinstance(event, ScalarEvent):
+                values.append(_scalars.construct_scalar_event(event))
+            elif isinstance(event, AliasEvent):
+                values.append(events.alias_value(event))
+            else:
+                _skip(events, event)
+    _skip(events, event)
+    return None
+
+
+def _read_mapping(events, fields, read_field=None):
+    """
+    Read the mapping which has just started, returning a dict of the
+    `fields` values. `read_field(events, key, event, values)` can read
+    the fields which aren't simple values, returning True when it did.
+    The rest of the mapping is skipped.
+    """
+    values = {}
+    for event in events:
+        if isinstance(event, CollectionEndEvent):
+            return values
+        if isinstance(event, ScalarEvent):
+            key = event.value
+        else:
+            key = None
+            _skip(events, event)
+        event = next(events)
+        if read_field and read_field(events, key, event, values):
+            continue
+        if key in fields:
+            values[key] = _read_value(events, event)
+        else:
+            _skip(events, event)
+    return values
+
+
+def _read_logs(events, event):
+    logs = []
+    if isinstance(event, AliasEvent):
+        raise _UnresolvedAlias(event.anchor)
+    if not isinstance(event, SequenceStartEvent):
+        _skip(events, event)
+        return logs
+    for event in events:
+        if isinstance(event, CollectionEndEvent):
+            break
+        if isinstance(event, MappingStartEvent):
+            logs.append(_make(PuppetLog, _read_mapping(events, LOG_FIELDS)))
+        elif isinstance(event, AliasEvent):
+            # only the scalars are remembered, the log needs the full load
+            raise _UnresolvedAlias(event.anchor)
+        else:
+            _skip(events, event)
+    return logs
+
+
+def _read_report_field(events, key, event, values):
+    if key != 'logs':
+        return False
+    values['logs'] = _read_logs(events, event)
+    return True
+
+
+def parse_report(contents):
+    """
+    Read the host, status, kind, configuration version, time and logs of
+    a report, skipping everything else. Returns a `PuppetReport` with
+    the fields which were found in the report, or None if the document isn't
+    a mapping.
+    """
+    try:
+        return _parse_report(contents)
+    except _UnresolvedAlias:
+        return load(contents)
+
+
+def _parse_report(contents):
+    events = _EventStream(yaml.parse(contents, Loader=BaseLoader))
+    for event in events:
+        if isinstance(event, (MappingStartEvent, SequenceStartEvent,
+                              ScalarEvent, AliasEvent)):
+            break
+    else:
+        return None
+    if not isinstance(event, MappingStartEvent):
+        return None
+    return _make(
+        PuppetReport,
+        _read_mapping(events, REPORT_FIELDS, _read_report_field),
+    )
@@ -9,20 +9,29 @@ from __future__ import unicode_literals
 import logging
 import re
 
+from django.conf import settings
+import django_rq
 from restkit.errors import Unauthorized
 
 from ralph.business.models import Venture
 from ralph.util import plugin
 from ralph.cmdb.integration.lib.fisheye import Fisheye
-from ralph.cmdb.integration.lib.puppet_yaml import load
+from ralph.cmdb.integration.lib.puppet_yaml import parse_report
 from ralph.cmdb import models as db
 from ralph.cmdb.integration.base import BaseImporter
 from ralph.cmdb.integration.util import strip_timezone
+from ralph.cmdb.models_signals import buffered_changes
+from ralph.cmdb.path_mappings import PathMatcher
 
 from lck.django.common import nested_commit_on_success
 
 logger = logging.getLogger(__name__)
 
+PUPPET_QUEUE = 'cmdb_puppet'
+VENTURE_PATH_RE = re.compile(
+    r'modules/ventures/([^\/]+)/(?:files|manifests)/(.*)',
+)
+
 
 class PuppetAgentsImporter(BaseImporter):
     """Every Puppet host after applying configurations sends yaml textfile report to
@@ -36,12 +45,14 @@ class PuppetAgentsImporter(BaseImporter):
     def import_contents(self, contents):
         if not contents:
             raise UserWarning('No content to import!')
-        yaml = load(contents)
+        yaml = parse_report(contents)
         try:
             host = yaml.host
             status = yaml.status
         except AttributeError:
-            logger.warning("Incorrect report from %s, skipped!" % host)
+            logger.warning("Incorrect report from %s, skipped!" % getattr(
+                yaml, 'host', None,
+            ))
             return
         if status == 'unchanged':
             # skip it, we import only changed/failed
@@ -55,35 +66,51 @@ class PuppetAgentsImporter(BaseImporter):
         ).exists():
             # skip importing another copy report of the same host/config version
             return
+        self.save_report(yaml, status)
+
+    @nested_commit_on_success
+    def save_report(self, yaml, status):
         report = db.CIChangePuppet()
         report.configuration_version = yaml.configuration_version or ''
         report.host = yaml.host
         report.kind = yaml.kind
         report.time = yaml.time
-        report.ci = self.get_ci_by_name(host)
+        report.ci = self.get_ci_by_name(yaml.host)
         report.status = status
         report.save()
         if status == 'changed' or status == 'failed':
-            for log in yaml.logs:
-                level = log.level
-                message = log.message
-                time = log.time
-                title = status.title
-                dblog = db.PuppetLog()
-                dblog.cichange = report
-                dblog.source = log.source
-                dblog.message = message[:1024]
-                dblog.time = time
-                dblog.level = level
-                dblog.save()
-                logger.debug('-' * 40)
-                logger.debug('''
-title=%s
-host=%s
-status=%s
-level=%s
-message=%s
-time=%s''' % (title(), host, status, level, message, time))
+            db.PuppetLog.objects.bulk_create([
+                db.PuppetLog(
+                    cichange=report,
+                    source=log.source,
+                    message=log.message[:1024],
+                    time=log.time,
+                    level=log.level,
+                ) for log in yaml.logs
+            ])
+            logger.debug('Saved %d log entries of %s (%s)' % (
+                len(yaml.logs), yaml.host, status,
+            ))
+
+
+def import_puppet_report(contents):
+    """The worker job importing a report queued by `enqueue_puppet_report`."""
+    PuppetAgentsImporter().import_contents(contents)
+
+
+def enqueue_puppet_report(contents):
+    """
+    Queue a raw puppet report for importing by the workers of the
+    ``cmdb_puppet`` queue, so that the puppet master doesn't wait for it.
+    """
+    queue = django_rq.get_queue(
+        name=PUPPET_QUEUE if PUPPET_QUEUE in settings.RQ_QUEUES else 'default',
+    )
+    queue.enqueue_call(
+        func=import_puppet_report,
+        args=(contents,),
+        result_ttl=0,
+    )
 
 
 class PuppetGitImporter(BaseImporter):
@@ -93,6 +120,9 @@ class PuppetGitImporter(BaseImporter):
     """
     def __init__(self, fisheye_class=Fisheye):
         self.fisheye = fisheye_class()
+        # CIs found during this import, by id and by venture and role
+        self._cis = {}
+        self._venture_role_cis = {}
 
     @staticmethod
     @plugin.register(chain='cmdb_git')
@@ -145,11 +175,12 @@ class PuppetGitImporter(BaseImporter):
         except Unauthorized as e:
             logger.warning(str(e))
             return
-        for changeset in ret.getchildren():
-            if not self.is_imported(changeset):
-                self.import_changeset(changeset)
-            else:
-                self.reconcilate(changeset)
+        with buffered_changes():
+            for changeset in ret.getchildren():
+                if not self.is_imported(changeset):
+                    self.import_changeset(changeset)
+                else:
+                    self.reconcilate(changeset)
 
     def find_venture(self, name):
         """Returns first venture ci with given `name`"""
@@ -169,6 +200,15 @@ class PuppetGitImporter(BaseImporter):
             return relation.child
 
     def find_ci_by_venturerole(self, role):
+        try:
+            return self._venture_role_cis[role]
+        except KeyError:
+            pass
+        ci = self._find_ci_by_venturerole(role)
+        self._venture_role_cis[role] = ci
+        return ci
+
+    def _find_ci_by_venturerole(self, role):
         venture = role[0]
         role = role[1]
         v = self.find_venture(venture)
@@ -189,28 +229,21 @@ class PuppetGitImporter(BaseImporter):
 
     def get_ci_by_path_mapping(self, path):
         """Return first successfull ci mapped to this path"""
-        for mapping in db.GitPathMapping.objects.all():
-            if mapping.is_regex:
-                compiled = re.compile(mapping.path)
-                if compiled.match(path):
-                    return mapping.ci
-            else:
-                if path in mapping.path:
-                    return mapping.ci
+        ci_id = PathMatcher.get().match(path)
+        if ci_id is None:
+            return None
+        if ci_id not in self._cis:
+            try:
+                self._cis[ci_id] = db.CI.objects.get(id=ci_id)
+            except db.CI.DoesNotExist:
+                self._cis[ci_id] = None
+        return self._cis[ci_id]
 
     def get_ci_by_path(self, paths):
-        ventures_1 = re.compile('modules/ventures/([^\/]+)/files/(.*)')
-        ventures_2 = re.compile('modules/ventures/([^\/]+)/manifests/(.*)')
         for path in paths:
-            groups = None
-            if ventures_1.match(path):
-                groups = ventures_1.match(path).groups()
-                ci = self.find_ci_by_venturerole(groups)
-                if ci:
-                    return ci
-            elif ventures_2.match(path):
-                groups = ventures_2.match(path).groups()
-                ci = self.find_ci_by_venturerole(groups)
+            match = VENTURE_PATH_RE.match(path)
+            if match:
+                ci = self.find_ci_by_venturerole(match.groups())
                 if ci:
                     return ci
             else:
@@ -7,11 +7,13 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import time
 from optparse import make_option
 
 from django.core.management.base import BaseCommand
 
 from ralph.cmdb.archiver import (
+    WINDOW_SIZE,
     run_cichange_git_archivization,
     run_cichange_zabbix_archivization,
     run_cichange_cmdb_history_archivization,
@@ -46,6 +48,28 @@ class Command(BaseCommand):
             type='choice',
             choices=ACTIONS_TYPES_MAPPER.keys(),
         ),
+        make_option(
+            '--window-size',
+            dest='window-size',
+            default=WINDOW_SIZE,
+            help='Number of consecutive change ids moved in one transaction.',
+            type='int',
+        ),
+        make_option(
+            '--pause',
+            dest='pause',
+            default=0,
+            help='Seconds to wait between the transactions.',
+            type='float',
+        ),
+        make_option(
+            '--repeat-every',
+            dest='repeat-every',
+            default=0,
+            help='Keep archiving, starting again every given number of '
+                 'seconds.',
+            type='int',
+        ),
     )
 
     def handle(self, *args, **options):
@@ -58,5 +82,17 @@ class Command(BaseCommand):
                 ),
             )
             return
-        older_than = datetime.datetime.now() - datetime.timedelta(days=days)
-        ACTIONS_TYPES_MAPPER[action_type](older_than)
+        repeat_every = options.get('repeat-every')
+        while True:
+            started = time.time()
+            older_than = datetime.datetime.now() - datetime.timedelta(
+                days=days,
+            )
+            ACTIONS_TYPES_MAPPER[action_type](
+                older_than,
+                window_size=options.get('window-size'),
+                pause=options.get('pause'),
+            )
+            if not repeat_every:
+                break
+            time.sleep(max(0, started + repeat_every - time.time()))
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from ralph.cmdb.archiver import fill_month_buckets
+from ralph.cmdb.counters import rebuild_counts
+from ralph.cmdb.models import CIChange
+
+
+class Command(BaseCommand):
+    help = (
+        'Count the CMDB changes, problems and incidents per CI and month '
+        'again, for the dashboard and the reports.'
+    )
+
+    def handle(self, *args, **options):
+        fill_month_buckets(CIChange)
+        rebuild_counts()
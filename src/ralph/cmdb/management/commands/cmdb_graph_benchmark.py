@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import random
+import resource
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ralph.util.graph import (
+    Graph,
+    breadth_first_search,
+    depth_first_search,
+    find_cycle,
+    strongly_connected_components,
+)
+
+
+class Command(BaseCommand):
+    help = ('Measure the time and memory taken by the CMDB graph routines '
+            'on a random graph of the size of a large CMDB.')
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--nodes',
+            dest='nodes',
+            default=200000,
+            help='Number of CIs in the graph.',
+            type='int',
+        ),
+        make_option(
+            '--edges',
+            dest='edges',
+            default=1000000,
+            help='Number of relations in the graph.',
+            type='int',
+        ),
+        make_option(
+            '--seed',
+            dest='seed',
+            default=0,
+            help='Seed of the random graph.',
+            type='int',
+        ),
+    )
+
+    def measure(self, name, func, *args):
+        start = time.time()
+        result = func(*args)
+        # ru_maxrss is in kilobytes on Linux
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print('%-32s %8.2f s %8.0f MiB' % (name, time.time() - start, memory))
+        return result
+
+    def handle(self, *args, **options):
+        nodes = options['nodes']
+        edges = options['edges']
+        rng = random.Random(options['seed'])
+
+        def random_edges():
+            for _ in xrange(edges):
+                # mostly from the lower to the higher ids, like the CMDB
+                # hierarchy, with a few edges closing cycles
+                parent = rng.randrange(nodes - 1)
+                child = rng.randrange(parent + 1, nodes)
+                if rng.random() < 0.001:
+                    parent, child = child, parent
+                yield parent, child, rng.randrange(1, 4)
+        graph = self.measure('build', Graph, random_edges())
+        self.measure(
+            'breadth first search', breadth_first_search, 0, graph.targets,
+        )
+        self.measure(
+            'depth first search', depth_first_search, xrange(nodes),
+            graph.targets,
+        )
+        cycle = self.measure(
+            'find cycle', find_cycle, xrange(nodes), graph.targets,
+        )
+        components = self.measure(
+            'strongly connected components', strongly_connected_components,
+            xrange(nodes), graph.targets,
+        )
+        for _ in xrange(1000):
+            parent = rng.randrange(nodes)
+            graph.add_edge(parent, rng.randrange(nodes), 1)
+        self.measure('compact', graph.compact)
+        print('cycle length: %d, components: %d' % (
+            len(cycle), len(components),
+        ))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ralph.cmdb.archiver import WINDOW_SIZE, run_month_roll
+
+
+class Command(BaseCommand):
+    help = (
+        'Roll the monthly buckets of the CMDB changes: fill in the missing '
+        'buckets and archive the months which are no longer kept.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--number-of-months-to-keep',
+            dest='number-of-months-to-keep',
+            default=False,
+            help='Specify number of months to keep, including the current '
+                 'one.',
+            type='int',
+        ),
+        make_option(
+            '--window-size',
+            dest='window-size',
+            default=WINDOW_SIZE,
+            help='Number of consecutive change ids moved in one transaction.',
+            type='int',
+        ),
+        make_option(
+            '--pause',
+            dest='pause',
+            default=0,
+            help='Seconds to wait between the transactions.',
+            type='float',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        months = options.get('number-of-months-to-keep')
+        if not months or months < 1:
+            print(
+                'You must specify a positive number of months to keep. '
+                'Use the --number-of-months-to-keep option.'
+            )
+            return
+        run_month_roll(
+            months,
+            window_size=options.get('window-size'),
+            pause=options.get('pause'),
+        )
@@ -55,7 +55,11 @@ class Command(BaseCommand):
                 '--content-types', dest='content_types',
                 help="Type of content to reimport.",
                 default=[],
-            )
+            ),
+            make_option(
+                '--bulk', dest='bulk', action='store_true', default=False,
+                help="Import CIs in chunks, writing only the changed ones.",
+            ),
         ])
 
     def handle(self, *args, **options):
@@ -100,7 +104,11 @@ class Command(BaseCommand):
                 cimp.purge_system_relations()
         elif options.get('action') == 'import':
             if options.get('kind') == 'ci':
-                cimp.import_all_ci(content_types_to_import, id_to_import)
+                cimp.import_all_ci(
+                    content_types_to_import,
+                    id_to_import,
+                    bulk=options.get('bulk'),
+                )
             elif options.get('kind') == 'all-relations':
                 for content_type in content_types_to_import:
                     cimp.import_relations(content_type, id_to_import)
@@ -40,9 +40,12 @@ from ralph.cmdb.models_changes import (
     CI_CHANGE_TYPES,
     CI_CHANGE_PRIORITY_TYPES,
     CI_CHANGE_REGISTRATION_TYPES,
+    CI_EVENT_TYPES,
 
     # change management types
     CIChange,
+    CIChangeCount,
+    CIEventCount,
     CIChangeZabbixTrigger,
     CIChangeCMDBHistory,
     CIChangeGit,
@@ -63,6 +66,8 @@ from ralph.cmdb.models_changes import (
     ArchivedCIChangeGit,
     ArchivedCIChangePuppet,
     ArchivedPuppetLog,
+    ArchivizationCheckpoint,
+    month_bucket,
 )
 
 from ralph.cmdb.models_audits import (
@@ -80,6 +85,7 @@ __all__ = [
     'CI_CHANGE_PRIORITY_TYPES',
     'CI_TYPES',
     'CI_CHANGE_REGISTRATION_TYPES',
+    'CI_EVENT_TYPES',
 
     # base types
     'CI',
@@ -100,6 +106,8 @@ __all__ = [
 
     # change management types
     'CIChange',
+    'CIChangeCount',
+    'CIEventCount',
     'CIChangeZabbixTrigger',
     'CIChangeCMDBHistory',
     'CIChangeGit',
@@ -123,6 +131,8 @@ __all__ = [
     'ArchivedCIChangeGit',
     'ArchivedCIChangePuppet',
     'ArchivedPuppetLog',
+    'ArchivizationCheckpoint',
+    'month_bucket',
 ]
 
 # hook signals, don't remove this.
@@ -14,6 +14,48 @@ from django.utils.translation import ugettext_lazy as _
 
 from lck.django.common.models import TimeTrackable
 from lck.django.choices import Choices
+from south.modelsinspector import add_introspection_rules
+
+
+def month_bucket(value):
+    """
+    Return the month of a date as a ``YYYYMM`` number. The date can also be
+    a string, as some integrations store the dates they get as text.
+    """
+    if isinstance(value, basestring):
+        value = models.DateTimeField().to_python(value)
+    return value.year * 100 + value.month
+
+
+class MonthBucketField(models.PositiveIntegerField):
+    """
+    The ``YYYYMM`` month of the date in the `source` field, filled in on
+    every save (including ``bulk_create``). The change tables are bucketed
+    by it, so that the queries limited in time and the archivization only
+    look at the index entries of the relevant months.
+    """
+
+    def __init__(self, source, *args, **kwargs):
+        self.source = source
+        kwargs.setdefault('null', True)
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('editable', False)
+        kwargs.setdefault('db_index', True)
+        super(MonthBucketField, self).__init__(*args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        value = model_instance._meta.get_field(self.source).to_python(
+            getattr(model_instance, self.source),
+        )
+        bucket = month_bucket(value) if value else None
+        setattr(model_instance, self.attname, bucket)
+        return bucket
+
+
+add_introspection_rules(
+    [([MonthBucketField], [], {'source': ['source', {}]})],
+    [r'^ralph\.cmdb\.models_changes\.MonthBucketField'],
+)
 
 
 class CI_CHANGE_TYPES(Choices):
@@ -37,6 +79,13 @@ class CI_CHANGE_PRIORITY_TYPES(Choices):
     CRITICAL = _('Critical')
 
 
+class CI_EVENT_TYPES(Choices):
+    _ = Choices.Choice
+
+    PROBLEM = _('Problem')
+    INCIDENT = _('Incident')
+
+
 class CI_CHANGE_REGISTRATION_TYPES(Choices):
     _ = Choices.Choice
 
@@ -63,6 +112,7 @@ class AbstractCIChangeZabbixTrigger(AbstractBaseCIChange):
     description = models.CharField(max_length=1024)
     lastchange = models.CharField(max_length=1024)
     comments = models.CharField(max_length=1024)
+    month = MonthBucketField('created', verbose_name=_("month"))
 
     class Meta:
         abstract = True
@@ -141,6 +191,7 @@ class AbstractCIChange(AbstractBaseCIChange):
         choices=CI_CHANGE_REGISTRATION_TYPES(),
         default=CI_CHANGE_REGISTRATION_TYPES.NOT_REGISTERED.id,
     )
+    month = MonthBucketField('time', verbose_name=_("month"))
 
     class Meta:
         abstract = True
@@ -197,6 +248,7 @@ class AbstractCIChangePuppet(AbstractBaseCIChange):
         default=datetime.now,
     )
     status = models.CharField(max_length=30)
+    month = MonthBucketField('time', verbose_name=_("month"))
 
     class Meta:
         abstract = True
@@ -216,6 +268,7 @@ class AbstractPuppetLog(TimeTrackable):
     tags = models.CharField(max_length=100)
     time = models.DateTimeField()
     level = models.CharField(max_length=100)
+    month = MonthBucketField('time', verbose_name=_("month"))
 
     class Meta:
         abstract = True
@@ -261,3 +314,57 @@ class CIIncident(CIEvent):
 
 class JiraChanges(CIEvent):
     pass
+
+
+class ArchivizationCheckpoint(TimeTrackable):
+    """
+    Progress of moving the changes of one type to the archive, so that the
+    archivization can be interrupted and resumed. All the changes with ids
+    up to ``start_id`` are archived or were too recent for the last run. An
+    unfinished run has its ``older_than`` set and has moved everything up to
+    ``last_id``.
+    """
+    change_type = models.IntegerField(
+        choices=CI_CHANGE_TYPES(),
+        unique=True,
+    )
+    start_id = models.PositiveIntegerField(default=0)
+    last_id = models.PositiveIntegerField(default=0)
+    older_than = models.DateTimeField(null=True, blank=True, default=None)
+
+    def __unicode__(self):
+        return '%s: %d' % (self.get_change_type_display(), self.last_id)
+
+
+class CIChangeCount(models.Model):
+    """
+    The number of the ``CIChange`` entries of a CI with the given type and
+    priority in a month. Kept up to date as the changes are created, deleted
+    and archived, so that the dashboard and the reports read these counters
+    instead of counting the changes.
+    """
+    ci = models.ForeignKey('CI', related_name='change_counts')
+    type = models.IntegerField(max_length=11, choices=CI_CHANGE_TYPES())
+    priority = models.IntegerField(
+        max_length=11,
+        choices=CI_CHANGE_PRIORITY_TYPES(),
+    )
+    month = models.PositiveIntegerField(verbose_name=_("month"))
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('ci', 'type', 'priority', 'month')
+
+
+class CIEventCount(models.Model):
+    """
+    The number of the problems or incidents of a CI created in a month, kept
+    up to date like ``CIChangeCount``.
+    """
+    ci = models.ForeignKey('CI', related_name='event_counts')
+    type = models.IntegerField(max_length=11, choices=CI_EVENT_TYPES())
+    month = models.PositiveIntegerField(verbose_name=_("month"))
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('ci', 'type', 'month')
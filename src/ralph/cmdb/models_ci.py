@@ -19,8 +19,9 @@ from lck.django.common.models import (
     WithConcurrentGetOrCreate,
 )
 from lck.django.choices import Choices
-from pygraph.classes.digraph import digraph
-from pygraph.algorithms.cycles import find_cycle
+
+from ralph.cmdb.relation_graph import RelationGraph
+from ralph.util.graph import Graph, find_cycle
 
 
 class CI_RELATION_TYPES(Choices):
@@ -186,6 +187,20 @@ class CIRelation(TimeTrackable, WithConcurrentGetOrCreate):
         validation_msg = 'CI can not have relation with himself'
         if self.parent == self.child:
             raise ValidationError(validation_msg)
+        cycle = RelationGraph.find_cycle(
+            self.parent_id,
+            self.child_id,
+            self.type,
+        )
+        if cycle:
+            names = dict(CI.objects.filter(
+                id__in=cycle,
+            ).values_list('id', 'name'))
+            raise ValidationError(
+                'This relation would create a cycle: {}'.format(' -> '.join(
+                    names.get(ci_id, '') for ci_id in [self.parent_id] + cycle
+                )),
+            )
 
     def save(self, user=None, *args, **kwargs):
         self.saving_user = user
@@ -372,20 +387,17 @@ class CI(TimeTrackable):
 
     @classmethod
     def get_cycle(cls):
-        allci = CI.objects.all().values('pk')
-        relations = CIRelation.objects.all().values('parent_id', 'child_id')
-        cis = [x['pk'] for x in allci]
-        rel = [(x['parent_id'], x['child_id']) for x in relations]
-        cycle = cls.has_cycle(cis, rel)
-        return cycle
+        cis = CI.objects.order_by('id').values_list('id', flat=True)
+        relations = CIRelation.objects.order_by('id').values_list(
+            'parent_id',
+            'child_id',
+        )
+        return cls.has_cycle(cis.iterator(), relations.iterator())
 
     @classmethod
     def has_cycle(cls, nodes, edges):
-        gr = digraph()
-        gr.add_nodes(nodes)
-        for edge in edges:
-            gr.add_edge(edge)
-        return find_cycle(gr)
+        graph = Graph((parent, child, 0) for parent, child in edges)
+        return find_cycle(nodes, graph.targets)
 
     @classmethod
     def get_by_content_object(self, content_object):
@@ -6,12 +6,16 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
+import contextlib
 import datetime
 import logging
 import re
+import threading
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.signals import request_finished
 from django.dispatch import receiver
 from django.db.models.signals import post_delete, post_save, pre_delete
 from django.db import IntegrityError
@@ -21,10 +25,18 @@ import django_rq
 # using models_ci not models, for dependency chain.
 from ralph.cmdb import models_ci as cdb
 from ralph.cmdb import models_changes as chdb
+from ralph.cmdb import counters
 from ralph.cmdb.integration.splunk import log_change_to_splunk
 from ralph.cmdb.integration.issuetracker import IssueTracker
 from ralph.cmdb.integration.exceptions import IssueTrackerException
-from ralph.discovery.models import Device, DataCenter, Network
+from ralph.cmdb.path_mappings import PathMatcher
+from ralph.cmdb.relation_graph import RelationGraph
+from ralph.discovery.models import (
+    ChangeFeedEntry,
+    DataCenter,
+    Device,
+    Network,
+)
 from ralph.business.models import Venture, VentureRole, Service, BusinessLine
 
 
@@ -32,7 +44,11 @@ SPLUNK_HOST = settings.SPLUNK_LOGGER_HOST
 logger = logging.getLogger(__name__)
 
 user_match = re.compile(r".*\<(.*)@.*\>")
-register_issue_signal = django.dispatch.Signal(providing_args=["change_id"])
+register_issue_signal = django.dispatch.Signal(
+    providing_args=["change_id", "change"],
+)
+# number of buffered change records classified together
+CHANGE_BATCH_SIZE = 500
 
 CHANGE_LINK = '%s'
 OP_TEMPLATE = None
@@ -99,6 +115,140 @@ def change_delete_post_save(sender, instance, **kwargs):
         pass
 
 
+def classify_change(instance):
+    """Return a new, unsaved ``CIChange`` for a saved change record."""
+    registration_type = chdb.CI_CHANGE_REGISTRATION_TYPES.NOT_REGISTERED.id
+    if isinstance(instance, chdb.CIChangeGit):
+        if SPLUNK_HOST:
+            log_change_to_splunk(instance, 'CHANGE_GIT')
+        # register every git change (treat as manual)
+        registration_type = chdb.CI_CHANGE_REGISTRATION_TYPES.WAITING.id
+        priority = chdb.CI_CHANGE_PRIORITY_TYPES.WARNING.id
+        change_type = chdb.CI_CHANGE_TYPES.CONF_GIT.id
+        message = instance.comment
+        time = instance.time or datetime.datetime.now()
+    elif isinstance(instance, chdb.CIChangeCMDBHistory):
+        if SPLUNK_HOST:
+            log_change_to_splunk(instance, 'CHANGE_HISTORY')
+        # register only user triggered cmdb history
+        if instance.user_id:
+            registration_type = chdb.CI_CHANGE_REGISTRATION_TYPES.WAITING.id
+        change_type = chdb.CI_CHANGE_TYPES.CI.id
+        priority = chdb.CI_CHANGE_PRIORITY_TYPES.NOTICE.id
+        message = instance.comment
+        time = instance.time
+    elif isinstance(instance, chdb.CIChangePuppet):
+        if SPLUNK_HOST:
+            log_change_to_splunk(instance, 'CHANGE_PUPPET')
+        if instance.status == 'failed':
+            priority = chdb.CI_CHANGE_PRIORITY_TYPES.ERROR.id
+        elif instance.status == 'changed':
+            priority = chdb.CI_CHANGE_PRIORITY_TYPES.WARNING.id
+        else:
+            priority = chdb.CI_CHANGE_PRIORITY_TYPES.NOTICE.id
+        change_type = chdb.CI_CHANGE_TYPES.CONF_AGENT.id
+        time = instance.time
+        message = 'Puppet log for %s (%s)' % (
+            instance.host, instance.configuration_version
+        )
+    else:
+        raise TypeError('Unknown change record: %r' % instance)
+    # some importers store the time as a string
+    time = chdb.CIChange._meta.get_field('time').to_python(time)
+    return chdb.CIChange(
+        time=time,
+        ci_id=instance.ci_id,
+        registration_type=registration_type,
+        priority=priority,
+        type=change_type,
+        content_type=ContentType.objects.get_for_model(instance),
+        object_id=instance.id,
+        message=message,
+    )
+
+
+def create_changes(instances):
+    """
+    Create the ``CIChange`` entries of the saved change records in bulk,
+    skipping the records which have them already, and register the eligible
+    ones in the issue tracker.
+    """
+    changes = {}
+    for instance in instances:
+        change = classify_change(instance)
+        changes[change.content_type_id, change.object_id] = instance, change
+    by_content_type = collections.defaultdict(list)
+    for content_type_id, object_id in changes:
+        by_content_type[content_type_id].append(object_id)
+    for content_type_id, object_ids in by_content_type.iteritems():
+        # already created parent cichange (e.g while saving twice)
+        for key in chdb.CIChange.objects.filter(
+            content_type=content_type_id,
+            object_id__in=object_ids,
+        ).values_list('content_type_id', 'object_id'):
+            del changes[key]
+    if not changes:
+        return
+    created = [change for instance, change in changes.itervalues()]
+    chdb.CIChange.objects.bulk_create(created)
+    counters.count_changes(created)
+    eligible = dict(
+        (key, (instance, change))
+        for key, (instance, change) in changes.iteritems()
+        if can_register_change(change)
+    )
+    by_content_type = collections.defaultdict(list)
+    for content_type_id, object_id in eligible:
+        by_content_type[content_type_id].append(object_id)
+    for content_type_id, object_ids in by_content_type.iteritems():
+        for change_id, object_id in chdb.CIChange.objects.filter(
+            content_type=content_type_id,
+            object_id__in=object_ids,
+        ).values_list('id', 'object_id'):
+            instance, change = eligible[content_type_id, object_id]
+            change.id = change_id
+            # register ticket now.
+            register_issue_signal.send(
+                sender=instance,
+                change_id=change_id,
+                change=change,
+            )
+
+
+class _ChangeBuffer(threading.local):
+    depth = 0
+
+    def __init__(self):
+        self.instances = []
+
+
+_change_buffer = _ChangeBuffer()
+
+
+def flush_changes():
+    """Create the ``CIChange`` entries of the buffered change records."""
+    instances = _change_buffer.instances
+    _change_buffer.instances = []
+    if instances:
+        create_changes(instances)
+
+
+@contextlib.contextmanager
+def buffered_changes():
+    """
+    Collect the change records saved in the block and create their
+    ``CIChange`` entries in batches, instead of one by one as they are
+    saved. Use for the imports of many changes.
+    """
+    _change_buffer.depth += 1
+    try:
+        yield
+    finally:
+        _change_buffer.depth -= 1
+        if not _change_buffer.depth:
+            flush_changes()
+
+
 @receiver(post_save, sender=chdb.CIChangeCMDBHistory,
           dispatch_uid='ralph.cmdb.change_post_save')
 @receiver(post_save, sender=chdb.CIChangePuppet,
@@ -106,76 +256,19 @@ def change_delete_post_save(sender, instance, **kwargs):
 @receiver(post_save, sender=chdb.CIChangeGit,
           dispatch_uid='ralph.cmdb.change_post_save')
 def post_create_change(sender, instance, raw, using, **kwargs):
-    registration_type = chdb.CI_CHANGE_REGISTRATION_TYPES.NOT_REGISTERED.id
-    user = None
+    """ Classify change, and create record - CIChange """
+    if _change_buffer.depth:
+        _change_buffer.instances.append(instance)
+        if len(_change_buffer.instances) >= CHANGE_BATCH_SIZE:
+            flush_changes()
+        return
+    logger.debug('Hooking post save CIChange creation.')
     try:
-        """ Classify change, and create record - CIChange """
-        logger.debug('Hooking post save CIChange creation.')
-        if isinstance(instance, chdb.CIChangeGit):
-            if SPLUNK_HOST:
-                log_change_to_splunk(instance, 'CHANGE_GIT')
-            # register every git change (treat as manual)
-            registration_type = chdb.CI_CHANGE_REGISTRATION_TYPES.WAITING.id
-            priority = chdb.CI_CHANGE_PRIORITY_TYPES.WARNING.id
-            change_type = chdb.CI_CHANGE_TYPES.CONF_GIT.id
-            message = instance.comment
-            if instance.time:
-                time = instance.time
-            else:
-                time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            ci = instance.ci
-        elif isinstance(instance, chdb.CIChangeCMDBHistory):
-            if SPLUNK_HOST:
-                log_change_to_splunk(instance, 'CHANGE_HISTORY')
-            # register only user triggered cmdb history
-            if instance.user_id:
-                registration_type = \
-                    chdb.CI_CHANGE_REGISTRATION_TYPES.WAITING.id
-                user = instance.user
-            change_type = chdb.CI_CHANGE_TYPES.CI.id
-            priority = chdb.CI_CHANGE_PRIORITY_TYPES.NOTICE.id
-            message = instance.comment
-            time = instance.time
-            ci = instance.ci
-        elif isinstance(instance, chdb.CIChangePuppet):
-            if SPLUNK_HOST:
-                log_change_to_splunk(instance, 'CHANGE_PUPPET')
-            if instance.status == 'failed':
-                priority = chdb.CI_CHANGE_PRIORITY_TYPES.ERROR.id
-            elif instance.status == 'changed':
-                priority = chdb.CI_CHANGE_PRIORITY_TYPES.WARNING.id
-            else:
-                priority = chdb.CI_CHANGE_PRIORITY_TYPES.NOTICE.id
-            change_type = chdb.CI_CHANGE_TYPES.CONF_AGENT.id
-            time = instance.time
-            ci = instance.ci
-            message = 'Puppet log for %s (%s)' % (
-                instance.host, instance.configuration_version
-            )
-
-        if chdb.CIChange.objects.filter(
-            content_type=ContentType.objects.get_for_model(instance),
-            object_id=instance.id,
-        ).exists():
-            # already created parent cichange (e.g while saving twice).
-            # Skip it.
-            return
-        ch = chdb.CIChange()
-        ch.time = time
-        ch.ci = ci
-        ch.registration_type = registration_type
-        ch.priority = priority
-        ch.type = change_type
-        ch.content_object = instance
-        ch.message = message
-        ch.user = user
-        ch.save()
-        # register ticket now.
-        register_issue_signal.send(sender=instance, change_id=ch.id)
-        logger.debug('Hook done.')
+        create_changes([instance])
     except IntegrityError:
         instance.delete()
         raise
+    logger.debug('Hook done.')
 
 
 def can_register_change(instance):
@@ -191,15 +284,16 @@ def can_register_change(instance):
 
 @receiver(
     register_issue_signal, dispatch_uid='register_issue_handler')
-def register_issue_handler(sender, change_id, **kwargs):
-    instance = chdb.CIChange.objects.get(id=change_id)
-    if can_register_change(instance):
+def register_issue_handler(sender, change_id, change=None, **kwargs):
+    if change is None:
+        change = chdb.CIChange.objects.get(id=change_id)
+    if can_register_change(change):
         if ENQUEUE_REGISTRATION:
             queue = django_rq.get_queue('cmdb_git')
-            queue.enqueue_call(func=create_issue, args=(instance.id,),
+            queue.enqueue_call(func=create_issue, args=(change.id,),
                                result_ttl=0)
         else:
-            create_issue(instance.id)
+            create_issue(change.id)
 
 
 @receiver(post_save, sender=cdb.CI, dispatch_uid='ralph.cmdb.history')
@@ -237,6 +331,118 @@ def ci_post_save(sender, instance, raw, using, **kwargs):
         ch.save()
 
 
+@receiver(post_save, sender=cdb.CI, dispatch_uid='ralph.cmdb.feed')
+def ci_feed_post_save(sender, instance, raw, using, **kwargs):
+    """A hook for adding changed CIs to the change feed."""
+    ChangeFeedEntry.touch(cdb.CI, instance.id)
+
+
+@receiver(post_delete, sender=cdb.CI, dispatch_uid='ralph.cmdb.feed')
+def ci_feed_post_delete(sender, instance, using, **kwargs):
+    """A hook for marking removed CIs in the change feed."""
+    ChangeFeedEntry.touch(cdb.CI, instance.id, deleted=True)
+
+
+@receiver(post_save, sender=cdb.CIRelation, dispatch_uid='ralph.cmdb.feed')
+@receiver(post_delete, sender=cdb.CIRelation, dispatch_uid='ralph.cmdb.feed')
+def cirelation_feed_changed(sender, instance, **kwargs):
+    """A hook for adding both ends of a changed relation to the feed."""
+    for ci_id in (instance.parent_id, instance.child_id):
+        ChangeFeedEntry.touch(cdb.CI, ci_id)
+
+
+@receiver(post_save, sender=cdb.CIRelation, dispatch_uid='ralph.cmdb.graph')
+def cirelation_graph_post_save(sender, instance, raw, using, created,
+                               **kwargs):
+    """A hook for keeping the cached relation graph up to date."""
+    dirty = instance.dirty_fields
+    if not created and not {'parent_id', 'child_id', 'type'} & set(dirty):
+        return
+    new = (instance.parent_id, instance.child_id, instance.type)
+    old = (
+        dirty.get('parent_id', instance.parent_id),
+        dirty.get('child_id', instance.child_id),
+        dirty.get('type', instance.type),
+    )
+
+    def update(relations):
+        if not created:
+            relations.remove_relation(*old)
+        relations.add_relation(*new)
+    RelationGraph.changed(update)
+
+
+@receiver(post_delete, sender=cdb.CIRelation, dispatch_uid='ralph.cmdb.graph')
+def cirelation_graph_post_delete(sender, instance, using, **kwargs):
+    """A hook for removing deleted relations from the cached graph."""
+    RelationGraph.changed(lambda relations: relations.remove_relation(
+        instance.parent_id, instance.child_id, instance.type,
+    ))
+
+
+@receiver(post_save, sender=cdb.CI, dispatch_uid='ralph.cmdb.graph')
+def ci_graph_post_save(sender, instance, raw, using, created, **kwargs):
+    """A hook for keeping the CI types in the cached graph up to date."""
+    if created or 'type_id' in instance.dirty_fields:
+        RelationGraph.changed(lambda relations: relations.set_ci_type(
+            instance.id, instance.type_id,
+        ))
+
+
+@receiver(post_delete, sender=cdb.CI, dispatch_uid='ralph.cmdb.graph')
+def ci_graph_post_delete(sender, instance, using, **kwargs):
+    """A hook for removing deleted CIs from the cached graph."""
+    ci_id = instance.id
+    RelationGraph.changed(lambda relations: relations.remove_ci(ci_id))
+
+
+@receiver(request_finished, dispatch_uid='ralph.cmdb.graph')
+def relation_graph_request_finished(sender, **kwargs):
+    """A hook for publishing the relation changes made by a request."""
+    RelationGraph.transaction_finished()
+
+
+@receiver(post_save, sender=chdb.CIChange, dispatch_uid='ralph.cmdb.counters')
+def change_counters_post_save(sender, instance, raw, using, created,
+                              **kwargs):
+    """A hook for keeping the monthly change counters up to date."""
+    counters.change_saved(instance, created)
+
+
+@receiver(post_delete, sender=chdb.CIChange,
+          dispatch_uid='ralph.cmdb.counters')
+def change_counters_post_delete(sender, instance, using, **kwargs):
+    """A hook for not counting the deleted changes."""
+    counters.count_changes([instance], sign=-1)
+
+
+@receiver(post_save, sender=chdb.CIProblem,
+          dispatch_uid='ralph.cmdb.counters')
+@receiver(post_save, sender=chdb.CIIncident,
+          dispatch_uid='ralph.cmdb.counters')
+def event_counters_post_save(sender, instance, raw, using, created, **kwargs):
+    """A hook for keeping the monthly problem and incident counters."""
+    counters.event_saved(instance, created)
+
+
+@receiver(post_delete, sender=chdb.CIProblem,
+          dispatch_uid='ralph.cmdb.counters')
+@receiver(post_delete, sender=chdb.CIIncident,
+          dispatch_uid='ralph.cmdb.counters')
+def event_counters_post_delete(sender, instance, using, **kwargs):
+    """A hook for not counting the deleted problems and incidents."""
+    counters.count_event(instance, sign=-1)
+
+
+@receiver(post_save, sender=chdb.GitPathMapping,
+          dispatch_uid='ralph.cmdb.path_mappings')
+@receiver(post_delete, sender=chdb.GitPathMapping,
+          dispatch_uid='ralph.cmdb.path_mappings')
+def git_path_mapping_changed(sender, instance, **kwargs):
+    """A hook for compiling the git path mappings again."""
+    PathMatcher.invalidate()
+
+
 def create_issue(change_id, retry_count=1):
     ch = chdb.CIChange.objects.get(id=change_id)
     if ch.registration_type == chdb.CI_CHANGE_REGISTRATION_TYPES.OP.id:
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A process-wide matcher of the git paths against the ``GitPathMapping``.
+
+The mappings are compiled once per process: the regular expressions into
+a few alternations, the plain paths into a single string searched in one
+go. Saving or deleting a mapping bumps a version number kept in the cache,
+so that every process compiles them again on the next use.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from bisect import bisect_right
+import random
+import re
+
+from django.core.cache import cache
+
+
+VERSION_KEY = 'ralph_cmdb_path_mappings_version'
+VERSION_TIMEOUT = 30 * 24 * 3600
+MEMO_SIZE = 10000
+# separates the plain paths, can't be a part of a git path
+SEPARATOR = '\0'
+# patterns which can't be a part of an alternation: backreferences, named
+# groups (duplicates) and global flags
+UNCOMBINABLE_RE = re.compile(r'\\[1-9]|\(\?P|\(\?[iLmsux]+\)')
+# the re module doesn't support more groups in one pattern
+MAX_GROUPS = 99
+
+
+class PathMatcher(object):
+    """
+    Finds the first mapping, in the order of their ids, matching a path.
+    A plain mapping matches the paths which are its substrings, a regular
+    expression matches the paths which it matches from the beginning.
+    """
+
+    _instance = None
+    _version = None
+
+    def __init__(self, mappings):
+        """`mappings` is a list of ``(ci_id, path, is_regex)`` in order."""
+        self._memo = {}
+        # plain paths joined together, with the mapping of each offset
+        self._plain_text = []
+        self._plain_offsets = []
+        self._plain_cis = []
+        # alternations of the regular expressions, each with the first
+        # group number of every alternative
+        self._regexes = []
+        offset = 0
+        alternatives = []
+        group_count = 0
+        for index, (ci_id, path, is_regex) in enumerate(mappings):
+            if not is_regex:
+                self._plain_offsets.append(offset)
+                self._plain_cis.append((index, ci_id))
+                self._plain_text.append(path)
+                offset += len(path) + len(SEPARATOR)
+                continue
+            try:
+                groups = re.compile(path).groups
+            except re.error:
+                continue
+            alone = UNCOMBINABLE_RE.search(path) or groups >= MAX_GROUPS
+            if alone or group_count + groups + 1 > MAX_GROUPS:
+                self._add_alternation(alternatives)
+                alternatives = []
+                group_count = 0
+            if alone:
+                self._add_alternation([(index, ci_id, path, groups)])
+            else:
+                alternatives.append((index, ci_id, path, groups))
+                group_count += groups + 1
+        self._add_alternation(alternatives)
+        self._plain_text = SEPARATOR.join(self._plain_text)
+
+    def _add_alternation(self, alternatives):
+        if not alternatives:
+            return
+        if len(alternatives) == 1:
+            index, ci_id, path, groups = alternatives[0]
+            self._regexes.append((re.compile(path), [0], [(index, ci_id)]))
+            return
+        group = 1
+        patterns = []
+        starts = []
+        cis = []
+        for index, ci_id, path, groups in alternatives:
+            patterns.append('(%s)' % path)
+            starts.append(group)
+            cis.append((index, ci_id))
+            group += groups + 1
+        self._regexes.append((re.compile('|'.join(patterns)), starts, cis))
+
+    @classmethod
+    def get(cls):
+        """Return the matcher, compiling it if it's missing or stale."""
+        from ralph.cmdb.models_changes import GitPathMapping
+
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, random.randint(1, 2 ** 30), VERSION_TIMEOUT)
+            version = cache.get(VERSION_KEY)
+        if cls._instance is None or cls._version != version:
+            cls._instance = cls(GitPathMapping.objects.order_by(
+                'id',
+            ).values_list('ci_id', 'path', 'is_regex'))
+            cls._version = version
+        return cls._instance
+
+    @classmethod
+    def invalidate(cls):
+        """Make every process compile the mappings again."""
+        cls._instance = None
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            pass
+
+    def _match_plain(self, path):
+        if not self._plain_cis:
+            return None
+        position = self._plain_text.find(path)
+        if position == -1:
+            return None
+        return self._plain_cis[
+            bisect_right(self._plain_offsets, position) - 1
+        ]
+
+    def _match_regex(self, path):
+        for regex, starts, cis in self._regexes:
+            match = regex.match(path)
+            if match:
+                # the alternative's own group closes last
+                return cis[bisect_right(starts, match.lastindex or 0) - 1]
+        return None
+
+    def match(self, path):
+        """Return the id of the CI mapped to the path, or None."""
+        try:
+            return self._memo[path]
+        except KeyError:
+            pass
+        matches = [
+            found for found in (self._match_plain(path),
+                                self._match_regex(path))
+            if found
+        ]
+        ci_id = min(matches)[1] if matches else None
+        if len(self._memo) >= MEMO_SIZE:
+            self._memo.clear()
+        self._memo[path] = ci_id
+        return ci_id
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A process-wide cache of the graph of all CI relations.
+
+The graph is loaded once per process and then kept up to date by the
+``CIRelation`` and ``CI`` signals. Other processes learn about the changes
+through a version number kept in the cache, so deployments running several
+processes need a cache backend shared between them (e.g. memcached).
+
+Changes made inside a managed transaction can still be rolled back, so they
+are queued, per thread, until the transaction is over. A transaction which
+reads the graph after its changes gets its own copy of the graph of the
+process, with the queued changes applied. Once the transaction is over,
+which is noticed at the end of the request or on the next use of the graph,
+the queued changes are checked against the database, since the transaction
+might have been rolled back, and published with a single version bump.
+
+The graph also keeps a topological order of the CIs along the ``CONTAINS``
+and ``REQUIRES`` relations, updated on every new relation with the
+Pearce-Kelly algorithm. Checking whether a new relation would close a cycle
+then only looks at the CIs between its ends in that order.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from array import array
+import random
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+
+from ralph.util.graph import Graph, strongly_connected_components
+
+
+VERSION_KEY = 'ralph_cmdb_relation_graph_version'
+VERSION_TIMEOUT = 30 * 24 * 3600
+# the number of relations or CIs checked against the database in one query
+CHECK_CHUNK_SIZE = 500
+
+
+class RelationChanges(object):
+    """
+    The net changes of the relations and CI types made in a transaction.
+    It has the update methods of `RelationGraph`, so the same updates can be
+    queued here or applied to a graph.
+    """
+
+    def __init__(self):
+        # {(parent_id, child_id, type): whether the relation exists}
+        self.relations = {}
+        # {ci_id: (whether the CI exists, type_id)}
+        self.cis = {}
+
+    def add_relation(self, parent_id, child_id, type_):
+        self.relations[parent_id, child_id, type_] = True
+
+    def remove_relation(self, parent_id, child_id, type_):
+        self.relations[parent_id, child_id, type_] = False
+
+    def set_ci_type(self, ci_id, type_id):
+        self.cis[ci_id] = (True, type_id)
+
+    def remove_ci(self, ci_id):
+        self.cis[ci_id] = (False, None)
+
+    def check(self):
+        """
+        Replace the changes with the state found in the database, which only
+        has them if the transaction was committed.
+        """
+
+        from ralph.cmdb.models_ci import CI, CIRelation
+        relations = self.relations.keys()
+        for offset in xrange(0, len(relations), CHECK_CHUNK_SIZE):
+            chunk = relations[offset:offset + CHECK_CHUNK_SIZE]
+            existing = set(CIRelation.objects.filter(
+                parent__in={relation[0] for relation in chunk},
+                child__in={relation[1] for relation in chunk},
+            ).values_list('parent_id', 'child_id', 'type'))
+            for relation in chunk:
+                self.relations[relation] = relation in existing
+        ci_ids = self.cis.keys()
+        for offset in xrange(0, len(ci_ids), CHECK_CHUNK_SIZE):
+            chunk = ci_ids[offset:offset + CHECK_CHUNK_SIZE]
+            types = dict(CI.objects.filter(
+                id__in=chunk,
+            ).values_list('id', 'type_id'))
+            for ci_id in chunk:
+                self.cis[ci_id] = (ci_id in types, types.get(ci_id))
+
+    def apply(self, relation_graph):
+        for ci_id, (exists, type_id) in self.cis.iteritems():
+            if exists:
+                relation_graph.set_ci_type(ci_id, type_id)
+            else:
+                relation_graph.remove_ci(ci_id)
+        for relation, exists in self.relations.iteritems():
+            if exists:
+                relation_graph.add_relation(*relation)
+            else:
+                relation_graph.remove_relation(*relation)
+
+
+class _TransactionState(threading.local):
+    # the `RelationChanges` of a transaction which isn't over yet
+    changes = None
+    # the copy of the graph with those changes, once it was needed
+    instance = None
+    # the relations were changed without the signals
+    invalidated = False
+
+
+class RelationGraph(object):
+    """
+    All the ``CIRelation`` edges as a compact graph from parent to child,
+    labelled with the relation type, plus the type of every CI.
+    """
+
+    _instance = None
+    _version = None
+    _transaction = _TransactionState()
+
+    def __init__(self):
+        from ralph.cmdb.models_ci import CI, CIRelation, CI_RELATION_TYPES
+        self.ordered_types = {
+            CI_RELATION_TYPES.CONTAINS.id,
+            CI_RELATION_TYPES.REQUIRES.id,
+        }
+        self.graph = Graph(CIRelation.objects.order_by('id').values_list(
+            'parent_id',
+            'child_id',
+            'type',
+        ).iterator())
+        self.ci_types = array(b'h')
+        for ci_id, type_id in CI.objects.values_list(
+            'id',
+            'type_id',
+        ).iterator():
+            self.set_ci_type(ci_id, type_id)
+        self._build_order()
+
+    @classmethod
+    def get(cls):
+        """Return the relation graph, loading it if it's missing or stale."""
+
+        state = cls._transaction
+        if (state.changes is not None or state.invalidated) and (
+                cls._in_transaction()):
+            if state.instance is None:
+                if state.invalidated:
+                    state.instance = cls()
+                else:
+                    state.instance = cls._get_committed().copy()
+                    state.changes.apply(state.instance)
+            return state.instance
+        cls.transaction_finished()
+        return cls._get_committed()
+
+    @classmethod
+    def _get_committed(cls):
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, random.randint(1, 2 ** 30), VERSION_TIMEOUT)
+            version = cache.get(VERSION_KEY)
+        if cls._instance is None or cls._version != version:
+            cls._instance = cls()
+            cls._version = version
+        return cls._instance
+
+    @classmethod
+    def changed(cls, update):
+        """
+        Tell the other processes that the relations have changed and apply
+        ``update(relation_graph)`` to the graph of this process, if it's up
+        to date. Otherwise the graph will be loaded again when needed.
+        Changes made in a managed transaction are queued until the
+        transaction is over, and only go to its own copy of the graph, if
+        it has one.
+        """
+
+        if transaction.is_managed():
+            state = cls._transaction
+            if not transaction.is_dirty():
+                # the transaction of the earlier changes is over
+                cls.transaction_finished()
+            if state.changes is None:
+                state.changes = RelationChanges()
+            update(state.changes)
+            if state.instance is not None:
+                update(state.instance)
+            return
+        cls.transaction_finished()
+        cls._publish(update)
+
+    @classmethod
+    def _publish(cls, update):
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            cls._instance = None
+            return
+        if cls._instance is not None and version == cls._version + 1:
+            update(cls._instance)
+            cls._version = version
+        else:
+            cls._instance = None
+
+    @classmethod
+    def find_cycle(cls, parent_id, child_id, type_):
+        """
+        Return the list of CIs from ``child_id`` to ``parent_id`` which would
+        form a cycle together with the given new relation, or an empty list.
+        A cycle found in the cached graph is confirmed in the database, so
+        a stale graph can't reject a valid relation.
+        """
+
+        from ralph.cmdb.models_ci import CIRelation
+        cycle = cls.get().creates_cycle(parent_id, child_id, type_)
+        if not cycle:
+            return cycle
+        relation_graph = cls.get()
+        existing = set(CIRelation.objects.filter(
+            parent__in=cycle,
+            child__in=cycle,
+            type__in=relation_graph.ordered_types,
+        ).values_list('parent_id', 'child_id'))
+        if all(edge in existing for edge in zip(cycle, cycle[1:])):
+            return cycle
+        cls.invalidate()
+        return cls.get().creates_cycle(parent_id, child_id, type_)
+
+    @classmethod
+    def invalidate(cls):
+        """
+        Make every process load the graph again, e.g. after the relations
+        were changed without sending the signals.
+        """
+
+        if transaction.is_managed():
+            cls._transaction.invalidated = True
+            cls._transaction.instance = None
+        else:
+            cls._instance = None
+            cache.delete(VERSION_KEY)
+
+    @staticmethod
+    def _in_transaction():
+        """Whether there are changes which can still be rolled back."""
+
+        return transaction.is_managed() and transaction.is_dirty()
+
+    @classmethod
+    def transaction_finished(cls):
+        """
+        Publish the changes queued in a transaction which is over. Whether
+        it was committed or rolled back isn't known, so the changes are
+        checked against the database first.
+        """
+
+        state = cls._transaction
+        changes, invalidated = state.changes, state.invalidated
+        state.changes = None
+        state.instance = None
+        state.invalidated = False
+        if invalidated:
+            cls._instance = None
+            cache.delete(VERSION_KEY)
+        elif changes is not None:
+            changes.check()
+            cls._publish(changes.apply)
+
+    def copy(self):
+        """Return a copy of the graph, which can be changed separately."""
+
+        other = self.__class__.__new__(self.__class__)
+        other.__dict__.update(self.__dict__)
+        other.graph = self.graph.copy()
+        other.ci_types = array(b'h', self.ci_types)
+        other.position = array(b'l', self.position)
+        return other
+
+    def has_ci(self, ci_id):
+        return ci_id < len(self.ci_types) and self.ci_types[ci_id] != 0
+
+    def get_ci_type(self, ci_id):
+        if ci_id < len(self.ci_types) and self.ci_types[ci_id] > 0:
+            return self.ci_types[ci_id]
+        return None
+
+    def set_ci_type(self, ci_id, type_id):
+        if ci_id >= len(self.ci_types):
+            self.ci_types.extend([0] * (ci_id + 1 - len(self.ci_types)))
+        # -1 marks existing CIs without a type
+        self.ci_types[ci_id] = type_id or -1
+
+    def remove_ci(self, ci_id):
+        if ci_id < len(self.ci_types):
+            self.ci_types[ci_id] = 0
+
+    def add_relation(self, parent_id, child_id, type_):
+        self.graph.add_edge(parent_id, child_id, type_)
+        if type_ in self.ordered_types:
+            self._update_order(parent_id, child_id)
+
+    def remove_relation(self, parent_id, child_id, type_):
+        self.graph.remove_edge(parent_id, child_id, type_)
+        if self.has_cycles and type_ in self.ordered_types:
+            # the removed relation may have been the last one of a cycle
+            self._build_order()
+
+    def creates_cycle(self, parent_id, child_id, type_):
+        """
+        Return the list of CIs from ``child_id`` to ``parent_id`` along the
+        ordered relations, if a relation of ``type_`` between them would form
+        a cycle. Otherwise return an empty list.
+        """
+
+        if type_ not in self.ordered_types:
+            return []
+        if parent_id == child_id:
+            return [parent_id]
+        return self._find_path(child_id, parent_id)
+
+    def _ordered_targets(self, node):
+        return [
+            target for target, type_ in self.graph.successors(node)
+            if type_ in self.ordered_types
+        ]
+
+    def _ordered_sources(self, node):
+        return [
+            source for source, type_ in self.graph.predecessors(node)
+            if type_ in self.ordered_types
+        ]
+
+    def _build_order(self):
+        """
+        Number the CIs in a topological order of the ordered relations. The
+        components come from Tarjan's algorithm in the reverse order, so the
+        CIs of a cycle already in the database just get neighbouring numbers
+        and mark the order as unreliable.
+        """
+
+        components = strongly_connected_components(
+            xrange(self.graph.size),
+            self._ordered_targets,
+        )
+        self.has_cycles = False
+        self.position = array(b'l', [0]) * self.graph.size
+        self._next_position = 0
+        for component in reversed(components):
+            if len(component) > 1 or component[0] in self._ordered_targets(
+                    component[0]):
+                self.has_cycles = True
+            for node in component:
+                self.position[node] = self._next_position
+                self._next_position += 1
+
+    def _get_position(self, node):
+        if node >= len(self.position):
+            start = self._next_position
+            self._next_position += node + 1 - len(self.position)
+            self.position.extend(xrange(start, self._next_position))
+        return self.position[node]
+
+    def _search(self, root, neighbors, accept):
+        """Return ``{node: parent}`` of nodes reachable via accepted nodes."""
+
+        parents = {root: None}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for other in neighbors(node):
+                if other not in parents and accept(other):
+                    parents[other] = node
+                    stack.append(other)
+        return parents
+
+    def _find_path(self, source, target):
+        if self.has_cycles:
+            # the order can't be trusted, search the whole graph
+            accept = lambda node: True
+        else:
+            limit = self._get_position(target)
+            if self._get_position(source) > limit:
+                return []
+            accept = lambda node: self._get_position(node) <= limit
+        parents = self._search(source, self._ordered_targets, accept)
+        if target not in parents:
+            return []
+        path = [target]
+        while path[-1] != source:
+            path.append(parents[path[-1]])
+        path.reverse()
+        return path
+
+    def _update_order(self, parent_id, child_id):
+        """
+        Move the CIs affected by a new ``parent_id -> child_id`` relation so
+        that the order stays topological (Pearce-Kelly). Only the CIs with
+        positions between the ends of the relation are visited.
+        """
+
+        if self.has_cycles:
+            return
+        lower = self._get_position(child_id)
+        upper = self._get_position(parent_id)
+        if lower > upper:
+            return
+        forward = self._search(
+            child_id,
+            self._ordered_targets,
+            lambda node: self._get_position(node) <= upper,
+        )
+        if parent_id in forward:
+            # the relation was saved in spite of the cycle
+            self.has_cycles = True
+            return
+        backward = self._search(
+            parent_id,
+            self._ordered_sources,
+            lambda node: self._get_position(node) >= lower,
+        )
+        nodes = sorted(backward, key=self._get_position)
+        nodes.extend(sorted(forward, key=self._get_position))
+        positions = sorted(self._get_position(node) for node in nodes)
+        for node, position in zip(nodes, positions):
+            self.position[node] = position
@@ -8,7 +8,7 @@ from __future__ import unicode_literals
 
 from django.views.decorators.csrf import csrf_exempt
 
-from ralph.cmdb.integration.puppet import PuppetAgentsImporter
+from ralph.cmdb.integration.puppet import enqueue_puppet_report
 from ralph.discovery.tasks import run_chain
 from ralph.util.views import jsonify
 
@@ -17,9 +17,11 @@ from ralph.util.views import jsonify
 @jsonify
 def notify_puppet_agent(request):
     contents = request.body
-    x = PuppetAgentsImporter()
-    x.import_contents(contents)
-    return {'ok': True}
+    if not contents:
+        return {'ok': False, 'status': 'No content to import!'}
+    # thousands of agents report at the same time, parse them in the workers
+    enqueue_puppet_report(contents)
+    return {'ok': True, 'status': 'Queued.'}
 
 
 @csrf_exempt
@@ -6,8 +6,8 @@ from __future__ import unicode_literals
 
 import datetime
 
-from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.test import TestCase
 import mock
@@ -30,6 +30,8 @@ from ralph.cmdb.models import (
     ArchivedCIChangePuppet,
     PuppetLog,
     ArchivedPuppetLog,
+    ArchivizationCheckpoint,
+    month_bucket,
 )
 from ralph.discovery.models import Device, DeviceType
 
@@ -41,12 +43,6 @@ class CMDBArchiverToolsTest(TestCase):
             foo2 = models.IntegerField()
         self.sampleDBModel = Foo
 
-    def test_get_used_db_backend_name(self):
-        db_backend = archiver._get_used_db_backend_name()
-        self.assertTrue(
-            db_backend in settings.DATABASES['default']['ENGINE'],
-        )
-
     def test_get_db_columns_for_model(self):
         cols = archiver._get_db_columns_for_model(self.sampleDBModel)
         self.assertEqual(
@@ -60,41 +56,6 @@ class CMDBArchiverToolsTest(TestCase):
             'unit_foo',
         )
 
-    def test_make_advanced_delete_query(self):
-        with mock.patch(
-            'ralph.cmdb.archiver._get_used_db_backend_name'
-        ) as db_backend:
-            db_backend.return_value = 'mysql'
-            sql = archiver._make_advanced_delete_query(
-                self.sampleDBModel,
-                self.sampleDBModel,
-            )
-            self.assertTrue(sql.lower().startswith(
-                'delete unit_foo.* from unit_foo',
-            ))
-            db_backend.return_value = 'postgresql'
-            sql = archiver._make_advanced_delete_query(
-                self.sampleDBModel,
-                self.sampleDBModel,
-            )
-            sql = ' '.join(sql.split())
-            self.assertTrue(sql.lower().startswith(
-                'delete from unit_foo using unit_foo',
-            ))
-            db_backend.return_value = 'sqlite'
-            sql = archiver._make_advanced_delete_query(
-                self.sampleDBModel,
-                self.sampleDBModel,
-            )
-            sql = ' '.join(sql.split())
-            self.assertTrue(sql.lower().startswith(
-                'delete from unit_foo where unit_foo.id in (',
-            ))
-            self.assertRegexpMatches(
-                sql.lower(),
-                r'delete from (?P<tab>[a-z_]+) where (?P=tab)\.[a-z_]+ in',
-            )
-
 
 class CMDBArchiverTest(TestCase):
     def setUp(self):
@@ -516,3 +477,100 @@ class CMDBArchiverTest(TestCase):
                 pk=self.puppet_log_2_id,
             ).exists(),
         )
+
+    def test_archivization_checkpoint(self):
+        archiver.run_cichange_device_archivization(
+            datetime.datetime.now() - datetime.timedelta(days=30),
+            window_size=1,
+        )
+        checkpoint = ArchivizationCheckpoint.objects.get(
+            change_type=CI_CHANGE_TYPES.DEVICE.id,
+        )
+        self.assertIsNone(checkpoint.older_than)
+        self.assertEqual(checkpoint.last_id, checkpoint.start_id)
+        self.assertLess(
+            checkpoint.start_id,
+            self.not_touched_cichange_device_id,
+        )
+        # the next run starts from the change which was too recent
+        archiver.run_cichange_device_archivization(
+            datetime.datetime.now() - datetime.timedelta(days=28),
+            window_size=1,
+        )
+        self.assertTrue(
+            ArchivedCIChange.objects.filter(
+                pk=self.not_touched_cichange_device_id,
+            ).exists(),
+        )
+
+    def test_archivization_stops_at_recent_changes(self):
+        device = Device.create(
+            sn='sn_123456789_3',
+            model_name='sampleDevice',
+            model_type=DeviceType.unknown,
+        )
+        change = CIChange(
+            type=CI_CHANGE_TYPES.DEVICE,
+            content_type=ContentType.objects.get_for_model(device),
+            object_id=device.id,
+            created=datetime.datetime.now() - datetime.timedelta(days=60),
+            priority=CI_CHANGE_PRIORITY_TYPES.ERROR,
+        )
+        change.save()
+        archiver.run_cichange_device_archivization(
+            datetime.datetime.now() - datetime.timedelta(days=30),
+            window_size=1,
+        )
+        # the windows after the first too recent change are left for later
+        self.assertTrue(CIChange.objects.filter(pk=change.id).exists())
+        archiver.run_cichange_device_archivization(
+            datetime.datetime.now() - datetime.timedelta(days=28),
+            window_size=1,
+        )
+        self.assertTrue(
+            ArchivedCIChange.objects.filter(pk=change.id).exists(),
+        )
+
+    def test_run_month_roll(self):
+        old = datetime.datetime.now() - datetime.timedelta(days=100)
+        # a change stored before the month buckets existed
+        CIChange.objects.filter(
+            pk=self.cichange_device_id,
+        ).update(time=old, month=None)
+        self.assertEqual(
+            CIChange.objects.get(
+                pk=self.not_touched_cichange_device_id,
+            ).month,
+            month_bucket(datetime.date.today()),
+        )
+        archiver.run_month_roll(2)
+        self.assertTrue(
+            ArchivedCIChange.objects.filter(
+                pk=self.cichange_device_id,
+                month=month_bucket(old),
+            ).exists(),
+        )
+        self.assertTrue(
+            CIChange.objects.filter(
+                pk=self.not_touched_cichange_device_id,
+            ).exists(),
+        )
+
+    def test_fill_month_buckets_skips_invalid_dates(self):
+        invalid_time = datetime.datetime(2010, 1, 1)
+        CIChange.objects.update(month=None)
+        CIChange.objects.filter(
+            pk=self.cichange_device_id,
+        ).update(time=invalid_time)
+
+        def bucket(value):
+            if value == invalid_time:
+                raise ValidationError('Invalid date.')
+            return month_bucket(value)
+
+        with mock.patch('ralph.cmdb.archiver.month_bucket', bucket):
+            count = archiver.fill_month_buckets(CIChange, chunk_size=1)
+        self.assertEqual(count, CIChange.objects.count() - 1)
+        self.assertIsNone(
+            CIChange.objects.get(pk=self.cichange_device_id).month,
+        )
@@ -16,15 +16,22 @@ import mock
 
 from ralph.business.models import Venture, VentureRole
 from ralph.cmdb.importer import CIImporter
-from ralph.cmdb.integration.puppet import PuppetAgentsImporter
+from ralph.cmdb.integration.puppet import (
+    PuppetAgentsImporter,
+    enqueue_puppet_report,
+)
 from ralph.cmdb.integration.puppet import PuppetGitImporter as pgi
+from ralph.cmdb.integration.lib.puppet_yaml import load, parse_report
 from ralph.cmdb.models import (
     CI, CIChange, CI_TYPES, CIChangePuppet,
     CIChangeGit,
-    CI_CHANGE_TYPES, CI_CHANGE_REGISTRATION_TYPES,
+    CI_CHANGE_TYPES, CI_CHANGE_REGISTRATION_TYPES, CI_CHANGE_PRIORITY_TYPES,
     GitPathMapping
 )
 from ralph.cmdb.models_changes import PuppetLog
+from ralph.cmdb.models_signals import buffered_changes
+from ralph.cmdb.path_mappings import PathMatcher
+from ralph.util import plugin
 
 
 CURRENT_DIR = settings.CURRENT_DIR
@@ -78,6 +85,53 @@ class OPRegisterTest(TestCase):
             CIChangePuppet.objects.count(), 1
         )
 
+    def test_buffered_changes(self):
+        with buffered_changes():
+            for status in ('failed', 'changed'):
+                CIChangePuppet(
+                    configuration_version='1',
+                    host='s11401.dc2',
+                    kind='apply',
+                    status=status,
+                ).save()
+            self.assertEqual(CIChange.objects.count(), 0)
+        changes = CIChange.objects.filter(
+            type=CI_CHANGE_TYPES.CONF_AGENT.id,
+        ).order_by('id')
+        self.assertEqual(
+            [change.priority for change in changes],
+            [
+                CI_CHANGE_PRIORITY_TYPES.ERROR.id,
+                CI_CHANGE_PRIORITY_TYPES.WARNING.id,
+            ],
+        )
+        self.assertEqual(
+            changes[0].content_object,
+            CIChangePuppet.objects.get(status='failed'),
+        )
+
+    @patch('ralph.cmdb.integration.puppet.django_rq')
+    def test_queue_puppet_report(self, django_rq):
+        hostci = CI(name='s11401.dc2', uid='mm-1')
+        hostci.type_id = CI_TYPES.DEVICE.id
+        hostci.save()
+        changed_yaml = open(
+            os.path.join(CURRENT_DIR, 'cmdb/tests/samples/canonical.yaml'),
+        ).read()
+        enqueue_puppet_report(changed_yaml)
+        # nothing is parsed until a worker runs the job
+        self.assertEqual(CIChangePuppet.objects.count(), 0)
+        queue = django_rq.get_queue.return_value
+        self.assertEqual(queue.enqueue_call.call_count, 1)
+        job = queue.enqueue_call.call_args[1]
+        job['func'](*job['args'])
+        chg = CIChange.objects.get(type=CI_CHANGE_TYPES.CONF_AGENT.id)
+        self.assertEqual(chg.ci, hostci)
+        self.assertEqual(
+            PuppetLog.objects.filter(cichange__host='s11401.dc2').count(),
+            16,
+        )
+
     @patch('ralph.cmdb.models_signals.OP_TEMPLATE', _PATCHED_OP_TEMPLATE)
     @patch('ralph.cmdb.models_signals.OP_START_DATE', _PATCHED_OP_START_DATE)
     @patch('ralph.cmdb.models_signals.OP_TICKETS_ENABLE',
@@ -180,6 +234,87 @@ class OPRegisterTest(TestCase):
             chg.registration_type, CI_CHANGE_REGISTRATION_TYPES.WAITING.id)
 
 
+class PuppetReportParserTest(TestCase):
+    def test_parse_report(self):
+        contents = open(
+            os.path.join(CURRENT_DIR, 'cmdb/tests/samples/canonical.yaml'),
+        ).read()
+        report = parse_report(contents)
+        full_report = load(contents)
+        for field in ('configuration_version', 'host', 'kind', 'status',
+                      'time'):
+            self.assertEqual(
+                getattr(report, field),
+                getattr(full_report, field),
+            )
+        self.assertEqual(len(report.logs), 16)
+        for log, full_log in zip(report.logs, full_report.logs):
+            for field in ('level', 'message', 'source', 'tags', 'time'):
+                self.assertEqual(
+                    getattr(log, field),
+                    getattr(full_log, field),
+                )
+        # the sections we don't store are skipped
+        self.assertFalse(hasattr(report, 'resource_statuses'))
+        self.assertFalse(hasattr(report, 'metrics'))
+        self.assertIsNone(parse_report('- not a report'))
+
+    def test_parse_report_aliases(self):
+        contents = """--- !ruby/object:Puppet::Transaction::Report
+  host: s11401.dc2
+  resource_statuses:
+    "File[/tmp/a]": !ruby/object:Puppet::Resource::Status
+      events:
+        - !ruby/object:Puppet::Transaction::Event
+          message: &id002 "owner changed 'pberry' to 'root'"
+          tags: &id003
+            - file
+  logs:
+    - !ruby/object:Puppet::Util::Log
+      level: !ruby/sym notice
+      message: *id002
+      source: Puppet
+      tags: [notice]
+"""
+        report = parse_report(contents)
+        self.assertEqual(
+            report.logs[0].message,
+            "owner changed 'pberry' to 'root'",
+        )
+        # an alias to a skipped collection falls back to the full load
+        report = parse_report(contents.replace('[notice]', '*id003'))
+        self.assertEqual(report.logs[0].tags, ['file'])
+        self.assertEqual(len(report.resource_statuses), 1)
+        # so does an alias to a whole log
+        report = parse_report(contents.replace(
+            '- !ruby/object:Puppet::Util::Log',
+            '- &id004 !ruby/object:Puppet::Util::Log',
+        ) + '    - *id004\n')
+        self.assertEqual(len(report.logs), 2)
+        self.assertEqual(
+            report.logs[1].message,
+            "owner changed 'pberry' to 'root'",
+        )
+
+
+class PathMatcherTest(TestCase):
+    def test_match(self):
+        matcher = PathMatcher([
+            (1, 'modules/custom/file.xml', False),
+            (2, '.*/file.xml', True),
+            (3, '(a)(b)?/(c)', True),
+            (4, 'modules/other/file.xml', False),
+            (5, '(x)\\1/.*', True),
+        ])
+        # the first mapping in order wins
+        self.assertEqual(matcher.match('modules/custom/file.xml'), 1)
+        self.assertEqual(matcher.match('modules/other/file.xml'), 2)
+        self.assertEqual(matcher.match('other/file'), 4)
+        self.assertEqual(matcher.match('a/c'), 3)
+        self.assertEqual(matcher.match('xx/c'), 5)
+        self.assertEqual(matcher.match('x/c'), None)
+
+
 class MockFisheye(object):
     def __init__(self):
         pass
@@ -218,6 +353,7 @@ class CIChangeGitTest(TestCase):
 
     """
     def setUp(self):
+        PathMatcher.invalidate()
         v = Venture(symbol='test_venture')
         v.save()
         r = VentureRole(name='test_role', venture=v)
@@ -259,6 +395,9 @@ class CIChangeGitTest(TestCase):
         self.assertEqual(CIChangeGit.objects.filter(
             ci__name='custom_ci').count(), 2)
 
+    def test_git_plugin(self):
+        self.assertIn('git', plugin.BY_NAME['cmdb_git'])
+
     def test_fisheye_no_mappings(self):
         self.load_fisheye_data()
         self.assertEqual(CIChangeGit.objects.filter(
@@ -268,3 +407,8 @@ class CIChangeGitTest(TestCase):
             ci__name='test_role',
             type=CI_CHANGE_TYPES.CONF_GIT.id,
         ).count(), 2)
+        # the times imported as strings are bucketed too
+        self.assertFalse(CIChange.objects.filter(
+            type=CI_CHANGE_TYPES.CONF_GIT.id,
+            month=None,
+        ).exists())
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+
+from django.test import TestCase
+
+from ralph.cmdb.counters import rebuild_counts, uncount_changes
+from ralph.cmdb.models import (
+    CI,
+    CI_CHANGE_PRIORITY_TYPES,
+    CI_CHANGE_TYPES,
+    CI_EVENT_TYPES,
+    CI_TYPES,
+    CIChange,
+    CIChangeCount,
+    CIChangeGit,
+    CIEventCount,
+    CIProblem,
+)
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.ci = CI(name='s11401.dc2', uid='mm-1')
+        self.ci.type_id = CI_TYPES.DEVICE.id
+        self.ci.save()
+
+    def get_change_counts(self):
+        # saving the CI has stored its history changes too
+        return sorted(CIChangeCount.objects.filter(
+            type=CI_CHANGE_TYPES.CONF_GIT.id,
+        ).values_list('ci_id', 'type', 'priority', 'month', 'count'))
+
+    def test_changes(self):
+        for changeset in ('123', '456'):
+            CIChangeGit(
+                ci=self.ci,
+                changeset=changeset,
+                time=datetime.datetime(2013, 5, 1),
+            ).save()
+        key = (
+            self.ci.id,
+            CI_CHANGE_TYPES.CONF_GIT.id,
+            CI_CHANGE_PRIORITY_TYPES.WARNING.id,
+            201305,
+        )
+        self.assertEqual(self.get_change_counts(), [key + (2,)])
+        change = CIChange.objects.filter(
+            type=CI_CHANGE_TYPES.CONF_GIT.id,
+        ).order_by('id')[0]
+        change.priority = CI_CHANGE_PRIORITY_TYPES.ERROR.id
+        change.save()
+        self.assertEqual(self.get_change_counts(), [
+            key + (1,),
+            key[:2] + (CI_CHANGE_PRIORITY_TYPES.ERROR.id, 201305, 1),
+        ])
+        change.delete()
+        self.assertEqual(self.get_change_counts(), [key + (1,)])
+        uncount_changes(CIChange.objects.all())
+        self.assertEqual(self.get_change_counts(), [])
+        rebuild_counts()
+        self.assertEqual(self.get_change_counts(), [key + (1,)])
+
+    def test_events(self):
+        problem = CIProblem(
+            ci=self.ci,
+            jira_id='PROB-1',
+            created_date=datetime.datetime(2013, 5, 1),
+        )
+        problem.save()
+        CIProblem(
+            ci=self.ci,
+            jira_id='PROB-2',
+            created_date=datetime.datetime(2013, 5, 2),
+        ).save()
+        counts = CIEventCount.objects.values_list('type', 'month', 'count')
+        self.assertEqual(
+            list(counts),
+            [(CI_EVENT_TYPES.PROBLEM.id, 201305, 2)],
+        )
+        problem.created_date = datetime.datetime(2013, 6, 1)
+        problem.save()
+        self.assertEqual(sorted(counts.all()), [
+            (CI_EVENT_TYPES.PROBLEM.id, 201305, 1),
+            (CI_EVENT_TYPES.PROBLEM.id, 201306, 1),
+        ])
+        problem.delete()
+        rebuild_counts()
+        self.assertEqual(
+            list(counts.all()),
+            [(CI_EVENT_TYPES.PROBLEM.id, 201305, 1)],
+        )
+        # the issue tracker sync stores the dates as strings
+        CIProblem(
+            ci=self.ci,
+            jira_id='PROB-3',
+            created_date='2013-07-01 10:00:00',
+        ).save()
+        self.assertEqual(sorted(counts.all()), [
+            (CI_EVENT_TYPES.PROBLEM.id, 201305, 1),
+            (CI_EVENT_TYPES.PROBLEM.id, 201307, 1),
+        ])
@@ -19,6 +19,8 @@ from ralph.business.models import (
 from ralph.cmdb.importer import CIImporter
 from ralph.cmdb.models import (
     CI,
+    CIChange,
+    CIChangeCMDBHistory,
     CIRelation,
     CI_RELATION_TYPES,
 )
@@ -181,6 +183,8 @@ class CIImporterTest(TestCase):
             set([(u'child_role', u'blade', 3)]),
         )
         from ralph.cmdb.graphs import ImpactCalculator
+        from ralph.cmdb.relation_graph import RelationGraph
+        RelationGraph.invalidate()
         # summarize relations.
         self.assertEqual(CIRelation.objects.count(), 9)
         # calculate impact/spanning tree for CI structure
@@ -191,6 +195,89 @@ class CIImporterTest(TestCase):
             ({2: 6, 5: 6, 6: None, 7: 6}, [6, 7, 2, 5]),
         )
 
+    def test_relations_sync(self):
+        device_type = ContentType.objects.get_for_model(Device)
+        importer = CIImporter()
+        importer.import_all_ci([device_type])
+        importer.import_relations(device_type)
+        ci_dc = CI.objects.get(name='dc')
+        ci_rack = CI.objects.get(name='rack')
+        ci_blade = CI.objects.get(name='blade')
+        contains = CI_RELATION_TYPES.CONTAINS.id
+        self.assertTrue(CIRelation.objects.filter(
+            parent=ci_rack, child=ci_blade, type=contains,
+        ).exists())
+        # move the blade without the signals
+        Device.objects.filter(id=self.blade.id).update(parent=self.dc)
+        importer.import_relations(device_type)
+        self.assertFalse(CIRelation.objects.filter(
+            parent=ci_rack, child=ci_blade,
+        ).exists())
+        relation = CIRelation.objects.get(
+            parent=ci_dc, child=ci_blade, type=contains,
+        )
+        self.assertTrue(relation.readonly)
+        importer.import_relations(device_type)
+        self.assertEqual(CIRelation.objects.get(
+            parent=ci_dc, child=ci_blade, type=contains,
+        ).id, relation.id)
+
+    def test_purge(self):
+        device_type = ContentType.objects.get_for_model(Device)
+        venture_type = ContentType.objects.get_for_model(Venture)
+        importer = CIImporter()
+        importer.import_all_ci([device_type, venture_type])
+        importer.import_relations(venture_type)
+        importer.import_relations(device_type)
+        ci_rack = CI.objects.get(name='rack')
+        ci_rack.name = 'rack2'
+        ci_rack.save()
+        self.assertTrue(CIChange.objects.filter(ci=ci_rack).exists())
+        importer.purge_system_relations()
+        self.assertFalse(CIRelation.objects.exists())
+        importer.import_relations(device_type)
+        importer.purge_all_ci([device_type])
+        self.assertFalse(CI.objects.filter(content_type=device_type).exists())
+        self.assertTrue(CI.objects.filter(content_type=venture_type).exists())
+        self.assertFalse(CIRelation.objects.exists())
+        self.assertFalse(CIChangeCMDBHistory.objects.filter(
+            ci_id=ci_rack.id,
+        ).exists())
+        self.assertFalse(CIChange.objects.filter(ci_id=ci_rack.id).exists())
+
+    def test_bulk_import(self):
+        device_type = ContentType.objects.get_for_model(Device)
+        count = CIImporter().import_all_ci([device_type], bulk=True)
+        self.assertEqual(count, 3)
+        self.assertEqual(
+            set(CI.objects.filter(
+                content_type=device_type,
+            ).values_list('object_id', 'name')),
+            {(self.dc.id, 'dc'), (self.rack.id, 'rack'),
+             (self.blade.id, 'blade')},
+        )
+        ci_rack = CI.objects.get(name='rack')
+        self.assertEqual(ci_rack.layers.count(), 1)
+        self.assertEqual(ci_rack.uid, CI.get_uid_by_content_object(self.rack))
+        # rename without the signals, like changes made by other tools
+        Device.objects.filter(id=self.rack.id).update(name='rack2')
+        CIImporter().import_all_ci([device_type], bulk=True)
+        self.assertEqual(CI.objects.filter(
+            content_type=device_type,
+        ).count(), 3)
+        ci_rack = CI.objects.get(id=ci_rack.id)
+        self.assertEqual(ci_rack.name, 'rack2')
+        entry = CIChangeCMDBHistory.objects.filter(
+            ci=ci_rack,
+            field_name='name',
+        ).latest('id')
+        self.assertEqual((entry.old_value, entry.new_value), ('rack', 'rack2'))
+        self.assertTrue(CIChange.objects.filter(
+            ci=ci_rack,
+            content_type=ContentType.objects.get_for_model(entry),
+            object_id=entry.id,
+        ).exists())
+
 
 class AddOrUpdateCITest(TestCase):
     def setUp(self):
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.core.exceptions import ValidationError
+from django.test import TestCase, TransactionTestCase
+
+from ralph.cmdb.graphs import ImpactCalculator
+from ralph.cmdb.models import CI, CIRelation, CI_RELATION_TYPES, CI_TYPES
+from ralph.cmdb.relation_graph import RelationGraph
+from ralph.util.graph import (
+    Graph,
+    depth_first_search,
+    find_cycle,
+    strongly_connected_components,
+)
+
+
+class GraphTest(TestCase):
+    def test_changes(self):
+        graph = Graph([(1, 2, 1), (1, 3, 2), (3, 1, 1)])
+        self.assertTrue(graph.has_edge(1, 3, 2))
+        self.assertFalse(graph.has_edge(1, 3, 1))
+        self.assertFalse(graph.has_edge(4, 1, 1))
+        self.assertEqual(graph.successors(1), [(2, 1), (3, 2)])
+        self.assertEqual(graph.predecessors(1), [(3, 1)])
+        graph.add_edge(1, 2, 1)
+        graph.add_edge(5, 1, 3)
+        graph.remove_edge(1, 3, 2)
+        self.assertEqual(graph.successors(1), [(2, 1)])
+        self.assertEqual(graph.predecessors(1), [(3, 1), (5, 3)])
+        self.assertEqual(graph.edge_count, 3)
+        self.assertTrue(graph.has_edge(5, 1, 3))
+        self.assertFalse(graph.has_edge(1, 3, 2))
+        graph.compact()
+        self.assertEqual(
+            sorted(graph.edges()),
+            [(1, 2, 1), (3, 1, 1), (5, 1, 3)],
+        )
+        self.assertEqual(graph.predecessors(1), [(3, 1), (5, 3)])
+        self.assertEqual(graph.successors(7), [])
+
+    def test_algorithms(self):
+        graph = Graph([
+            (1, 2, 0), (2, 3, 0), (3, 1, 0), (3, 4, 0), (4, 5, 0), (5, 4, 0),
+        ])
+        self.assertEqual(find_cycle(range(6), graph.targets), [1, 2, 3])
+        self.assertEqual(
+            strongly_connected_components(range(6), graph.targets),
+            [[0], [5, 4], [3, 2, 1]],
+        )
+        self.assertEqual(
+            depth_first_search([1], graph.targets),
+            (
+                {1: None, 2: 1, 3: 2, 4: 3, 5: 4},
+                [1, 2, 3, 4, 5],
+                [5, 4, 3, 2, 1],
+            ),
+        )
+        graph.remove_edge(3, 1, 0)
+        graph.remove_edge(5, 4, 0)
+        self.assertEqual(find_cycle(range(6), graph.targets), [])
+
+
+class RelationGraphTest(TestCase):
+    def setUp(self):
+        RelationGraph.invalidate()
+        self.cis = []
+        for name in ('a', 'b', 'c'):
+            ci = CI(name=name, type_id=CI_TYPES.DEVICE.id)
+            ci.save()
+            self.cis.append(ci)
+        self.relation = CIRelation(
+            parent=self.cis[0],
+            child=self.cis[1],
+            type=CI_RELATION_TYPES.CONTAINS.id,
+        )
+        self.relation.save()
+
+    def test_signals(self):
+        a, b, c = self.cis
+        # as if the changes made in setUp were committed
+        RelationGraph.transaction_finished()
+        relations = RelationGraph.get()
+        self.assertEqual(
+            relations.graph.successors(a.id),
+            [(b.id, CI_RELATION_TYPES.CONTAINS.id)],
+        )
+        self.relation.child = c
+        self.relation.save()
+        self.assertEqual(
+            RelationGraph.get().graph.successors(a.id),
+            [(c.id, CI_RELATION_TYPES.CONTAINS.id)],
+        )
+        self.relation.delete()
+        self.assertEqual(RelationGraph.get().graph.successors(a.id), [])
+        c_id = c.id
+        c.delete()
+        self.assertFalse(RelationGraph.get().has_ci(c_id))
+        self.assertTrue(RelationGraph.get().has_ci(a.id))
+        # the changes can still be rolled back, so the graph of this process
+        # is left alone until the transaction is over
+        self.assertEqual(
+            relations.graph.successors(a.id),
+            [(b.id, CI_RELATION_TYPES.CONTAINS.id)],
+        )
+        self.assertTrue(relations.has_ci(c_id))
+        # a change which didn't make it to the database, like the changes of
+        # a transaction which was rolled back
+        RelationGraph.changed(lambda relations: relations.add_relation(
+            b.id, a.id, CI_RELATION_TYPES.CONTAINS.id,
+        ))
+        RelationGraph.transaction_finished()
+        # the changes found in the database are applied in place
+        self.assertIs(RelationGraph.get(), relations)
+        self.assertEqual(relations.graph.successors(a.id), [])
+        self.assertEqual(relations.graph.successors(b.id), [])
+        self.assertFalse(relations.has_ci(c_id))
+
+    def test_changes_without_copy(self):
+        a, b, c = self.cis
+        RelationGraph.transaction_finished()
+        RelationGraph.get()
+        # nothing is loaded when the graph isn't read in the transaction
+        with self.assertNumQueries(0):
+            RelationGraph.changed(lambda relations: relations.add_relation(
+                b.id, c.id, CI_RELATION_TYPES.CONTAINS.id,
+            ))
+
+    def test_impact(self):
+        a, b, c = self.cis
+        calc = ImpactCalculator(b)
+        self.assertEqual(
+            calc.find_affected_nodes(b.id),
+            ({a.id: b.id, b.id: None}, [b.id, a.id]),
+        )
+        calc = ImpactCalculator(c)
+        self.assertEqual(
+            calc.find_affected_nodes(c.id),
+            ({c.id: None}, [c.id]),
+        )
+
+    def test_cycles(self):
+        a, b, c = self.cis
+        CIRelation(
+            parent=b,
+            child=c,
+            type=CI_RELATION_TYPES.REQUIRES.id,
+        ).save()
+        relation = CIRelation(
+            parent=c,
+            child=a,
+            type=CI_RELATION_TYPES.CONTAINS.id,
+        )
+        with self.assertRaises(ValidationError):
+            relation.clean()
+        self.assertEqual(
+            RelationGraph.find_cycle(c.id, a.id, relation.type),
+            [a.id, b.id, c.id],
+        )
+        # roles may form cycles
+        relation.type = CI_RELATION_TYPES.HASROLE.id
+        relation.clean()
+        relation = CIRelation(
+            parent=a,
+            child=c,
+            type=CI_RELATION_TYPES.CONTAINS.id,
+        )
+        relation.clean()
+        relation.save()
+        self.assertEqual(
+            RelationGraph.find_cycle(c.id, a.id, relation.type),
+            [a.id, c.id],
+        )
+
+    def test_removed_cycle(self):
+        a, b, c = self.cis
+        contains = CI_RELATION_TYPES.CONTAINS.id
+        relations = RelationGraph()
+        relations.add_relation(a.id, b.id, contains)
+        relations.add_relation(b.id, a.id, contains)
+        self.assertTrue(relations.has_cycles)
+        relations.remove_relation(b.id, a.id, contains)
+        self.assertFalse(relations.has_cycles)
+        self.assertEqual(
+            relations.creates_cycle(b.id, a.id, contains),
+            [a.id, b.id],
+        )
+
+
+class RelationGraphAutocommitTest(TransactionTestCase):
+    def test_signals(self):
+        RelationGraph.invalidate()
+        a = CI(name='a', type_id=CI_TYPES.DEVICE.id)
+        a.save()
+        b = CI(name='b', type_id=CI_TYPES.DEVICE.id)
+        b.save()
+        relations = RelationGraph.get()
+        CIRelation(
+            parent=a,
+            child=b,
+            type=CI_RELATION_TYPES.CONTAINS.id,
+        ).save()
+        # the committed changes are applied to the graph of this process
+        self.assertIs(RelationGraph.get(), relations)
+        self.assertEqual(
+            relations.graph.successors(a.id),
+            [(b.id, CI_RELATION_TYPES.CONTAINS.id)],
+        )
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+import mock
+
+from ralph.cmdb.models import (
+    CI,
+    CILayer,
+    CIOwner,
+    CIRelation,
+    CI_RELATION_TYPES,
+    CI_TYPES,
+)
+from ralph.cmdb.models_ci import CIOwnership
+from ralph.cmdb.views import CIPageLoader, CIRelationsEdit
+
+
+class CIPageLoaderTest(TestCase):
+    def setUp(self):
+        self.venture = CI(name='venture', type_id=CI_TYPES.VENTURE.id)
+        self.venture.save()
+        self.role = CI(name='role', type_id=CI_TYPES.VENTUREROLE.id)
+        self.role.save()
+        self.service = CI(name='service', type_id=CI_TYPES.SERVICE.id)
+        self.service.save()
+        CIRelation(
+            parent=self.venture,
+            child=self.role,
+            type=CI_RELATION_TYPES.CONTAINS.id,
+        ).save()
+        CIRelation(
+            parent=self.role,
+            child=self.service,
+            type=CI_RELATION_TYPES.CONTAINS.id,
+        ).save()
+        layer = CILayer(name='applications')
+        layer.save()
+        self.role.layers.add(layer)
+        owner = CIOwner(first_name='John', last_name='Doe')
+        owner.save()
+        CIOwnership(ci=self.role, owner=owner, type=1).save()
+
+    def test_page(self):
+        with self.assertNumQueries(4):
+            loader = CIPageLoader(
+                CI.objects.filter(id=self.role.id).select_related('type'),
+            )
+        role = loader.cis[0]
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                loader.parents(role, CI_TYPES.VENTURE.id),
+                [self.venture],
+            )
+            self.assertEqual(
+                loader.children(role, CI_TYPES.SERVICE.id),
+                [self.service],
+            )
+            self.assertEqual(loader.children(role, CI_TYPES.VENTURE.id), [])
+            self.assertEqual(
+                [layer.name for layer in loader.layers(role)],
+                ['applications'],
+            )
+            self.assertEqual(
+                [owner.last_name for owner in loader.owners(role, 1)],
+                ['Doe'],
+            )
+            self.assertEqual(loader.owners(role, 2), [])
+
+    def test_empty_page(self):
+        with self.assertNumQueries(0):
+            loader = CIPageLoader([])
+        self.assertEqual(loader.cis, [])
+
+
+class CIRelationsTabTest(TestCase):
+    def setUp(self):
+        self.cis = []
+        for name in ('a', 'b', 'c', 'd'):
+            ci = CI(name=name, type_id=CI_TYPES.DEVICE.id)
+            ci.save()
+            self.cis.append(ci)
+        a, b, c, d = self.cis
+        for parent, child, type_ in (
+            (a, b, CI_RELATION_TYPES.CONTAINS.id),
+            (a, c, CI_RELATION_TYPES.CONTAINS.id),
+            (a, d, CI_RELATION_TYPES.REQUIRES.id),
+            (d, a, CI_RELATION_TYPES.HASROLE.id),
+        ):
+            CIRelation(parent=parent, child=child, type=type_).save()
+
+    def get_view(self, **params):
+        view = CIRelationsEdit()
+        view.request = RequestFactory().get('/', params)
+        view.calculate_relations(self.cis[0].id)
+        return view
+
+    def test_panels(self):
+        a, b, c, d = self.cis
+        with self.assertNumQueries(3):
+            view = self.get_view()
+        self.assertEqual(
+            [(ci, icon) for rel, ci, icon in view.relations_contains],
+            [(b, ''), (c, '')],
+        )
+        self.assertEqual(
+            [ci for rel, ci, icon in view.relations_requires],
+            [d],
+        )
+        self.assertEqual([ci for rel, ci, icon in view.relations_isrole], [d])
+        self.assertEqual(view.relations_parts, [])
+        self.assertEqual(view.relation_counts['contains'], 2)
+        self.assertEqual(view.relation_counts['parts'], 0)
+        self.assertEqual(view.relation_pages, {})
+
+    def test_pagination(self):
+        a, b, c, d = self.cis
+        with mock.patch('ralph.cmdb.views.RELATIONS_PER_PAGE', 1):
+            view = self.get_view(contains_page=2)
+        self.assertEqual(
+            [ci for rel, ci, icon in view.relations_contains],
+            [c],
+        )
+        self.assertEqual(view.relation_counts['contains'], 2)
+        self.assertEqual(view.relation_pages['contains'].number, 2)
+        self.assertEqual(
+            [ci for rel, ci, icon in view.relations_requires],
+            [d],
+        )
@@ -6,6 +6,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from collections import defaultdict
 import datetime
 import re
 from urlparse import urljoin
@@ -14,8 +15,9 @@ from urlparse import urljoin
 from bob.data_table import DataTableMixin
 from bob.menu import MenuItem, MenuHeader
 
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.shortcuts import get_object_or_404
 from django.contrib import messages
@@ -52,6 +54,7 @@ from ralph.cmdb.models_ci import (
 )
 import ralph.cmdb.models as db
 from ralph.cmdb.graphs import ImpactCalculator
+from ralph.discovery.models import IPAddress
 from ralph.ui.views.common import Base
 from ralph.util.presentation import (
     get_device_icon,
@@ -68,6 +71,7 @@ from ralph.cmdb.util import report_filters, add_filter, table_colums
 
 JIRA_URL = urljoin(settings.ISSUETRACKERS['default']['URL'], 'browse')
 ROWS_PER_PAGE = 20
+RELATIONS_PER_PAGE = 100
 SAVE_PRIORITY = 200
 
 
@@ -85,6 +89,121 @@ def get_icon_for(ci):
         return 'wall'
 
 
+# what the icons and the columns of the CIs need from their content objects
+CONTENT_OBJECT_RELATED = {
+    ('discovery', 'device'): ('model', 'parent__model', 'parent__parent__model'),
+    ('business', 'venture'): ('department',),
+    ('discovery', 'network'): ('kind',),
+}
+# the content objects which have IP addresses, with the field pointing at them
+ADDRESS_FIELDS = {
+    ('discovery', 'device'): 'device',
+    ('discovery', 'network'): 'network',
+}
+
+
+def load_content_objects(cis):
+    """
+    Fetch the content objects of the given CIs with one query per content
+    type, so that accessing ``ci.content_object`` doesn't query the database.
+    Returns the ids of the objects found for every content type.
+    """
+    object_ids = defaultdict(set)
+    for ci in cis:
+        if ci.content_type_id and ci.object_id:
+            object_ids[ci.content_type_id].add(ci.object_id)
+    objects = {}
+    found = {}
+    for content_type_id, ids in object_ids.iteritems():
+        content_type = ContentType.objects.get_for_id(content_type_id)
+        model = content_type.model_class()
+        if model is None:
+            continue
+        query = model._base_manager.filter(pk__in=ids)
+        related = CONTENT_OBJECT_RELATED.get(
+            (content_type.app_label, content_type.model),
+        )
+        if related:
+            query = query.select_related(*related)
+        found[content_type] = []
+        for obj in query:
+            objects[content_type_id, obj.pk] = obj
+            found[content_type].append(obj.pk)
+    cache_attr = CI.content_object.cache_attr
+    for ci in cis:
+        if ci.content_type_id and ci.object_id:
+            setattr(ci, cache_attr, objects.get(
+                (ci.content_type_id, ci.object_id),
+            ))
+    return found
+
+
+class CIPageLoader(object):
+    """
+    Loads what the rows of a page of CIs show with a few queries for the
+    whole page: the layers, the owners, the content objects with their IP
+    addresses and the relations from and to the CIs.
+    """
+
+    def __init__(self, cis):
+        self.cis = list(cis)
+        self._layers = defaultdict(list)
+        self._owners = defaultdict(list)
+        self._parents = defaultdict(list)
+        self._children = defaultdict(list)
+        self._addresses = defaultdict(list)
+        ids = [ci.id for ci in self.cis]
+        if not ids:
+            return
+        for row in CI.layers.through.objects.filter(
+            ci__in=ids,
+        ).select_related('cilayer').order_by('cilayer__name'):
+            self._layers[row.ci_id].append(row.cilayer)
+        for ownership in CIOwnership.objects.filter(
+            ci__in=ids,
+        ).select_related('owner').order_by('id'):
+            self._owners[ownership.ci_id, ownership.type].append(
+                ownership.owner,
+            )
+        for relation in CIRelation.objects.filter(
+            Q(parent__in=ids) | Q(child__in=ids),
+        ).select_related('parent', 'child').order_by('id'):
+            self._parents[relation.child_id].append(relation.parent)
+            self._children[relation.parent_id].append(relation.child)
+        self._load_content_objects()
+
+    def _load_content_objects(self):
+        for content_type, ids in load_content_objects(self.cis).iteritems():
+            field = ADDRESS_FIELDS.get(
+                (content_type.app_label, content_type.model),
+            )
+            if not field:
+                continue
+            for address in IPAddress.objects.filter(**{
+                '%s__in' % field: ids,
+            }):
+                self._addresses[
+                    content_type.id, getattr(address, '%s_id' % field)
+                ].append(address)
+
+    def layers(self, ci):
+        return self._layers[ci.id]
+
+    def owners(self, ci, type_):
+        return self._owners[ci.id, type_]
+
+    def parents(self, ci, type_id):
+        return [parent for parent in self._parents[ci.id]
+                if parent.type_id == type_id]
+
+    def children(self, ci, type_id=None):
+        return [child for child in self._children[ci.id]
+                if type_id is None or child.type_id == type_id]
+
+    def addresses(self, ci):
+        return self._addresses[ci.content_type_id, ci.object_id]
+
+
 class BaseCMDBView(Base):
     template_name = 'nope.html'
     Form = CIRelationEditForm
@@ -780,6 +899,16 @@ class MainCIView(MainCIEdit):
 class CIRelationsEdit(BaseCIDetails):
     template_name = 'cmdb/ci_relations.html'
     active_tab = 'relations'
+    # the panels of the tab: their names, the relation types and whether
+    # the CI is the parent of the relations shown
+    panels = (
+        ('contains', db.CI_RELATION_TYPES.CONTAINS.id, True),
+        ('parts', db.CI_RELATION_TYPES.CONTAINS.id, False),
+        ('requires', db.CI_RELATION_TYPES.REQUIRES.id, True),
+        ('isrequired', db.CI_RELATION_TYPES.REQUIRES.id, False),
+        ('hasrole', db.CI_RELATION_TYPES.HASROLE.id, True),
+        ('isrole', db.CI_RELATION_TYPES.HASROLE.id, False),
+    )
 
     def get_context_data(self, **kwargs):
         ret = super(CIRelationsEdit, self).get_context_data(**kwargs)
@@ -790,6 +919,9 @@ class CIRelationsEdit(BaseCIDetails):
             'relations_parts': self.relations_parts,
             'relations_hasrole': self.relations_hasrole,
             'relations_isrole': self.relations_isrole,
+            'relation_counts': self.relation_counts,
+            'relation_pages': self.relation_pages,
+            'url_query': self.request.GET,
             'editable': True,
         })
         return ret
@@ -802,6 +934,8 @@ class CIRelationsEdit(BaseCIDetails):
         self.relations_isrequired = []
         self.relations_hasrole = []
         self.relations_isrole = []
+        self.relation_counts = {}
+        self.relation_pages = {}
 
     def get(self, *args, **kwargs):
         perm = self.check_perm()
@@ -818,38 +952,76 @@ class CIRelationsEdit(BaseCIDetails):
             self.calculate_relations(ci_id)
         return super(CIRelationsEdit, self).get(*args, **kwargs)
 
+    def _get_relation_page(self, query, name):
+        paginator = Paginator(query, RELATIONS_PER_PAGE)
+        page = self.request.GET.get('%s_page' % name) or 1
+        try:
+            return paginator.page(page)
+        except PageNotAnInteger:
+            return paginator.page(1)
+        except EmptyPage:
+            return paginator.page(paginator.num_pages)
+
     def calculate_relations(self, ci_id):
-        self.relations_contains = [
-            (x, x.child, get_icon_for(x.child))
-            for x in db.CIRelation.objects.filter(
-                parent=ci_id, type=db.CI_RELATION_TYPES.CONTAINS.id)
-        ]
-        self.relations_parts = [
-            (x, x.parent, get_icon_for(x.parent))
-            for x in db.CIRelation.objects.filter(
-                child=ci_id,
-                type=db.CI_RELATION_TYPES.CONTAINS.id)
-        ]
-        self.relations_requires = [
-            (x, x.child, get_icon_for(x.parent))
-            for x in db.CIRelation.objects.filter(
-                parent=ci_id, type=db.CI_RELATION_TYPES.REQUIRES.id)
-        ]
-        self.relations_isrequired = [
-            (x, x.parent, get_icon_for(x.parent))
-            for x in db.CIRelation.objects.filter(
-                child=ci_id, type=db.CI_RELATION_TYPES.REQUIRES.id)
-        ]
-        self.relations_hasrole = [
-            (x, x.child, get_icon_for(x.parent))
-            for x in db.CIRelation.objects.filter(
-                parent=ci_id, type=db.CI_RELATION_TYPES.HASROLE.id)
-        ]
-        self.relations_isrole = [
-            (x, x.parent, get_icon_for(x.parent))
-            for x in db.CIRelation.objects.filter(
-                child=ci_id, type=db.CI_RELATION_TYPES.HASROLE.id)
-        ]
+        """
+        Fill the panels of the tab. The relations are counted per type in
+        two queries, the panels which fit on one page are then fetched
+        together in one query, and only the larger ones are paginated.
+        """
+
+        ci_id = int(ci_id)
+        self.relation_counts = {}
+        self.relation_pages = {}
+        counts = {}
+        for is_parent, field in ((True, 'parent'), (False, 'child')):
+            for type_, count in db.CIRelation.objects.filter(**{
+                field: ci_id,
+            }).values_list('type').annotate(Count('id')).order_by():
+                counts[type_, is_parent] = count
+        relations = db.CIRelation.objects.select_related(
+            'parent__type',
+            'parent__content_type',
+            'child__type',
+            'child__content_type',
+        ).order_by('id')
+        rows = {}
+        small = None
+        small_panels = {}
+        for name, type_, is_parent in self.panels:
+            count = counts.get((type_, is_parent), 0)
+            self.relation_counts[name] = count
+            rows[name] = []
+            if not count:
+                continue
+            field = 'parent' if is_parent else 'child'
+            condition = Q(type=type_, **{field: ci_id})
+            if count <= RELATIONS_PER_PAGE:
+                small = condition if small is None else small | condition
+                small_panels[type_, is_parent] = name
+                continue
+            page = self._get_relation_page(relations.filter(condition), name)
+            self.relation_pages[name] = page
+            rows[name] = list(page.object_list)
+        if small is not None:
+            for relation in relations.filter(small):
+                for is_parent, end in ((True, relation.parent_id),
+                                       (False, relation.child_id)):
+                    name = small_panels.get((relation.type, is_parent))
+                    if name and end == ci_id:
+                        rows[name].append(relation)
+        shown = []
+        for name, type_, is_parent in self.panels:
+            rows[name] = [
+                (relation, relation.child if is_parent else relation.parent)
+                for relation in rows[name]
+            ]
+            shown.extend(ci for relation, ci in rows[name])
+        load_content_objects(shown)
+        for name, type_, is_parent in self.panels:
+            setattr(self, 'relations_%s' % name, [
+                (relation, ci, get_icon_for(ci))
+                for relation, ci in rows[name]
+            ])
 
 
 class CIRelationsView(CIRelationsEdit):
@@ -1454,7 +1626,7 @@ class Search(BaseCMDBView):
             escape(i.id), escape(i.uid)))
 
     def get_layer(self, i):
-        return ', '.join(unicode(x) for x in i.layers.select_related())
+        return ', '.join(unicode(x) for x in self.loader.layers(i))
 
     def get_parent_dev(self, i):
         parent = '-'
@@ -1466,11 +1638,9 @@ class Search(BaseCMDBView):
 
     def get_network(self, i):
         network = '-'
-        try:
-            networks = i.content_object.ipaddress_set.all()
+        if hasattr(i.content_object, 'ipaddress_set'):
+            networks = self.loader.addresses(i)
             network = ', '.join(unicode(x) for x in networks)
-        except AttributeError:
-            pass
         return network
 
     def get_dc(self, i):
@@ -1482,52 +1652,31 @@ class Search(BaseCMDBView):
         return dc
 
     def get_owners(self, i, filter):
-        owners = ', '.join("%s %s" % (b.owner.first_name, b.owner.last_name)
-            for b in i.ciownership_set.filter(type=filter)),
-        return owners[0]
+        return ', '.join("%s %s" % (owner.first_name, owner.last_name)
+            for owner in self.loader.owners(i, filter))
 
-    def get_bl(self, i, relations):
+    def get_bl(self, i):
         business_line = '-'
-        rel_bl = relations.filter(
-            child=i.id, parent__type__id=CI_TYPES.BUSINESSLINE.id
-        )
-        for bl in rel_bl:
+        for bl in self.loader.parents(i, CI_TYPES.BUSINESSLINE.id):
             business_line = ('<a href="%s">%s</a>' % (
-                escape(bl.parent.id), escape(bl.parent.name))
+                escape(bl.id), escape(bl.name))
             )
         return mark_safe(business_line)
 
-    def get_venture(self, relations, i, child=False):
-        venture = []
-        if child is False:
-            ven = relations.filter(
-                child=i.id,
-                parent__type__id=CI_TYPES.VENTURE.id
-            )
-            for v in ven:
-                venture.append(
-                    '<a href="/cmdb/ci/view/%s">%s</a>' % (
-                        escape(v.parent.id), escape(v.parent.name))
-                )
-        elif child is True:
-            ven = relations.filter(
-                parent=i.id,
-                child__type__id=CI_TYPES.VENTURE.id
-            )
-            for v in ven:
-                venture.append(
-                    '<a href="/cmdb/ci/view/%s">%s</a>' % (
-                        escape(v.child.id), escape(v.child.name))
-                )
-        return mark_safe(', '.join(x for x in venture))
+    def get_venture(self, i, child=False):
+        if child:
+            ventures = self.loader.children(i, CI_TYPES.VENTURE.id)
+        else:
+            ventures = self.loader.parents(i, CI_TYPES.VENTURE.id)
+        return mark_safe(', '.join(
+            '<a href="/cmdb/ci/view/%s">%s</a>' % (escape(v.id), escape(v.name))
+            for v in ventures
+        ))
 
-    def get_service(self, relations, i):
+    def get_service(self, i):
         services = ''
-        servi = relations.filter(
-            parent=i.id, child__type__id=CI_TYPES.SERVICE.id
-        )
-        for s in servi:
-            services += '%s, ' % escape(s.child.name)
+        for s in self.loader.children(i, CI_TYPES.SERVICE.id):
+            services += '%s, ' % escape(s.name)
         return mark_safe(services)
 
     def get_operations(self, i):
@@ -1538,7 +1687,7 @@ class Search(BaseCMDBView):
 
     def get(self, *args, **kwargs):
         values = self.request.GET
-        cis = db.CI.objects.all()
+        cis = db.CI.objects.select_related('type', 'content_type')
         uid = values.get('uid')
         state = values.get('state')
         status = values.get('status')
@@ -1575,14 +1724,14 @@ class Search(BaseCMDBView):
             cis = self.paginator.page(self.paginator.num_pages)
             page = self.paginator.num_pages
         self.page = cis
+        self.loader = CIPageLoader(cis.object_list)
         table_body = []
-        relations = CIRelation.objects.all()
         t_owners = 1
         b_owners = 2
-        for i in cis:
+        for i in self.loader.cis:
             icon = get_icon_for(i)
-            venture = self.get_venture(relations, i)
-            service = self.get_service(relations, i)
+            venture = self.get_venture(i)
+            service = self.get_service(i)
             DEFAULT_ROWS = [
                 {'name': 'name', 'value': self.get_name(i, icon)},
                 {'name': 'uid', 'value': self.get_uid(i)},
@@ -1611,7 +1760,7 @@ class Search(BaseCMDBView):
                 ]
                 table_body.append(row)
             elif type_ == CI_TYPES.VENTURE:
-                venture_c = self.get_venture(relations, i, child=True)
+                venture_c = self.get_venture(i, child=True)
                 b_own = self.get_owners(i, b_owners)
                 t_own = self.get_owners(i, t_owners)
                 row = [
@@ -1637,10 +1786,9 @@ class Search(BaseCMDBView):
                 ]
                 table_body.append(row)
             elif type_ == CI_TYPES.BUSINESSLINE:
-                ven = relations.filter(parent=i.id)
                 services_contained = ', '.join(
                     '<a href="/cmdb/ci/view/%s">%s</a>' %
-                    (v.child.id, v.child.name) for v in ven)
+                    (v.id, v.name) for v in self.loader.children(i))
                 row = [
                     {'name': 'name', 'value': self.get_name(i, icon)},
                     {'name': 'uid', 'value': self.get_uid(i)},
@@ -1649,14 +1797,14 @@ class Search(BaseCMDBView):
                 ]
                 table_body.append(row)
             elif type_ == CI_TYPES.SERVICE.id:
-                venture_c = self.get_venture(relations, i, child=True)
+                venture_c = self.get_venture(i, child=True)
                 b_own = self.get_owners(i, b_owners)
                 t_own = self.get_owners(i, t_owners)
                 row = [
                     {'name': 'name', 'value': self.get_name(i, icon)},
                     {'name': 'uid', 'value': self.get_uid(i)},
                     {'name': 'venture-child', 'value': venture_c},
-                    {'name': 'bl', 'value': self.get_bl(i, relations)},
+                    {'name': 'bl', 'value': self.get_bl(i)},
                     {'name': 't_owners', 'value': t_own},
                     {'name': 'b_owners', 'value': b_own},
                     {'name': 'operations', 'value': self.get_operations(i)}
@@ -1734,14 +1882,14 @@ class Graphs(BaseCMDBView):
                     {'overflow': len(search_tree)}
                 )
             else:
-                ci_names = dict(CI.objects.values_list('id', 'name'))
+                ci_names = dict(CI.objects.filter(
+                    pk__in=search_tree.keys(),
+                ).values_list('id', 'name'))
                 relations = [dict(
                     child=item,
                     parent=search_tree.get(item),
                     parent_name=ci_names[item],
-                    type=ic.graph.edge_attributes(
-                        (search_tree.get(item), item)
-                    )[0],
+                    type=ic.edge_types[search_tree.get(item), item],
                     child_name=ci_names[search_tree.get(item)]) for item
                     in search_tree.keys() if item and search_tree.get(item)
                 ]
@@ -13,8 +13,7 @@ from bob.data_table import DataTableMixin, DataTableColumn
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import connection
-from django.db.models import (Count, Q)
+from django.db.models import Count, Q, Sum
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import simplejson
@@ -392,21 +391,18 @@ class DashboardDetails(ChangesBase):
         month = kwargs.get('month')
         report_type = kwargs.get('report_type')
         venture_id = self.request.GET.get('venture_id')
-        cursor = connection.cursor()
-        cursor.execute('''
-            SELECT
-            COUNT(*) as cnt, cc.name as name, cc.id as ci_id
-            FROM cmdb_ci cc
-            INNER JOIN cmdb_cichange ch ON (cc.id = ch.ci_id)
-            WHERE type=%s AND priority=%s AND MONTH(ch.time)=%s
-            AND YEAR(ch.time)=YEAR(NOW())
-            GROUP BY cc.id DESC
-            ORDER BY COUNT(*) DESC, cc.name ASC
-            LIMIT 20
-        ''', [type, prio, month])
+        rows = [
+            (row['cnt'], row['ci__name'], row['ci'])
+            for row in db.CIChangeCount.objects.filter(
+                type=type,
+                priority=prio,
+                month=datetime.date.today().year * 100 + int(month),
+            ).values('ci', 'ci__name').annotate(
+                cnt=Sum('count'),
+            ).order_by('-cnt', 'ci__name')[:20]
+        ]
         if report_type == 'ci':
             self.data = []
-            rows = cursor.fetchall()
             for r in rows:
                 venture = None
                 count = r[0]
@@ -442,7 +438,6 @@ class DashboardDetails(ChangesBase):
         else:
             self.template_name = 'cmdb/dashboard_details_venture.html'
             self.data_dict = {}
-            rows = cursor.fetchall()
             for r in rows:
                 venture = None
                 count = r[0]
@@ -488,19 +483,18 @@ class DashSubReport(object):
         )
 
     def get_month_data(self):
-        cursor = connection.cursor()
-        cursor.execute('''
-            SELECT
-            COUNT(*) as cnt, type, priority, MONTH(ch.time) as date
-            FROM cmdb_ci cc
-            INNER JOIN cmdb_cichange ch ON (cc.id = ch.ci_id)
-            WHERE YEAR(ch.time) = YEAR(NOW())
-            AND type=%s AND priority=%s
-            GROUP BY MONTH(ch.time)
-            ORDER BY DATE(ch.time) DESC
-        ''', [self.report_type_int, self.priority_int])
-        rows = cursor.fetchall()
-        return rows
+        year = datetime.date.today().year
+        return [
+            (row['cnt'], self.report_type_int, self.priority_int,
+             row['month'] % 100)
+            for row in db.CIChangeCount.objects.filter(
+                type=self.report_type_int,
+                priority=self.priority_int,
+                month__range=(year * 100 + 1, year * 100 + 12),
+            ).values('month').annotate(
+                cnt=Sum('count'),
+            ).order_by('-month')
+        ]
 
     def calculate_report(self):
         self.data = []
@@ -587,13 +581,8 @@ class Dashboard(ChangesBase):
         )
 
     def get(self, *args, **kwargs):
-        engine = settings.DATABASES['default'].get('ENGINE')
-        if engine != 'django.db.backends.mysql':
-            self.db_supported = False
-            self.reports = []
-            return super(Dashboard, self).get(*args)
-        else:
-            self.db_supported = True
+        # the counters work on every database
+        self.db_supported = True
         self.reports = []
         for _type in db.CI_CHANGE_TYPES():
             d = DashReport(_type)
@@ -676,37 +665,46 @@ class Reports(ChangesBase, DataTableMixin):
         delta = datetime.timedelta(days=ddays)
         return dt - delta
 
-    def handle_params(self, queryset):
-        beginning = self.first_day_of_month(datetime.date.today())
-        beginning = beginning.strftime("%Y-%m-%d")
+    def handle_params(self, counters):
+        """Limit the monthly counters to this month if requested."""
         if self.request.GET.get('this_month'):
-            queryset = queryset.filter(cichange__time__gt=beginning)
-        return queryset
+            counters['month'] = db.month_bucket(datetime.date.today())
+        return counters
+
+    def top_cis(self, prefix, **counters):
+        """Sum the monthly counters of every CI which has some."""
+        counters = self.handle_params(counters)
+        queryset = db.CI.objects.filter(**dict(
+            ('%s__%s' % (prefix, key), value)
+            for key, value in counters.iteritems()
+        )).annotate(num=Sum('%s__count' % prefix)).order_by('-num')
+        rows = [(x.num or 0, x) for x in queryset]
+        return rows
 
     def top_ci_problems(self):
-        queryset = db.CI.objects.annotate(num=Count('ciproblem')).order_by('-num')
-        queryset = self.handle_params(queryset)
-        rows = [(x.num, x) for x in queryset]
-        return rows
+        return self.top_cis(
+            'event_counts',
+            type=db.CI_EVENT_TYPES.PROBLEM.id,
+        )
 
     def top_ci_incidents(self):
-        queryset = db.CI.objects.annotate(num=Count('ciincident')).order_by('-num')
-        queryset = self.handle_params(queryset)
-        rows = [(x.num, x) for x in queryset]
-        return rows
+        return self.top_cis(
+            'event_counts',
+            type=db.CI_EVENT_TYPES.INCIDENT.id,
+        )
 
     def least_ci_changes(self):
-        queryset = db.CI.objects.annotate(
-            num=Count('cichange')).filter(num=0).order_by('num')
-        queryset = self.handle_params(queryset)
-        rows = [(x.num, x) for x in queryset]
+        counters = self.handle_params({})
+        queryset = db.CI.objects.exclude(
+            id__in=db.CIChangeCount.objects.filter(
+                **counters
+            ).values('ci'),
+        ).order_by('name')
+        rows = [(0, x) for x in queryset]
         return rows
 
     def top_ci_changes(self):
-        queryset = db.CI.objects.annotate(num=Count('cichange')).order_by('-num')
-        queryset = self.handle_params(queryset)
-        rows = [(x.num, x) for x in queryset]
-        return rows
+        return self.top_cis('change_counts')
 
     def get_csv_data(self):
         self.csv_data = [(unicode(x[0]), unicode(x[1])) for x in self.data]
@@ -20,12 +20,14 @@ from tastypie import fields
 from tastypie.authentication import ApiKeyAuthentication
 from tastypie.cache import SimpleCache
 from tastypie.constants import ALL, ALL_WITH_RELATIONS
+from tastypie.exceptions import BadRequest
 from tastypie.resources import ModelResource as MResource
 from tastypie.throttle import CacheThrottle
 
 from ralph.account.api_auth import RalphAuthorization
 from ralph.account.models import Perm
 from ralph.discovery.models import (
+    ChangeFeedEntry,
     ComponentType,
     Device,
     DeviceModel,
@@ -43,7 +45,59 @@ EXPIRATION = settings.API_THROTTLING['expiration']
 SAVE_PRIORITY=10
 
 
-class IPAddressResource(MResource):
+class ChangedSinceMixin(object):
+    """
+    Allows to fetch only the objects changed after the given change feed
+    entry id, e.g. ``?changed_since=1234``.
+    """
+
+    def apply_filters(self, request, applicable_filters):
+        objects = super(ChangedSinceMixin, self).apply_filters(
+            request,
+            applicable_filters,
+        )
+        position = request.GET.get('changed_since')
+        if position is None:
+            return objects
+        try:
+            position = int(position)
+        except ValueError:
+            raise BadRequest("changed_since must be a change feed entry id.")
+        return objects.filter(
+            id__in=ChangeFeedEntry.changed_since(objects.model, position),
+        )
+
+
+class ChangeFeedResource(MResource):
+    model = fields.CharField(attribute='content_type__model')
+
+    class Meta:
+        queryset = ChangeFeedEntry.objects.select_related('content_type')
+        authentication = ApiKeyAuthentication()
+        authorization = RalphAuthorization(
+            required_perms=[
+                Perm.read_dc_structure,
+            ]
+        )
+        filtering = {
+            'date': ALL,
+            'deleted': ALL,
+            'id': ALL,
+            'model': ('exact', 'in'),
+            'object_id': ALL,
+        }
+        ordering = ['id']
+        list_allowed_methods = ['get']
+        detail_allowed_methods = ['get']
+        resource_name = 'changefeed'
+        throttle = CacheThrottle(
+            throttle_at=THROTTLE_AT,
+            timeframe=TIMEFRAME,
+            expiration=EXPIRATION,
+        )
+
+
+class IPAddressResource(ChangedSinceMixin, MResource):
     device = fields.ForeignKey(
         'ralph.discovery.api.DevResource',
         'device',
@@ -174,7 +228,7 @@ class ModelResource(MResource):
         )
 
 
-class DeviceResource(MResource):
+class DeviceResource(ChangedSinceMixin, MResource):
     model = fields.ForeignKey(ModelResource, 'model', null=True, full=True)
     management = fields.ForeignKey(
         IPAddressResource,
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import textwrap
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ralph.discovery.models import DeviceSummary
+
+
+class Command(BaseCommand):
+    """Summarize the devices which have no device summary."""
+
+    help = textwrap.dedent(__doc__).strip()
+    requires_model_validation = True
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--rebuild',
+            action='store_true',
+            dest='rebuild',
+            default=False,
+            help='Drop all the summaries and build them from scratch.',
+        ),
+    )
+
+    def handle(self, rebuild=False, **options):
+        if rebuild:
+            DeviceSummary.objects.all().delete()
+        count = DeviceSummary.refresh()
+        print('%d devices summarized.' % count)
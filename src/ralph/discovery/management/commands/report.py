@@ -19,6 +19,7 @@ from bob.csvutil import UnicodeWriter
 from ralph.util import pricing
 from ralph.business.models import Venture
 from ralph.discovery.models import DeviceType, ReadOnlyDevice
+from ralph.util.views import iter_chunks
 
 
 def field(field_name):
@@ -134,8 +135,9 @@ class Command(BaseCommand):
             writer = UnicodeWriter(f)
             writer.writerow([title for (title, func) in report])
             def get_rows(query, report):
-                for dev in query.select_related(depth=2):
-                    yield [func(dev) for (title, func) in report]
+                for chunk in iter_chunks(query.select_related(depth=2)):
+                    for dev in chunk:
+                        yield [func(dev) for (title, func) in report]
             writer.writerows(get_rows(query, report))
         elif format == 'xls':
             if not output:
@@ -146,7 +148,12 @@ class Command(BaseCommand):
                 worksheet = workbook.add_sheet(v.symbol.encode('ascii', 'ignore').replace('/', ' '))
                 for i, (title, func) in enumerate(report):
                     worksheet.write(0, i, title)
-                for i, dev in enumerate(query.filter(venture=v).select_related(depth=2)):
+                devices = (
+                    dev for chunk in iter_chunks(
+                        query.filter(venture=v).select_related(depth=2),
+                    ) for dev in chunk
+                )
+                for i, dev in enumerate(devices):
                     for j, (title, func) in enumerate(report):
                         value = func(dev)
                         worksheet.write(i+1, j, value)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import textwrap
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ralph.discovery.models import DeviceSearchIndex
+
+
+class Command(BaseCommand):
+    """Index the devices which are missing from the device search index."""
+
+    help = textwrap.dedent(__doc__).strip()
+    requires_model_validation = True
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--rebuild',
+            action='store_true',
+            dest='rebuild',
+            default=False,
+            help='Drop the whole index and build it from scratch.',
+        ),
+    )
+
+    def handle(self, rebuild=False, **options):
+        if rebuild:
+            DeviceSearchIndex.objects.all().delete()
+        count = DeviceSearchIndex.refresh()
+        print('%d devices indexed.' % count)
@@ -52,11 +52,14 @@ from ralph.discovery.models_component import (
     Storage,
 )
 from ralph.discovery.models_history import (
+    ChangeFeedEntry,
     DiscoveryValue,
     DiscoveryWarning,
     HistoryChange,
     HistoryCost,
 )
+from ralph.discovery.models_search import DeviceSearchIndex
+from ralph.discovery.models_summary import DeviceSummary
 from ralph.discovery.models_pricing import  (
     PricingAggregate,
     PricingGroup,
@@ -106,11 +109,15 @@ __all__ = [
     'SERIAL_BLACKLIST',
     'UptimeSupport',
 
+    'ChangeFeedEntry',
     'HistoryChange',
     'HistoryCost',
     'DiscoveryValue',
     'DiscoveryWarning',
 
+    'DeviceSearchIndex',
+    'DeviceSummary',
+
     'PricingAggregate',
     'PricingGroup',
     'PricingFormula',
@@ -12,6 +12,7 @@ import datetime
 from decimal import Decimal
 
 from django.db import models as db
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from lck.django.common.models import (TimeTrackable, Named,
     WithConcurrentGetOrCreate, MACAddressField, SavePrioritized)
@@ -19,6 +20,7 @@ from lck.django.choices import Choices
 from django.utils.html import escape
 
 from ralph.discovery.models_util import SavingUser
+from ralph.util.parse import version_key
 
 
 MAC_PREFIX_BLACKLIST = set([
@@ -99,6 +101,31 @@ def is_virtual_cpu(family):
     return any(virtual in family for virtual in CPU_VIRTUAL_LIST)
 
 
+def guess_core_count(model, cores):
+    """Guess the number of cores of a processor of the given model."""
+    if model:
+        return max(
+            1,
+            model.cores,
+            cores,
+            model.size,
+            cores_from_model(
+                model.name
+            ) if not is_virtual_cpu(model.name) else 1,
+        )
+    return max(1, cores)
+
+
+def count_cores(model, cores):
+    """
+    Return the number of cores of a processor of the given model with
+    `cores` stored in the database, the same as `Processor.get_cores`.
+    """
+    if model and model.cores:
+        return model.cores
+    return guess_core_count(model, cores)
+
+
 class EthernetSpeed(Choices):
     _ = Choices.Choice
 
@@ -469,17 +496,7 @@ class Processor(Component):
 
     def guess_core_count(self):
         """Guess the number of cores for a CPU model."""
-        if self.model:
-            return max(
-                1,
-                self.model.cores,
-                self.cores,
-                self.model.size,
-                cores_from_model(
-                    self.model.name
-                ) if not is_virtual_cpu(self.model.name) else 1,
-            )
-        return max(1, self.cores)
+        return guess_core_count(self.model, self.cores)
 
     def save(self, *args, **kwargs):
         if self.model:
@@ -574,6 +591,14 @@ class Software(Component):
         null=True, blank=True, default=None)
     version = db.CharField(verbose_name=_("version"), max_length=255,
                            null=True, blank=True, default=None)
+    # derived from ``label`` and ``version`` for the indexed version lookups
+    package_name = db.CharField(verbose_name=_("package name"),
+        max_length=255, blank=True, default='', db_index=True,
+        editable=False)
+    version_key = db.CharField(verbose_name=_("version key"), max_length=255,
+        blank=True, default='', db_index=True, editable=False)
+    insignificant_fields = Component.insignificant_fields | {
+        'package_name', 'version_key'}
 
     class Meta:
         verbose_name = _("software")
@@ -617,6 +642,45 @@ class Software(Component):
         #        existing objects?
         return software
 
+    @classmethod
+    def find(cls, name, operator=None, version=None):
+        """
+        Return the software whose package name starts with the given name,
+        optionally compared with the given version. The operator is one of
+        ``==``, ``>``, ``>=``, ``<``, ``<=`` or ``^=`` for the version prefix.
+        Only when no package name matches, the software whose model name or
+        model group name contains the given name is returned instead.
+        """
+
+        name = name.strip()
+        query = cls.objects.filter(package_name__startswith=name.lower())
+        if not query.exists():
+            query = cls.objects.filter(
+                db.Q(model__name__icontains=name) |
+                db.Q(model__group__name__icontains=name)
+            )
+        if not (operator and version):
+            return query
+        if operator == '^=':
+            return query.filter(version__startswith=version)
+        lookups = {
+            '==': 'version_key',
+            '>': 'version_key__gt',
+            '>=': 'version_key__gte',
+            '<': 'version_key__lt',
+            '<=': 'version_key__lte',
+        }
+        return query.filter(**{lookups[operator]: version_key(version)})
+
+
+@receiver(
+    db.signals.pre_save, sender=Software,
+    dispatch_uid='discovery.software.pre_save'
+)
+def software_pre_save(sender, instance, **kwargs):
+    instance.package_name = (instance.label or '').strip().lower()
+    instance.version_key = version_key(instance.version)
+
 
 class SplunkUsage(Component):
     day = db.DateField(verbose_name=_("day"), auto_now_add=True)
@@ -11,11 +11,13 @@ from __future__ import unicode_literals
 from datetime import datetime, date
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.db import models as db
 from django.db.models.signals import (post_save, pre_save, pre_delete,
                                       post_delete)
 from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
+from lck.django.common import nested_commit_on_success
 
 from ralph.cmdb.integration.splunk import log_change_to_splunk
 from ralph.discovery.models_device import (Device, DeprecationKind,
@@ -68,10 +70,90 @@ class HistoryChange(db.Model):
                 self.user, self.date, self.id)
 
 
+class ChangeFeedEntry(db.Model):
+    """
+    A single entry in the changed-since feed used by the API consumers.
+
+    Every time a tracked object changes, a new entry is added for it and the
+    older ones are removed, so the auto-incremented ``id`` works as the feed
+    position and the table holds about one row per object. The newest entry
+    is never removed, so the databases which reuse the highest freed id
+    can't give out an id twice.
+    """
+
+    date = db.DateTimeField(verbose_name=_("date"), default=datetime.now)
+    content_type = db.ForeignKey(ContentType, verbose_name=_("content type"))
+    object_id = db.PositiveIntegerField(verbose_name=_("object id"),
+                                        db_index=True)
+    deleted = db.BooleanField(verbose_name=_("deleted"), default=False)
+
+    class Meta:
+        verbose_name = _("change feed entry")
+        verbose_name_plural = _("change feed entries")
+        ordering = ('id',)
+
+    def __unicode__(self):
+        return "#{} {}.{} ({})".format(
+            self.id, self.content_type.model, self.object_id,
+            'deleted' if self.deleted else 'changed')
+
+    @classmethod
+    def touch(cls, model, object_id, deleted=False):
+        """
+        Move the object identified by ``model`` and ``object_id`` to the end
+        of the feed.
+        """
+
+        cls._touch(ContentType.objects.get_for_model(model), {object_id},
+                   deleted)
+
+    @classmethod
+    def touch_many(cls, model, object_ids, deleted=False):
+        """Move many objects of the same ``model`` to the end of the feed."""
+
+        cls._touch(ContentType.objects.get_for_model(model), set(object_ids),
+                   deleted)
+
+    @classmethod
+    @nested_commit_on_success
+    def _touch(cls, content_type, object_ids, deleted):
+        if not object_ids:
+            return
+        previous = list(cls.objects.filter(
+            content_type=content_type,
+            object_id__in=object_ids,
+        ).values_list('id', flat=True))
+        now = datetime.now()
+        cls.objects.bulk_create([
+            cls(
+                content_type=content_type,
+                object_id=object_id,
+                deleted=deleted,
+                date=now,
+            ) for object_id in sorted(object_ids)
+        ])
+        if previous:
+            cls.objects.filter(id__in=previous).delete()
+
+    @classmethod
+    def changed_since(cls, model, position):
+        """
+        Return a query with ids of objects of the given ``model`` changed after
+        the feed entry number ``position``.
+        """
+
+        return cls.objects.filter(
+            content_type=ContentType.objects.get_for_model(model),
+            id__gt=position,
+        ).values_list('object_id', flat=True)
+
+
 @receiver(post_save, sender=HistoryChange, dispatch_uid='ralph.history')
 def history_change_post_save(sender, instance, raw, using, **kwargs):
     if SPLUNK_HOST:
         log_change_to_splunk(instance, 'CHANGE_HISTORY')
+    if instance.device_id:
+        ChangeFeedEntry.touch(Device, instance.device_id)
 
 
 @receiver(post_save, sender=Device, dispatch_uid='ralph.history')
@@ -96,6 +178,46 @@ def device_post_save(sender, instance, raw, using, **kwargs):
         update_txt_records(instance)
 
 
+@receiver(post_save, sender=Device, dispatch_uid='ralph.history.feed')
+def device_feed_post_save(sender, instance, raw, using, created, **kwargs):
+    """
+    A hook for adding new devices to the change feed. Changes of existing
+    devices get there through their ``HistoryChange`` entries.
+    """
+
+    if created:
+        ChangeFeedEntry.touch(Device, instance.id)
+
+
+@receiver(post_delete, sender=Device, dispatch_uid='ralph.history.feed')
+@receiver(post_delete, sender=IPAddress, dispatch_uid='ralph.history.feed')
+def feed_post_delete(sender, instance, using, **kwargs):
+    """A hook for marking removed objects in the change feed."""
+
+    ChangeFeedEntry.touch(sender, instance.id, deleted=True)
+
+
+@receiver(post_save, sender=IPAddress, dispatch_uid='ralph.history.feed')
+def ipaddress_feed_post_save(sender, instance, raw, using, created,
+                             **kwargs):
+    """
+    A hook for adding IP addresses to the change feed. Pings and scans which
+    only refresh the bookkeeping fields are skipped.
+    """
+
+    ignore = {
+        'dead_ping_count',
+        'last_plugins',
+        'last_puppet',
+        'last_seen',
+    }
+    if created or any(
+        field not in ignore and field not in instance.insignificant_fields
+        for field in instance.dirty_fields
+    ):
+        ChangeFeedEntry.touch(IPAddress, instance.id)
+
+
 @receiver(pre_delete, sender=Device, dispatch_uid='ralph.history')
 def device_pre_delete(sender, instance, using, **kwargs):
     """
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Device search index models."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models as db, IntegrityError
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.translation import ugettext_lazy as _
+import django_rq
+from redis.exceptions import ConnectionError
+
+from ralph.discovery.models_device import (Device, DeviceModel,
+                                           DeviceModelGroup)
+from ralph.discovery.models_component import (
+    ComponentModel, ComponentModelGroup, DiskShare, DiskShareMount, Ethernet,
+    FibreChannel, GenericComponent, Memory, OperatingSystem, Processor,
+    Software, Storage)
+from ralph.discovery.models_network import IPAddress
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_CHUNK_SIZE = 500
+INDEX_QUEUE = 'device_search'
+# at most one refresh job is waiting in the queue during that many seconds
+INDEX_JOB_KEY = 'ralph_device_search_job'
+INDEX_JOB_TIMEOUT = 300
+# components with a label and a model, searched in the ``component`` field
+LABELED_COMPONENTS = (GenericComponent, FibreChannel, Storage, Memory,
+                      Processor)
+# all the component classes which have a ``model`` pointing to
+# a ``ComponentModel``
+MODELED_COMPONENTS = LABELED_COMPONENTS + (DiskShare, OperatingSystem,
+                                           Software, Ethernet)
+# the device lookups searched for the devices which aren't indexed yet, by
+# the field of the index they are gathered in
+FALLBACK_LOOKUPS = {
+    'name': [
+        'name__contains',
+        'ipaddress__hostname__icontains',
+    ],
+    'address': [
+        'ipaddress__address__icontains',
+    ],
+    'serial': [
+        'sn__icontains',
+        'ethernet__mac__icontains',
+        'genericcomponent__sn__icontains',
+        'diskshare__wwn',
+        'disksharemount__share__wwn',
+    ],
+    'model': [
+        'model__name__icontains',
+        'model__group__name__icontains',
+    ],
+    'component': [
+        'genericcomponent__label__icontains',
+        'genericcomponent__model__name__icontains',
+        'genericcomponent__model__group__name__icontains',
+        'ethernet__mac__icontains',
+        'fibrechannel__label__icontains',
+        'fibrechannel__model__name__icontains',
+        'fibrechannel__model__group__name__icontains',
+        'storage__label__icontains',
+        'storage__model__name__icontains',
+        'storage__model__group__name__icontains',
+        'memory__label__icontains',
+        'memory__model__name__icontains',
+        'memory__model__group__name__icontains',
+        'processor__label__icontains',
+        'processor__model__name__icontains',
+        'processor__model__group__name__icontains',
+        'disksharemount__share__label__icontains',
+        'disksharemount__share__wwn__icontains',
+        'disksharemount__share__model__name__icontains',
+        'operatingsystem__model__name__icontains',
+    ],
+    'software': [
+        'software__label__icontains',
+        'software__model__name__icontains',
+        'software__model__group__name__icontains',
+    ],
+}
+
+
+class DeviceSearchIndex(db.Model):
+    """
+    Denormalized, searchable copy of the device attributes which live in many
+    related tables. Every text field holds the distinct values of one search
+    category, one value per line, so a single ``icontains`` on this table
+    replaces a multi-table join with ``DISTINCT``.
+
+    The rows are removed whenever any of the indexed data changes and are
+    rebuilt in bulk by :meth:`refresh` for the devices which have none, in
+    a worker job queued on every change or by the ``searchindex`` command.
+    Until then :meth:`device_filter` searches those devices the old way,
+    through their related tables, so no device is ever missing from the
+    results.
+    """
+
+    device = db.OneToOneField(Device, verbose_name=_("device"),
+                              primary_key=True, related_name='search_index')
+    name = db.TextField(verbose_name=_("names"), default='')
+    address = db.TextField(verbose_name=_("addresses"), default='')
+    serial = db.TextField(verbose_name=_("serial numbers"), default='')
+    model = db.TextField(verbose_name=_("models"), default='')
+    component = db.TextField(verbose_name=_("components"), default='')
+    software = db.TextField(verbose_name=_("software"), default='')
+
+    class Meta:
+        verbose_name = _("device search index")
+        verbose_name_plural = _("device search index")
+
+    def __unicode__(self):
+        return 'search index of {}'.format(self.device_id)
+
+    @classmethod
+    def build(cls, device_ids):
+        """
+        Return unsaved index rows for the given devices, collected with a few
+        queries per related table instead of a few queries per device.
+        """
+
+        values = {}
+        for device_id in device_ids:
+            values[device_id] = {
+                'name': set(),
+                'address': set(),
+                'serial': set(),
+                'model': set(),
+                'component': set(),
+                'software': set(),
+            }
+
+        def add(field, rows):
+            for row in rows:
+                if row[0] not in values:
+                    continue
+                for value in row[1:]:
+                    if value:
+                        values[row[0]][field].add(unicode(value))
+
+        devices = Device.admin_objects.filter(id__in=device_ids)
+        add('name', devices.values_list('id', 'name'))
+        add('serial', devices.values_list('id', 'sn'))
+        add('model', devices.values_list('id', 'model__name',
+                                         'model__group__name'))
+        ips = IPAddress.objects.filter(device__in=device_ids)
+        add('name', ips.values_list('device_id', 'hostname'))
+        add('address', ips.values_list('device_id', 'address'))
+        for component in LABELED_COMPONENTS:
+            add('component', component.objects.filter(
+                device__in=device_ids,
+            ).values_list('device_id', 'label', 'model__name',
+                          'model__group__name'))
+        macs = Ethernet.objects.filter(
+            device__in=device_ids,
+        ).values_list('device_id', 'mac')
+        add('component', macs)
+        add('serial', macs)
+        add('serial', GenericComponent.objects.filter(
+            device__in=device_ids,
+        ).values_list('device_id', 'sn'))
+        add('serial', DiskShare.objects.filter(
+            device__in=device_ids,
+        ).values_list('device_id', 'wwn'))
+        mounts = DiskShareMount.objects.filter(device__in=device_ids)
+        add('component', mounts.values_list('device_id', 'share__label',
+                                            'share__wwn', 'share__model__name'))
+        add('serial', mounts.values_list('device_id', 'share__wwn'))
+        add('component', OperatingSystem.objects.filter(
+            device__in=device_ids,
+        ).values_list('device_id', 'model__name'))
+        add('software', Software.objects.filter(
+            device__in=device_ids,
+        ).values_list('device_id', 'label', 'model__name',
+                      'model__group__name'))
+        return [
+            cls(device_id=device_id, **dict(
+                (field, '\n'.join(sorted(field_values)))
+                for field, field_values in fields.iteritems()
+            )) for device_id, fields in values.iteritems()
+        ]
+
+    @classmethod
+    def refresh(cls, limit=None):
+        """
+        Index the devices which are missing from the index. Returns the number
+        of indexed devices.
+        """
+
+        missing = Device.admin_objects.filter(
+            search_index=None,
+        ).values_list('id', flat=True)
+        if limit:
+            missing = missing[:limit]
+        missing = list(missing)
+        for offset in xrange(0, len(missing), INDEX_CHUNK_SIZE):
+            chunk = missing[offset:offset + INDEX_CHUNK_SIZE]
+            try:
+                cls.objects.bulk_create(cls.build(chunk))
+            except IntegrityError:
+                # a concurrent refresh has indexed some of them already,
+                # fall back to indexing them one by one
+                for entry in cls.build(chunk):
+                    if not cls.objects.filter(
+                        device=entry.device_id,
+                    ).exists():
+                        entry.save()
+        return len(missing)
+
+    @classmethod
+    def invalidate(cls, device_ids):
+        """
+        Remove the index rows of the given devices and queue a job rebuilding
+        them.
+        """
+
+        device_ids = {device_id for device_id in device_ids if device_id}
+        if device_ids:
+            cls.objects.filter(device__in=device_ids).delete()
+            enqueue_index_refresh()
+
+    @classmethod
+    def search(cls, field, values):
+        """
+        Return a query for the ids of devices which have any of the values as
+        a substring in the given ``field`` of their index, usable as
+        a subquery in ``id__in`` lookups.
+        """
+
+        q = db.Q()
+        for value in values:
+            value = value.strip()
+            if value:
+                q |= db.Q(**{'%s__icontains' % field: value})
+        return cls.objects.filter(q).values_list('device_id', flat=True)
+
+    @classmethod
+    def device_filter(cls, field, values):
+        """
+        Return a filter for devices which have any of the values as
+        a substring in the given ``field`` of their index. The devices which
+        aren't indexed yet are matched with the ``FALLBACK_LOOKUPS`` of the
+        field instead.
+        """
+
+        fallback = db.Q()
+        for value in values:
+            value = value.strip()
+            if value:
+                for lookup in FALLBACK_LOOKUPS[field]:
+                    fallback |= db.Q(**{lookup: value})
+        if not fallback:
+            return db.Q()
+        return db.Q(id__in=cls.search(field, values)) | db.Q(
+            id__in=Device.admin_objects.filter(
+                fallback,
+                search_index=None,
+            ).values_list('id', flat=True),
+        )
+
+
+def refresh_index():
+    """The worker job queued by `enqueue_index_refresh`."""
+    cache.delete(INDEX_JOB_KEY)
+    DeviceSearchIndex.refresh()
+
+
+def enqueue_index_refresh():
+    """
+    Queue a job indexing the devices which are missing from the index, unless
+    one is already waiting in the ``device_search`` queue.
+    """
+    if not cache.add(INDEX_JOB_KEY, True, INDEX_JOB_TIMEOUT):
+        return
+    queue = django_rq.get_queue(
+        name=INDEX_QUEUE if INDEX_QUEUE in settings.RQ_QUEUES else 'default',
+    )
+    try:
+        queue.enqueue_call(func=refresh_index, result_ttl=0)
+    except ConnectionError:
+        # the searches index a few devices themselves
+        logger.warning('Could not queue the refresh of the search index.')
+
+
+@receiver(post_save, sender=Device, dispatch_uid='ralph.search')
+def device_search_post_save(sender, instance, raw, using, created, **kwargs):
+    """A hook for dropping the index of a device when its data changes."""
+
+    if not created and {'name', 'sn', 'model_id'} & set(
+            instance.dirty_fields):
+        DeviceSearchIndex.invalidate([instance.id])
+
+
+@receiver(post_save, sender=IPAddress, dispatch_uid='ralph.search')
+@receiver(post_save, sender=DiskShareMount, dispatch_uid='ralph.search')
+@receiver(post_save, sender=Ethernet, dispatch_uid='ralph.search')
+@receiver(post_save, sender=FibreChannel, dispatch_uid='ralph.search')
+@receiver(post_save, sender=GenericComponent, dispatch_uid='ralph.search')
+@receiver(post_save, sender=Memory, dispatch_uid='ralph.search')
+@receiver(post_save, sender=OperatingSystem, dispatch_uid='ralph.search')
+@receiver(post_save, sender=Processor, dispatch_uid='ralph.search')
+@receiver(post_save, sender=Software, dispatch_uid='ralph.search')
+@receiver(post_save, sender=Storage, dispatch_uid='ralph.search')
+def device_related_search_post_save(sender, instance, raw, using, created,
+                                    **kwargs):
+    """
+    A hook for dropping the index of a device when one of its components
+    changes, including the device it was moved away from. Pings and scans
+    which only refresh the bookkeeping fields are skipped.
+    """
+
+    ignore = {
+        'dead_ping_count',
+        'last_plugins',
+        'last_puppet',
+        'last_seen',
+    }
+    if created or any(
+        field not in ignore and field not in instance.insignificant_fields
+        for field in instance.dirty_fields
+    ):
+        DeviceSearchIndex.invalidate([
+            instance.device_id,
+            instance.dirty_fields.get('device_id'),
+        ])
+
+
+@receiver(post_delete, sender=IPAddress, dispatch_uid='ralph.search')
+@receiver(post_delete, sender=DiskShareMount, dispatch_uid='ralph.search')
+@receiver(post_delete, sender=Ethernet, dispatch_uid='ralph.search')
+@receiver(post_delete, sender=FibreChannel, dispatch_uid='ralph.search')
+@receiver(post_delete, sender=GenericComponent, dispatch_uid='ralph.search')
+@receiver(post_delete, sender=Memory, dispatch_uid='ralph.search')
+@receiver(post_delete, sender=OperatingSystem, dispatch_uid='ralph.search')
+@receiver(post_delete, sender=Processor, dispatch_uid='ralph.search')
+@receiver(post_delete, sender=Software, dispatch_uid='ralph.search')
+@receiver(post_delete, sender=Storage, dispatch_uid='ralph.search')
+def device_related_search_post_delete(sender, instance, using, **kwargs):
+    """A hook for dropping the index of a device when a component is gone."""
+
+    DeviceSearchIndex.invalidate([instance.device_id])
+
+
+@receiver(post_save, sender=DiskShare, dispatch_uid='ralph.search')
+@receiver(post_delete, sender=DiskShare, dispatch_uid='ralph.search')
+def diskshare_search_changed(sender, instance, using, **kwargs):
+    """
+    A hook for dropping the index of the device exporting a share and of all
+    the devices mounting it.
+    """
+
+    device_ids = set(DiskShareMount.objects.filter(
+        share=instance,
+    ).values_list('device_id', flat=True))
+    device_ids.add(instance.device_id)
+    DeviceSearchIndex.invalidate(device_ids)
+
+
+@receiver(post_save, sender=DeviceModel, dispatch_uid='ralph.search')
+@receiver(post_save, sender=DeviceModelGroup, dispatch_uid='ralph.search')
+def device_model_search_post_save(sender, instance, raw, using, **kwargs):
+    """A hook for dropping the index of devices of a renamed model."""
+
+    if not {'name', 'group_id'} & set(instance.dirty_fields):
+        return
+    if sender is DeviceModel:
+        devices = Device.admin_objects.filter(model=instance)
+    else:
+        devices = Device.admin_objects.filter(model__group=instance)
+    DeviceSearchIndex.invalidate(devices.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=ComponentModel, dispatch_uid='ralph.search')
+@receiver(post_save, sender=ComponentModelGroup, dispatch_uid='ralph.search')
+def component_model_search_post_save(sender, instance, raw, using, **kwargs):
+    """A hook for dropping the index of devices with a renamed component."""
+
+    if not {'name', 'group_id'} & set(instance.dirty_fields):
+        return
+    if sender is ComponentModel:
+        lookup = {'model': instance}
+    else:
+        lookup = {'model__group': instance}
+    device_ids = set()
+    for component in MODELED_COMPONENTS:
+        device_ids.update(component.objects.filter(
+            **lookup
+        ).values_list('device_id', flat=True))
+    device_ids.update(DiskShareMount.objects.filter(**dict(
+        ('share__%s' % key, value) for key, value in lookup.iteritems()
+    )).values_list('device_id', flat=True))
+    DeviceSearchIndex.invalidate(device_ids)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Device summary models."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models as db, IntegrityError
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.translation import ugettext_lazy as _
+import django_rq
+from redis.exceptions import ConnectionError
+
+from ralph.discovery.models_device import Device, DeviceModel, DeviceType
+from ralph.discovery.models_component import (
+    ComponentModel,
+    Memory,
+    Processor,
+    Storage,
+    count_cores,
+)
+from ralph.discovery.models_network import IPAddress
+
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_CHUNK_SIZE = 500
+SUMMARY_QUEUE = 'device_summary'
+# at most one refresh job is waiting in the queue during that many seconds
+SUMMARY_JOB_KEY = 'ralph_device_summary_job'
+SUMMARY_JOB_TIMEOUT = 300
+# the fields of the related objects which don't change the summaries
+IGNORED_FIELDS = {
+    'dead_ping_count',
+    'last_plugins',
+    'last_puppet',
+    'last_seen',
+}
+
+
+class DeviceSummary(db.Model):
+    """
+    Denormalized facts about a device which are otherwise computed from its
+    addresses and components on every use: the display name, the number of
+    cores, the memory and disk totals, the management address and the last
+    ping.
+
+    The last ping is updated in place. The rows are removed whenever any of
+    the other summarized data changes and are rebuilt in bulk for the devices which have none, by a queued job started
+    from the signals, by the ``devicesummary`` command, or on the first use by
+    :meth:`for_devices`.
+    """
+
+    device = db.OneToOneField(Device, verbose_name=_("device"),
+                              primary_key=True, related_name='summary')
+    name = db.CharField(verbose_name=_("name"), max_length=255, default='')
+    cores = db.PositiveIntegerField(verbose_name=_("number of cores"),
+                                    default=0)
+    memory = db.PositiveIntegerField(verbose_name=_("memory (MiB)"),
+                                     default=0)
+    disk = db.PositiveIntegerField(verbose_name=_("disk (MiB)"), default=0)
+    management = db.CharField(verbose_name=_("management address"),
+                              max_length=16, null=True, blank=True,
+                              default=None)
+    last_ping = db.DateTimeField(verbose_name=_("last ping"), null=True,
+                                 blank=True, default=None)
+
+    class Meta:
+        verbose_name = _("device summary")
+        verbose_name_plural = _("device summaries")
+
+    def __unicode__(self):
+        return 'summary of {}'.format(self.device_id)
+
+    @classmethod
+    def build(cls, device_ids):
+        """
+        Return unsaved summaries of the given devices, collected with a few
+        queries per related table instead of a few queries per device.
+        """
+
+        summaries = {}
+        for device_id, model_type, name, management in (
+            Device.admin_objects.filter(id__in=device_ids).values_list(
+                'id', 'model__type', 'name', 'management__address',
+            )
+        ):
+            summaries[device_id] = cls(
+                device_id=device_id,
+                management=management,
+            )
+            if model_type in (DeviceType.rack.id, DeviceType.data_center.id):
+                summaries[device_id].name = name or ''
+        # (address, hostname, is_management, last_seen) tuples per device
+        addresses = {}
+        for device_id, address, hostname, is_management, last_seen in (
+            IPAddress.objects.filter(device__in=device_ids).values_list(
+                'device_id', 'address', 'hostname', 'is_management',
+                'last_seen',
+            )
+        ):
+            addresses.setdefault(device_id, []).append(
+                (address, hostname, is_management, last_seen),
+            )
+        for device_id, ips in addresses.iteritems():
+            summary = summaries.get(device_id)
+            if summary is None:
+                continue
+            # the order of `Device.get_name`
+            ips.sort(key=lambda ip: ip[0], reverse=True)
+            ips.sort(
+                key=lambda ip: ip[3] or datetime.datetime.min,
+                reverse=True,
+            )
+            ips.sort(key=lambda ip: ip[2])
+            if not summary.name:
+                named = [ip for ip in ips if ip[1] is not None]
+                summary.name = (
+                    named[0][1] if named else ips[0][1] or ips[0][0]
+                )
+            # the order of `Device.find_management`
+            managed = sorted(
+                (ip[0] for ip in ips if ip[2]),
+                reverse=True,
+            )
+            if managed:
+                summary.management = managed[0]
+            pings = [ip[3] for ip in ips if ip[3]]
+            summary.last_ping = max(pings) if pings else None
+        processors = list(Processor.objects.filter(
+            device__in=device_ids,
+        ).values_list('device_id', 'model_id', 'cores'))
+        models = ComponentModel.objects.in_bulk(
+            {row[1] for row in processors if row[1]},
+        )
+        for device_id, model_id, cores in processors:
+            if device_id in summaries:
+                summaries[device_id].cores += count_cores(
+                    models.get(model_id),
+                    cores,
+                )
+        for field, component in (('memory', Memory), ('disk', Storage)):
+            for device_id, total in component.objects.filter(
+                device__in=device_ids,
+            ).values_list('device_id').annotate(db.Sum('size')).order_by():
+                if device_id in summaries:
+                    setattr(summaries[device_id], field, total or 0)
+        for summary in summaries.itervalues():
+            if not summary.name:
+                summary.name = 'unknown'
+        return summaries.values()
+
+    @classmethod
+    def _save_all(cls, summaries):
+        try:
+            cls.objects.bulk_create(summaries)
+        except IntegrityError:
+            # a concurrent refresh has built some of them already, fall back
+            # to saving them one by one
+            for summary in summaries:
+                if not cls.objects.filter(device=summary.device_id).exists():
+                    summary.save()
+
+    @classmethod
+    def refresh(cls, limit=None):
+        """
+        Summarize the devices which have no summary. Returns the number of
+        summarized devices.
+        """
+
+        missing = Device.admin_objects.filter(
+            summary=None,
+        ).values_list('id', flat=True)
+        if limit:
+            missing = missing[:limit]
+        missing = list(missing)
+        for offset in xrange(0, len(missing), SUMMARY_CHUNK_SIZE):
+            cls._save_all(cls.build(
+                missing[offset:offset + SUMMARY_CHUNK_SIZE],
+            ))
+        return len(missing)
+
+    @classmethod
+    def for_devices(cls, device_ids):
+        """
+        Return a dict of the summaries of the given devices by their ids,
+        building the missing ones.
+        """
+
+        device_ids = set(device_ids)
+        summaries = dict(
+            (summary.device_id, summary) for summary in
+            cls.objects.filter(device__in=device_ids)
+        ) if device_ids else {}
+        missing = [
+            device_id for device_id in device_ids
+            if device_id not in summaries
+        ]
+        for offset in xrange(0, len(missing), SUMMARY_CHUNK_SIZE):
+            built = cls.build(missing[offset:offset + SUMMARY_CHUNK_SIZE])
+            cls._save_all(built)
+            summaries.update(
+                (summary.device_id, summary) for summary in built
+            )
+        return summaries
+
+    @classmethod
+    def invalidate(cls, device_ids):
+        """
+        Remove the summaries of the given devices and queue a job rebuilding
+        them.
+        """
+
+        device_ids = {device_id for device_id in device_ids if device_id}
+        if device_ids:
+            cls.objects.filter(device__in=device_ids).delete()
+            enqueue_summary_refresh()
+
+    @classmethod
+    def update_last_ping(cls, device_id, last_ping):
+        """Move the last ping of the device forward to ``last_ping``."""
+
+        cls.objects.filter(
+            db.Q(last_ping__lt=last_ping) | db.Q(last_ping=None),
+            device=device_id,
+        ).update(last_ping=last_ping)
+
+
+def refresh_summaries():
+    """The worker job queued by `enqueue_summary_refresh`."""
+    cache.delete(SUMMARY_JOB_KEY)
+    DeviceSummary.refresh()
+
+
+def enqueue_summary_refresh():
+    """
+    Queue a job summarizing the devices which have no summary, unless one is
+    already waiting in the ``device_summary`` queue.
+    """
+    if not cache.add(SUMMARY_JOB_KEY, True, SUMMARY_JOB_TIMEOUT):
+        return
+    queue = django_rq.get_queue(
+        name=SUMMARY_QUEUE if SUMMARY_QUEUE in settings.RQ_QUEUES else
+        'default',
+    )
+    try:
+        queue.enqueue_call(func=refresh_summaries, result_ttl=0)
+    except ConnectionError:
+        # the summaries will be built when they are used
+        logger.warning('Could not queue the refresh of device summaries.')
+
+
+@receiver(post_save, sender=Device, dispatch_uid='ralph.summary')
+def device_summary_post_save(sender, instance, raw, using, created,
+                             **kwargs):
+    """A hook for dropping the summary of a device when its data changes."""
+
+    if not created and {'name', 'model_id', 'management_id'} & set(
+            instance.dirty_fields):
+        DeviceSummary.invalidate([instance.id])
+
+
+@receiver(post_save, sender=IPAddress, dispatch_uid='ralph.summary')
+@receiver(post_save, sender=Memory, dispatch_uid='ralph.summary')
+@receiver(post_save, sender=Processor, dispatch_uid='ralph.summary')
+@receiver(post_save, sender=Storage, dispatch_uid='ralph.summary')
+def device_related_summary_post_save(sender, instance, raw, using, created,
+                                     **kwargs):
+    """
+    A hook for dropping the summary of a device when one of its addresses or
+    components changes, including the device it was moved away from. Pings
+    only move the last ping of the summary forward.
+    """
+
+    if created or any(
+        field not in IGNORED_FIELDS and
+        field not in instance.insignificant_fields
+        for field in instance.dirty_fields
+    ):
+        DeviceSummary.invalidate([
+            instance.device_id,
+            instance.dirty_fields.get('device_id'),
+        ])
+    elif (sender is IPAddress and 'last_seen' in instance.dirty_fields and
+          instance.device_id and instance.last_seen):
+        DeviceSummary.update_last_ping(instance.device_id, instance.last_seen)
+
+
+@receiver(post_delete, sender=IPAddress, dispatch_uid='ralph.summary')
+@receiver(post_delete, sender=Memory, dispatch_uid='ralph.summary')
+@receiver(post_delete, sender=Processor, dispatch_uid='ralph.summary')
+@receiver(post_delete, sender=Storage, dispatch_uid='ralph.summary')
+def device_related_summary_post_delete(sender, instance, using, **kwargs):
+    """A hook for dropping the summary of a device when a component is gone."""
+
+    DeviceSummary.invalidate([instance.device_id])
+
+
+@receiver(post_save, sender=DeviceModel, dispatch_uid='ralph.summary')
+def device_model_summary_post_save(sender, instance, raw, using, **kwargs):
+    """A hook for dropping the summaries of devices of a retyped model."""
+
+    if 'type' in instance.dirty_fields:
+        DeviceSummary.invalidate(Device.admin_objects.filter(
+            model=instance,
+        ).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=ComponentModel, dispatch_uid='ralph.summary')
+def component_model_summary_post_save(sender, instance, raw, using,
+                                      **kwargs):
+    """A hook for dropping the summaries of devices with a changed CPU."""
+
+    if not {'name', 'cores', 'size'} & set(instance.dirty_fields):
+        return
+    DeviceSummary.invalidate(Processor.objects.filter(
+        model=instance,
+    ).values_list('device_id', flat=True))
@@ -10,6 +10,17 @@ from __future__ import unicode_literals
 import yaml
 
 
+try:
+    SafeLoader = yaml.CSafeLoader
+except AttributeError:
+    SafeLoader = yaml.SafeLoader
+
+
+class PuppetLoader(SafeLoader):
+    """Reads the Ruby objects and symbols as plain mappings and strings,
+    using the libyaml C parser when it's available."""
+
+
 def construct_ruby_object(loader, suffix, node):
     return loader.construct_yaml_map(node)
 
@@ -18,7 +29,9 @@ def construct_ruby_sym(loader, node):
     return loader.construct_yaml_str(node)
 
 
+PuppetLoader.add_multi_constructor(u"!ruby/object:", construct_ruby_object)
+PuppetLoader.add_constructor(u"!ruby/sym", construct_ruby_sym)
+
+
 def load(contents):
-    yaml.add_multi_constructor(u"!ruby/object:", construct_ruby_object)
-    yaml.add_constructor(u"!ruby/sym", construct_ruby_sym)
-    return yaml.load(contents)
+    return yaml.load(contents, Loader=PuppetLoader)
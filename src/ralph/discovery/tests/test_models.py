@@ -7,11 +7,27 @@ from __future__ import unicode_literals
 
 import datetime
 
+from django.core.cache import cache
 from django.test import TestCase
 import mock
 
-from ralph.discovery.models import DeviceType, Device, UptimeSupport
+from ralph.discovery.models import (
+    ChangeFeedEntry,
+    ComponentModel,
+    ComponentModelGroup,
+    Device,
+    DeviceSearchIndex,
+    DeviceSummary,
+    DeviceType,
+    Ethernet,
+    IPAddress,
+    Memory,
+    Processor,
+    Software,
+    UptimeSupport,
+)
 from ralph.discovery.models_history import HistoryChange
+from ralph.discovery.models_summary import SUMMARY_JOB_KEY
 
 
 class ModelsTest(TestCase):
@@ -64,6 +80,283 @@ class ModelsTest(TestCase):
         self.assertEqual(dev_db.sn, 'xaxaxa')
 
 
+class ChangeFeedTest(TestCase):
+    def test_device_changes(self):
+        dev = Device.create(
+            model_name='xxx',
+            model_type=DeviceType.unknown,
+            sn='xaxaxa',
+        )
+        other = Device.create(
+            model_name='xxx',
+            model_type=DeviceType.unknown,
+            sn='xbxbxb',
+        )
+        sequence = ChangeFeedEntry.objects.order_by('-id')[0].id
+        self.assertEqual(
+            list(ChangeFeedEntry.changed_since(Device, sequence)),
+            [],
+        )
+        dev.name = 'dev1'
+        dev.save()
+        self.assertEqual(
+            list(ChangeFeedEntry.changed_since(Device, sequence)),
+            [dev.id],
+        )
+        self.assertEqual(
+            ChangeFeedEntry.objects.filter(
+                content_type__model='device',
+                object_id=dev.id,
+            ).count(),
+            1,
+        )
+        self.assertEqual(
+            set(ChangeFeedEntry.changed_since(Device, 0)),
+            {dev.id, other.id},
+        )
+
+    def test_ip_changes(self):
+        ip = IPAddress(address='10.0.0.1')
+        ip.save()
+        sequence = ChangeFeedEntry.objects.order_by('-id')[0].id
+        ip.last_seen = datetime.datetime.now()
+        ip.save()
+        self.assertEqual(
+            list(ChangeFeedEntry.changed_since(IPAddress, sequence)),
+            [],
+        )
+        ip.hostname = 'host1.local'
+        ip.save()
+        self.assertEqual(
+            list(ChangeFeedEntry.changed_since(IPAddress, sequence)),
+            [ip.id],
+        )
+        ip_id = ip.id
+        ip.delete()
+        entry = ChangeFeedEntry.objects.get(
+            content_type__model='ipaddress',
+            object_id=ip_id,
+        )
+        self.assertTrue(entry.deleted)
+
+
+class DeviceSearchIndexTest(TestCase):
+    def setUp(self):
+        self.device = Device.create(
+            sn='sn-12345',
+            model_name='PowerEdge R610',
+            model_type=DeviceType.rack_server,
+        )
+        self.device.name = 'db1.local'
+        self.device.save()
+        IPAddress(address='10.0.0.1', device=self.device).save()
+        Ethernet(
+            device=self.device,
+            mac='DEADBEEFCAFE',
+            model=ComponentModel.objects.create(name='Broadcom BCM5709'),
+        ).save()
+
+    def test_search(self):
+        self.assertEqual(DeviceSearchIndex.refresh(), 1)
+        self.assertEqual(DeviceSearchIndex.refresh(), 0)
+        self.assertEqual(
+            list(DeviceSearchIndex.search('name', ['db1', 'nothing'])),
+            [self.device.id],
+        )
+        self.assertEqual(
+            list(DeviceSearchIndex.search('address', ['10.0.0.'])),
+            [self.device.id],
+        )
+        self.assertEqual(
+            list(DeviceSearchIndex.search('serial', ['beefcafe', 'sn-12'])),
+            [self.device.id],
+        )
+        self.assertEqual(
+            list(DeviceSearchIndex.search('model', ['poweredge'])),
+            [self.device.id],
+        )
+        self.assertEqual(
+            list(DeviceSearchIndex.search('software', ['db1'])),
+            [],
+        )
+
+    def test_invalidation(self):
+        DeviceSearchIndex.refresh()
+        self.device.last_seen = datetime.datetime.now()
+        self.device.save()
+        self.assertEqual(DeviceSearchIndex.refresh(), 0)
+        self.device.name = 'db2.local'
+        self.device.save()
+        self.assertEqual(DeviceSearchIndex.refresh(), 1)
+        IPAddress(address='10.0.0.2', device=self.device).save()
+        DeviceSearchIndex.refresh()
+        self.assertEqual(
+            list(DeviceSearchIndex.search('address', ['10.0.0.2'])),
+            [self.device.id],
+        )
+        self.device.ethernet_set.all().delete()
+        DeviceSearchIndex.refresh()
+        self.assertEqual(
+            list(DeviceSearchIndex.search('serial', ['beef'])),
+            [],
+        )
+
+    def test_unindexed_devices(self):
+        other = Device.create(
+            sn='sn-67890',
+            model_name='PowerEdge R610',
+            model_type=DeviceType.rack_server,
+        )
+        DeviceSearchIndex.refresh()
+        self.device.name = 'db2.local'
+        self.device.save()
+        # the renamed device isn't indexed until the worker runs
+        devices = Device.objects.filter(
+            DeviceSearchIndex.device_filter('name', ['db2']),
+        )
+        self.assertEqual(list(devices), [self.device])
+        devices = Device.objects.filter(
+            DeviceSearchIndex.device_filter('model', ['poweredge']),
+        ).order_by('id')
+        self.assertEqual(list(devices), [self.device, other])
+
+
+class DeviceSummaryTest(TestCase):
+    def setUp(self):
+        self.device = Device.create(
+            sn='sn-12345',
+            model_name='PowerEdge R610',
+            model_type=DeviceType.rack_server,
+        )
+        IPAddress(
+            address='10.0.0.1',
+            hostname='db1.local',
+            device=self.device,
+            last_seen=datetime.datetime(2013, 1, 1),
+        ).save()
+        IPAddress(
+            address='10.0.1.1',
+            is_management=True,
+            device=self.device,
+        ).save()
+        model = ComponentModel.objects.create(name='Xeon E5645', cores=6)
+        for index in (1, 2):
+            Processor(device=self.device, model=model, index=index).save()
+            Memory(device=self.device, size=4096, index=index).save()
+
+    def test_summary(self):
+        self.assertEqual(DeviceSummary.refresh(), 1)
+        self.assertEqual(DeviceSummary.refresh(), 0)
+        summary = DeviceSummary.objects.get(device=self.device)
+        self.assertEqual(summary.name, self.device.get_name())
+        self.assertEqual(summary.cores, self.device.get_core_count())
+        self.assertEqual(summary.cores, 12)
+        self.assertEqual(summary.memory, 8192)
+        self.assertEqual(summary.disk, 0)
+        self.assertEqual(
+            summary.management,
+            self.device.find_management().address,
+        )
+        self.assertEqual(summary.last_ping, self.device.get_last_ping())
+
+    @mock.patch('ralph.discovery.models_summary.django_rq')
+    def test_invalidation(self, django_rq):
+        DeviceSummary.refresh()
+        self.device.last_seen = datetime.datetime.now()
+        self.device.save()
+        self.assertEqual(DeviceSummary.refresh(), 0)
+        cache.delete(SUMMARY_JOB_KEY)
+        self.device.memory_set.all()[0].delete()
+        queue = django_rq.get_queue.return_value
+        self.assertEqual(queue.enqueue_call.call_count, 1)
+        # the queued job builds the summary again
+        queue.enqueue_call.call_args[1]['func']()
+        summaries = DeviceSummary.for_devices([self.device.id])
+        self.assertEqual(summaries[self.device.id].memory, 4096)
+        IPAddress(address='10.0.0.2', device=self.device).save()
+        self.assertFalse(
+            DeviceSummary.objects.filter(device=self.device).exists(),
+        )
+        summaries = DeviceSummary.for_devices([self.device.id])
+        self.assertEqual(
+            summaries[self.device.id].name,
+            self.device.get_name(),
+        )
+
+    @mock.patch('ralph.discovery.models_summary.django_rq')
+    def test_last_ping(self, django_rq):
+        DeviceSummary.refresh()
+        last_ping = DeviceSummary.objects.get(
+            device=self.device,
+        ).last_ping + datetime.timedelta(days=1)
+        ip = self.device.ipaddress_set.get(address='10.0.0.1')
+        ip.last_seen = last_ping
+        ip.save()
+        summary = DeviceSummary.objects.get(device=self.device)
+        self.assertEqual(summary.last_ping, last_ping)
+        self.assertEqual(summary.last_ping, self.device.get_last_ping())
+        ip.last_seen = last_ping - datetime.timedelta(hours=1)
+        ip.save()
+        summary = DeviceSummary.objects.get(device=self.device)
+        self.assertEqual(summary.last_ping, last_ping)
+        queue = django_rq.get_queue.return_value
+        self.assertEqual(queue.enqueue_call.call_count, 0)
+
+
+class SoftwareVersionTest(TestCase):
+    def setUp(self):
+        self.device = Device.create(
+            sn='sn-12345',
+            model_name='PowerEdge R610',
+            model_type=DeviceType.rack_server,
+        )
+        for version in ('0.9.8zh', '1.0.1e', '1.0.1g', '1.0.10'):
+            Software.create(
+                dev=self.device,
+                path='openssl - %s' % version,
+                model_name='openssl - %s' % version,
+                label='OpenSSL',
+                version=version,
+                priority=0,
+            )
+
+    def _versions(self, operator=None, version=None):
+        return sorted(
+            Software.find('openssl', operator, version).values_list(
+                'version', flat=True,
+            ),
+        )
+
+    def test_find(self):
+        self.assertEqual(len(self._versions()), 4)
+        self.assertEqual(self._versions('<', '1.0.1g'), ['0.9.8zh', '1.0.1e'])
+        self.assertEqual(self._versions('>', '1.0.9'), ['1.0.10'])
+        self.assertEqual(self._versions('==', '1.0.1G'), ['1.0.1g'])
+        self.assertEqual(self._versions('^=', '1.0.1'), [
+            '1.0.10', '1.0.1e', '1.0.1g',
+        ])
+        self.assertEqual(Software.find('openss').count(), 4)
+        # the names of the models and model groups are matched too
+        model = Software.objects.all()[0].model
+        self.assertEqual(Software.find(model.name).count(), 4)
+        model.group = ComponentModelGroup.objects.create(name='Crypto libs')
+        model.save()
+        self.assertEqual(Software.find('crypto', '>=', '1.0').count(), 3)
+        libcrypto = Software.create(
+            dev=self.device,
+            path='libcrypto',
+            model_name='openssl-libs',
+            label='libcrypto',
+            version='1.0.1e',
+            priority=0,
+        )
+        libcrypto.model = ComponentModel.objects.create(name='openssl-libs')
+        libcrypto.save()
+        # the model names are only searched when no package name matches
+        self.assertEqual(Software.find('openssl').count(), 4)
+        self.assertEqual(Software.find('openssl-libs').count(), 1)
+
+
 class MockDateTime(datetime.datetime):
     @classmethod
     def now(cls):
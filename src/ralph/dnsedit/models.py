@@ -23,7 +23,7 @@ class DHCPEntry(TimeTrackable):
                       default="", max_length=len('xxx.xxx.xxx.xxx'))
     number = db.BigIntegerField(
         _("IP address"), help_text=_("Presented as int."), editable=False,
-        unique=False, default=0
+        unique=False, default=0, db_index=True,
     )
 
     class Meta:
@@ -37,10 +37,10 @@ TEMPLATE_LOADERS = (
     'django.template.loaders.app_directories.Loader',
 )
 MIDDLEWARE_CLASSES = (
-    'django.middleware.gzip.GZipMiddleware',
+    'ralph.util.middleware.GZipMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
-    'lck.django.common.middleware.TimingMiddleware',
+    'ralph.util.middleware.TimingMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -336,7 +336,8 @@ API_THROTTLING = {
     'expiration': None,
 }
 RQ_QUEUE_LIST = ('reports', 'email', 'cmdb_git', 'cmdb_jira', 'cmdb_jira_int',
-                 'cmdb_zabbix', 'cmdb_assets')
+                 'cmdb_zabbix', 'cmdb_assets', 'cmdb_puppet', 'device_summary',
+                 'device_search')
 RQ_QUEUES = {
     'default': {
         'HOST': 'localhost',
@@ -1,3 +1,5 @@
 from django.db import models
 
-# Create your models here.
+# hook signals, don't remove this.
+import ralph.ui.sidebar_trees
+import ralph.ui.reports
@@ -5,10 +5,44 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from array import array
+from collections import namedtuple
 import datetime
+import logging
+import zlib
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
 from django.db.models.sql.aggregates import Aggregate
-from ralph.discovery.models import HistoryCost, DeviceType
+from django.dispatch import receiver
+from dj.choices import Choices
+import django_rq
+from redis.exceptions import ConnectionError
+
+from ralph.discovery.models import Device, HistoryCost, DeviceType
+
+
+logger = logging.getLogger(__name__)
+
+DEVICE_CHECKS_KEY = 'ralph_ui_device_checks'
+DEVICE_CHECKS_LOCK = 'ralph_ui_device_checks_lock'
+DEVICE_CHECKS_TIMEOUT = 24 * 3600
+DEVICE_CHECKS_QUEUE = 'reports'
+DEVICE_CHECKS_BATCH_SIZE = 500
+# the fields of a device which the checks look at
+CHECKED_FIELDS = (
+    'id',
+    'parent_id',
+    'deleted',
+    'deprecation_date',
+    'deprecation_kind_id',
+    'support_expiration_date',
+    'purchase_date',
+    'venture_id',
+    'venture_role_id',
+)
+CheckedDevice = namedtuple('CheckedDevice', CHECKED_FIELDS)
 
 
 class SpanSum(Aggregate):
@@ -113,3 +147,247 @@ def get_total_virtual_cores(query, start, end):
             end=end.strftime('%Y-%m-%d'),
         ),
     )['spansum'] or 0)/ days
+
+
+class DeviceCheck(Choices):
+    """
+    The device quality checks of the devices report. The `test` of a check
+    gets a `CheckedDevice`, the date of the report and the set of ids of the
+    deleted devices, the `column` is the device attribute shown with the
+    devices failing it.
+    """
+
+    _ = Choices.Choice
+
+    deprecation = _('Depreciation date').extra(
+        column='deprecation_date',
+        test=lambda dev, today, deleted: (
+            dev.deprecation_date is not None and
+            dev.deprecation_date <= datetime.datetime.combine(
+                today,
+                datetime.time(),
+            )
+        ),
+    )
+    no_deprecation = _('No depreciation date').extra(
+        column='deprecation_date',
+        test=lambda dev, today, deleted: dev.deprecation_date is None,
+    )
+    no_margin = _('No depreciation kind').extra(
+        column='deprecation_kind',
+        test=lambda dev, today, deleted: dev.deprecation_kind_id is None,
+    )
+    no_support = _('No support').extra(
+        column='support_expiration_date',
+        test=lambda dev, today, deleted: dev.support_expiration_date is None,
+    )
+    no_purchase = _('No purchase').extra(
+        column='purchase_date',
+        test=lambda dev, today, deleted: dev.purchase_date is None,
+    )
+    no_venture = _('No venture').extra(
+        column='venture',
+        test=lambda dev, today, deleted: dev.venture_id is None,
+    )
+    no_role = _('No venture role').extra(
+        column='venture_role',
+        test=lambda dev, today, deleted: dev.venture_role_id is None,
+    )
+    no_parent = _('No parent').extra(
+        column='parent',
+        test=lambda dev, today, deleted: (
+            dev.parent_id is None or dev.parent_id in deleted
+        ),
+    )
+
+
+def _run_checks(devices, today, deleted, failing):
+    checks = DeviceCheck(item=lambda check: check)
+    for dev in devices:
+        if dev.deleted:
+            continue
+        for check in checks:
+            if check.test(dev, today, deleted):
+                failing[check.name].add(dev.id)
+
+
+def run_device_checks(today=None):
+    """
+    Run all the device checks in a single pass over all the devices, loaded
+    with one query. Returns the date of the results and the sets of ids of
+    the devices failing each check, by the name of the check.
+    """
+
+    today = today or datetime.date.today()
+    devices = [
+        CheckedDevice(*row) for row in
+        Device.admin_objects.values_list(*CHECKED_FIELDS).iterator()
+    ]
+    deleted = {dev.id for dev in devices if dev.deleted}
+    failing = dict(
+        (check.name, set()) for check in DeviceCheck(item=lambda c: c)
+    )
+    _run_checks(devices, today, deleted, failing)
+    return {'date': today, 'failing': failing}
+
+
+def _pack_ids(ids):
+    """
+    Pack a set of ids into a compressed string of the differences between
+    the sorted ids, which is a small fraction of the size of a pickled set.
+    """
+
+    deltas = array(b'L')
+    last = 0
+    for id in sorted(ids):
+        deltas.append(id - last)
+        last = id
+    return zlib.compress(deltas.tostring())
+
+
+def _unpack_ids(data):
+    """Return the set of ids packed with `_pack_ids`."""
+
+    deltas = array(b'L')
+    deltas.fromstring(zlib.decompress(data))
+    ids = set()
+    last = 0
+    for delta in deltas:
+        last += delta
+        ids.add(last)
+    return ids
+
+
+def _check_key(name):
+    return '%s_%s' % (DEVICE_CHECKS_KEY, name)
+
+
+def load_device_checks():
+    """
+    Return the cached results of the device checks, or None when they, or
+    any of the checks, are missing.
+    """
+
+    names = [check.name for check in DeviceCheck(item=lambda c: c)]
+    cached = cache.get_many(
+        [DEVICE_CHECKS_KEY] + [_check_key(name) for name in names],
+    )
+    if DEVICE_CHECKS_KEY not in cached:
+        return None
+    failing = {}
+    for name in names:
+        data = cached.get(_check_key(name))
+        if data is None:
+            return None
+        failing[name] = _unpack_ids(data)
+    return {'date': cached[DEVICE_CHECKS_KEY], 'failing': failing}
+
+
+def store_device_checks(results):
+    """
+    Cache the results of the device checks. The ids failing each check are
+    stored packed under a separate key, so that the values stay well below
+    the size limit of memcached even for large numbers of devices. The date
+    is stored last, marking the results as complete.
+    """
+
+    cache.set_many(dict(
+        (_check_key(name), _pack_ids(ids))
+        for name, ids in results['failing'].iteritems()
+    ), DEVICE_CHECKS_TIMEOUT)
+    cache.set(DEVICE_CHECKS_KEY, results['date'], DEVICE_CHECKS_TIMEOUT)
+
+
+def refresh_device_checks():
+    """Run the device checks and cache the results. A worker job."""
+
+    results = run_device_checks()
+    store_device_checks(results)
+    return results
+
+
+def get_device_checks():
+    """
+    Return the cached results of the device checks, running them if they
+    are missing or from another day.
+    """
+
+    results = load_device_checks()
+    if results is None or results['date'] != datetime.date.today():
+        results = refresh_device_checks()
+    return results
+
+
+def invalidate_device_checks():
+    """Drop the cached results and queue a job running the checks again."""
+
+    cache.delete(DEVICE_CHECKS_KEY)
+    queue = django_rq.get_queue(
+        name=DEVICE_CHECKS_QUEUE if DEVICE_CHECKS_QUEUE in settings.RQ_QUEUES
+        else 'default',
+    )
+    try:
+        queue.enqueue_call(func=refresh_device_checks, result_ttl=0)
+    except ConnectionError:
+        # the checks will run when the report is shown
+        logger.warning('Could not queue the device checks.')
+
+
+def update_device_checks(device_ids):
+    """
+    Check the given devices again and update the cached results with them.
+    When another process is updating the results at the same time, they are
+    dropped and rebuilt instead.
+    """
+
+    if cache.get(DEVICE_CHECKS_KEY) is None:
+        return
+    if not cache.add(DEVICE_CHECKS_LOCK, True, 60):
+        invalidate_device_checks()
+        return
+    try:
+        results = load_device_checks()
+        if results is None:
+            return
+        device_ids = list(device_ids)
+        for offset in xrange(0, len(device_ids), DEVICE_CHECKS_BATCH_SIZE):
+            batch = device_ids[offset:offset + DEVICE_CHECKS_BATCH_SIZE]
+            devices = [
+                CheckedDevice(*row) for row in Device.admin_objects.filter(
+                    id__in=batch,
+                ).values_list(*CHECKED_FIELDS)
+            ]
+            deleted = set(Device.admin_objects.filter(
+                id__in={dev.parent_id for dev in devices if dev.parent_id},
+                deleted=True,
+            ).values_list('id', flat=True))
+            for failing in results['failing'].itervalues():
+                failing.difference_update(batch)
+            _run_checks(devices, results['date'], deleted, results['failing'])
+        store_device_checks(results)
+    finally:
+        cache.delete(DEVICE_CHECKS_LOCK)
+
+
+@receiver(post_save, sender=Device, dispatch_uid='ralph.ui.device_checks')
+def device_checks_post_save(sender, instance, raw, using, created, **kwargs):
+    """A hook for checking a device again after its checked fields changed."""
+
+    dirty = set(instance.dirty_fields)
+    if not created and not set(CHECKED_FIELDS) & dirty:
+        return
+    device_ids = [instance.id]
+    if 'deleted' in dirty:
+        # the children of a deleted device have no parent
+        device_ids.extend(Device.admin_objects.filter(
+            parent=instance,
+        ).values_list('id', flat=True))
+    update_device_checks(device_ids)
+
+
+@receiver(post_delete, sender=Device, dispatch_uid='ralph.ui.device_checks')
+def device_checks_post_delete(sender, instance, using, **kwargs):
+    """A hook for dropping the device checks when a device is removed."""
+
+    if cache.get(DEVICE_CHECKS_KEY) is not None:
+        invalidate_device_checks()
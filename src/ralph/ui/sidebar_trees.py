@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Process-wide trees of the ventures, networks and racks in the sidebars.
+
+Each tree is loaded once per process, in a few queries, and the sidebar
+menus are built from it. Saving or deleting any of the objects shown in
+a tree bumps a version number kept in the cache, so that every process
+loads that tree again on the next use. A page only renders the subtrees
+leading to the selected item; the other ones get a placeholder and are
+fetched with AJAX from `render_subtree` when they are expanded.
+
+The version numbers have to be shared by all the processes, so this needs
+a shared cache backend, like memcached. With a per-process cache, such as
+the default `LocMemCache`, only the process which saved the object loads
+the tree again; the other ones show the stale tree until the version
+expires after `VERSION_TIMEOUT`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import random
+import re
+import urllib
+
+from bob.menu import MenuItem
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.urlresolvers import reverse
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from ralph.account.models import Perm
+from ralph.business.models import Department, Venture
+from ralph.discovery.models import (
+    Device,
+    DeviceModel,
+    DeviceType,
+    Network,
+    NetworkKind,
+)
+from ralph.util import presentation
+
+
+VERSION_TIMEOUT = 30 * 24 * 3600
+# the fields of a device which are shown in the racks tree
+RACK_FIELDS = {'name', 'sn', 'parent_id', 'model_id', 'deleted'}
+
+
+def _normalize_venture(symbol):
+    """
+    >>> _normalize_venture('węgielek,Ziew')
+    u'w.gielek.ziew'
+    """
+    return re.sub(r'[^\w]', '.', symbol).lower()
+
+
+def _slug(sn):
+    return sn.replace(' ', '-').lower()
+
+
+def _get_identifier(asset):
+    if not asset:
+        return asset
+    return 'sn-%s' % _slug(asset.sn) if asset.sn else asset.id
+
+
+class TreeNode(object):
+    """A node of a sidebar tree, with the fields needed for its menu item."""
+
+    def __init__(self, id, parent_id=None, **kwargs):
+        self.id = id
+        self.parent_id = parent_id
+        self.__dict__.update(kwargs)
+
+
+class SidebarTree(object):
+    """
+    The nodes of a sidebar, with their children in the order of the menu.
+    Subclasses load the nodes and make the menu items out of them.
+    """
+
+    name = None
+    version_key = None
+    _instance = None
+    _version = None
+
+    def __init__(self, nodes):
+        """`nodes` is a list of `TreeNode` objects in the order of the menu."""
+        self.nodes = {}
+        self.roots = []
+        self.children = defaultdict(list)
+        for node in nodes:
+            self.nodes[node.id] = node
+            if node.parent_id is None:
+                self.roots.append(node)
+            else:
+                self.children[node.parent_id].append(node)
+
+    @classmethod
+    def load(cls):
+        raise NotImplementedError()
+
+    @classmethod
+    def get(cls):
+        """Return the tree, loading it if it's missing or stale."""
+        version = cache.get(cls.version_key)
+        if version is None:
+            cache.add(
+                cls.version_key,
+                random.randint(1, 2 ** 30),
+                VERSION_TIMEOUT,
+            )
+            version = cache.get(cls.version_key)
+        if cls._instance is None or cls._version != version:
+            cls._instance = cls.load()
+            cls._version = version
+        return cls._instance
+
+    @classmethod
+    def invalidate(cls):
+        """Make every process load the tree again."""
+        cls._instance = None
+        try:
+            cache.incr(cls.version_key)
+        except ValueError:
+            pass
+
+    @classmethod
+    def for_params(cls, params):
+        """Return the tree shown with the given query parameters."""
+        return cls.get()
+
+    def ancestors(self, node_id):
+        """Return the ids of the nodes above the given one."""
+        ids = []
+        node = self.nodes.get(node_id)
+        while node is not None and node.parent_id is not None:
+            ids.append(node.parent_id)
+            node = self.nodes.get(node.parent_id)
+        return ids
+
+    def is_allowed(self, profile, node_id):
+        """Can the user see the subtree of the given node?"""
+        return profile.is_active
+
+    def is_visible(self, node, params):
+        return True
+
+    def make_item(self, node, params):
+        raise NotImplementedError()
+
+    def get_children(self, node_id, params):
+        return [
+            node for node in self.children.get(node_id, [])
+            if self.is_visible(node, params)
+        ]
+
+    def menu(self, nodes, params, expanded=()):
+        """
+        Return the menu items of `nodes`. The children of the nodes with ids
+        in `expanded` are included, those of the other nodes are replaced
+        with a single item, which loads them when the node is expanded.
+        """
+        items = []
+        for node in nodes:
+            item = self.make_item(node, params)
+            children = self.get_children(node.id, params)
+            if children and node.id in expanded:
+                item.subitems = self.menu(children, params, expanded)
+                item.kwargs['collapsed'] = False
+            elif children:
+                item.subitems = [self.placeholder(node, params)]
+                item.kwargs['collapsed'] = True
+            item.kwargs['collapsible'] = True
+            items.append(item)
+        return items
+
+    def placeholder(self, node, params):
+        href = reverse('sidebar-subtree', args=[self.name, node.id])
+        query = dict((k, v) for k, v in params.iteritems() if v)
+        if query:
+            href += '?' + urllib.urlencode(dict(
+                (k, unicode(v).encode('utf-8')) for k, v in query.iteritems()
+            ))
+        return MenuItem(
+            'Loading...',
+            name='lazy-%s-%s' % (self.name, node.id),
+            fugue_icon='fugue-hourglass',
+            indent=' ',
+            href=href,
+        )
+
+
+class VentureTree(SidebarTree):
+    name = 'ventures'
+    version_key = 'ralph_ui_venture_tree_version'
+
+    @classmethod
+    def load(cls):
+        nodes = []
+        for venture in Venture.objects.select_related(
+            'department',
+        ).order_by('-is_infrastructure', 'name'):
+            symbol = _normalize_venture(venture.symbol)
+            nodes.append(TreeNode(
+                venture.id,
+                venture.parent_id,
+                name=venture.name,
+                symbol=symbol,
+                icon=presentation.get_venture_icon(venture),
+                show_in_ralph=venture.show_in_ralph,
+            ))
+        return cls(nodes)
+
+    def is_allowed(self, profile, node_id):
+        """The user needs access to the venture or one above it."""
+        if not profile.is_active:
+            return False
+        return profile.perm_ventures(Perm.list_devices_generic).filter(
+            id__in=[node_id] + self.ancestors(node_id),
+        ).exists()
+
+    def is_visible(self, node, params):
+        return params.get('show_all') or node.show_in_ralph
+
+    def make_item(self, node, params):
+        return MenuItem(
+            node.name,
+            name=node.symbol,
+            fugue_icon=node.icon,
+            view_name='ventures',
+            view_args=[node.symbol, params.get('details', ''), ''],
+            indent=' ',
+        )
+
+
+class NetworkTree(SidebarTree):
+    name = 'networks'
+    version_key = 'ralph_ui_network_tree_version'
+
+    def __init__(self, nodes):
+        """`nodes` are sorted by their first address, larger ones first."""
+        stack = []
+        for node in nodes:
+            while stack and not (
+                stack[-1].min_ip <= node.min_ip and
+                node.max_ip <= stack[-1].max_ip
+            ):
+                stack.pop()
+            node.parent_id = stack[-1].id if stack else None
+            stack.append(node)
+        super(NetworkTree, self).__init__(nodes)
+
+    @classmethod
+    def load(cls):
+        return cls([
+            TreeNode(
+                network.id,
+                name=network.name,
+                address=network.address,
+                icon=presentation.get_network_icon(network),
+                min_ip=network.min_ip,
+                max_ip=network.max_ip,
+            )
+            for network in Network.objects.select_related(
+                'kind',
+            ).order_by('min_ip', '-max_ip', 'id')
+        ])
+
+    def is_allowed(self, profile, node_id):
+        return profile.has_perm(Perm.read_network_structure)
+
+    @classmethod
+    def for_params(cls, params):
+        tree = cls.get()
+        contains = (params.get('contains') or '').lower()
+        if not contains:
+            return tree
+        nodes = sorted(tree.nodes.itervalues(), key=lambda node: (
+            node.min_ip, -node.max_ip, node.id,
+        ))
+        return cls([
+            TreeNode(**node.__dict__) for node in nodes
+            if contains in node.name.lower() or
+            contains in node.address.lower()
+        ])
+
+    def make_item(self, node, params):
+        return MenuItem(
+            node.address if params.get('show_ip') else node.name,
+            name=node.name,
+            fugue_icon=node.icon,
+            view_name='networks',
+            view_args=[
+                node.name,
+                params.get('details', ''),
+                params.get('status', ''),
+            ],
+            indent=' ',
+        )
+
+
+class RackTree(SidebarTree):
+    name = 'racks'
+    version_key = 'ralph_ui_rack_tree_version'
+
+    @classmethod
+    def load(cls):
+        data_centers = []
+        racks = []
+        for device in Device.objects.select_related('model').filter(
+            model__type__in=(DeviceType.data_center.id, DeviceType.rack.id),
+        ).order_by('name', 'id'):
+            if device.model.type == DeviceType.data_center.id:
+                data_centers.append(device)
+            else:
+                racks.append(device)
+        ids = {device.id for device in data_centers}
+        nodes = []
+        for device, parent_id in (
+            [(dc, None) for dc in data_centers] +
+            # racks outside of a data center aren't shown
+            [(r, r.parent_id) for r in racks if r.parent_id in ids]
+        ):
+            nodes.append(TreeNode(
+                device.id,
+                parent_id,
+                name=device.name,
+                identifier=_get_identifier(device),
+                icon=presentation.get_device_icon(device),
+            ))
+        return cls(nodes)
+
+    def is_allowed(self, profile, node_id):
+        return profile.has_perm(Perm.read_dc_structure)
+
+    def make_item(self, node, params):
+        return MenuItem(
+            node.name,
+            name=node.identifier,
+            fugue_icon=node.icon,
+            view_name='racks',
+            view_args=[node.identifier, params.get('details', ''), ''],
+            indent=' ',
+        )
+
+
+TREES = {tree.name: tree for tree in (VentureTree, NetworkTree, RackTree)}
+
+
+def render_subtree(name, node_id, params, profile):
+    """
+    Return the menu items of the children of a node, or None. Raises
+    `PermissionDenied` when the user with the given `profile` can't see it.
+    """
+    try:
+        tree = TREES[name].for_params(params)
+    except KeyError:
+        return None
+    if node_id not in tree.nodes:
+        return None
+    if not tree.is_allowed(profile, node_id):
+        raise PermissionDenied()
+    return tree.menu(tree.get_children(node_id, params), params)
+
+
+@receiver(post_save, sender=Venture, dispatch_uid='ralph.ui.venture_tree')
+@receiver(post_delete, sender=Venture, dispatch_uid='ralph.ui.venture_tree')
+@receiver(post_save, sender=Department, dispatch_uid='ralph.ui.venture_tree')
+@receiver(post_delete, sender=Department,
+          dispatch_uid='ralph.ui.venture_tree')
+def venture_tree_changed(sender, instance, **kwargs):
+    """A hook for reloading the ventures sidebar."""
+    VentureTree.invalidate()
+
+
+@receiver(post_save, sender=Network, dispatch_uid='ralph.ui.network_tree')
+@receiver(post_delete, sender=Network, dispatch_uid='ralph.ui.network_tree')
+@receiver(post_save, sender=NetworkKind,
+          dispatch_uid='ralph.ui.network_tree')
+@receiver(post_delete, sender=NetworkKind,
+          dispatch_uid='ralph.ui.network_tree')
+def network_tree_changed(sender, instance, **kwargs):
+    """A hook for reloading the networks sidebar."""
+    NetworkTree.invalidate()
+
+
+@receiver(post_save, sender=DeviceModel, dispatch_uid='ralph.ui.rack_tree')
+@receiver(post_delete, sender=DeviceModel,
+          dispatch_uid='ralph.ui.rack_tree')
+def rack_model_changed(sender, instance, **kwargs):
+    """A hook for reloading the racks sidebar after a model changed."""
+    if instance.type in (DeviceType.data_center.id, DeviceType.rack.id):
+        RackTree.invalidate()
+
+
+def _is_rack(device):
+    if RackTree._instance is not None and device.id in RackTree._instance.nodes:
+        return True
+    try:
+        model = device.model
+    except DeviceModel.DoesNotExist:
+        return False
+    return model is not None and model.type in (
+        DeviceType.data_center.id,
+        DeviceType.rack.id,
+    )
+
+
+@receiver(post_save, sender=Device, dispatch_uid='ralph.ui.rack_tree')
+def rack_saved(sender, instance, created, **kwargs):
+    """A hook for reloading the racks sidebar after a rack changed."""
+    if not created and not RACK_FIELDS & set(instance.dirty_fields):
+        return
+    if _is_rack(instance):
+        RackTree.invalidate()
+    elif 'model_id' in instance.dirty_fields:
+        # it could have been a rack before
+        RackTree.invalidate()
+
+
+@receiver(post_delete, sender=Device, dispatch_uid='ralph.ui.rack_tree')
+def rack_deleted(sender, instance, **kwargs):
+    """A hook for reloading the racks sidebar after a rack was deleted."""
+    if _is_rack(instance):
+        RackTree.invalidate()
@@ -166,6 +166,19 @@ $(function ($) {
     $('select#id_venture').change(venture_changed);
     $('select#id_venture').each(venture_changed);
 
+    /* Sidebar subtrees are loaded when they are expanded for the first time. */
+    $(document).on('show', 'ul.subitems', function (event) {
+        if (event.target !== this) {
+            return;
+        }
+        $(this).children('li[class*="menu-item-lazy-"]').each(function () {
+            var $placeholder = $(this);
+            $.get($placeholder.find('a').attr('href'), function (data) {
+                $placeholder.replaceWith(data);
+            });
+        });
+    });
+
     $('.datepicker').datepicker({format: 'yyyy-mm-dd', autoclose: true}).click(function(){
         $("input.datepicker[name!='" + $(this).attr('name') + "']").datepicker('hide');
     });
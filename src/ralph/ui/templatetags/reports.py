@@ -11,8 +11,9 @@ register = template.Library()
 
 
 @register.inclusion_tag('ui/templatetags/wait_for_results.html')
-def wait_for_results(autoreload=True, reload_frequency=60):
+def wait_for_results(autoreload=True, reload_frequency=60, progress=None):
     return {
         'autoreload': autoreload,
         'reload_frequency': reload_frequency * 1000,
+        'progress': progress,
     }
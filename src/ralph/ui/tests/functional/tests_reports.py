@@ -25,6 +25,11 @@ from ralph.discovery.models import (
     DeprecationKind,
     MarginKind,
 )
+from ralph.ui.reports import (
+    _pack_ids,
+    _unpack_ids,
+    load_device_checks,
+)
 from ralph.ui.tests.global_utils import login_as_su
 from ralph.ui.tests.util import create_device
 from ralph.util.pricing import get_device_price
@@ -332,6 +337,34 @@ class ReportsDevicesTest(TestCase):
         self.assertEqual(form[0][0], name)
         self.assertEqual(form[0][1], datetime.datetime(2005, 01, 02))
 
+    def test_no_parent(self):
+        url = '/ui/reports/devices/?no_venture=on&no_parent=on'
+        report = self.client.get(url, follow=True)
+        self.assertEqual(report.status_code, 200)
+        form = report.context['rows']
+        self.assertEqual(len(form), 1)
+        self.assertEqual(form[0][1:], [None, None])
+
+    def test_checks_follow_changes(self):
+        url = '/ui/reports/devices/?no_venture=on'
+        report = self.client.get(url, follow=True)
+        self.assertEqual(len(report.context['rows']), 1)
+        self.device_with_blanks.venture = self.venture
+        self.device_with_blanks.save()
+        # the cached results are updated in place
+        failing = load_device_checks()['failing']
+        self.assertNotIn(self.device_with_blanks.id, failing['no_venture'])
+        self.assertIn(self.device_with_blanks.id, failing['no_role'])
+        report = self.client.get(url, follow=True)
+        self.assertEqual(len(report.context['rows']), 0)
+
+    def test_packed_ids(self):
+        ids = set(xrange(1, 200000, 3)) | {2 ** 31 - 1}
+        packed = _pack_ids(ids)
+        self.assertLess(len(packed), 10000)
+        self.assertEqual(_unpack_ids(packed), ids)
+        self.assertEqual(_unpack_ids(_pack_ids(set())), set())
+
 
 class ReportsPriceDeviceVentureTest(TestCase):
     def setUp(self):
@@ -15,7 +15,9 @@ from ralph.discovery.models_component import (
 from ralph.discovery.models_history import HistoryChange
 from ralph.discovery.models_network import (
     IPAddress, NetworkTerminator, Network, DataCenter)
+from ralph.dnsedit.models import DHCPEntry
 from ralph.ui.tests.global_utils import login_as_su
+from ralph.util.network import ip_ranges
 
 DEVICE = {
     'name': 'SimpleDevice',
@@ -219,6 +221,31 @@ class SearchTest(TestCase):
         FIXME - i can`t tests network, i need more info !
         """
 
+    def test_address_ranges(self):
+        # the search form queries the database when it's imported
+        from ralph.ui.views.search import _search_ip_ranges
+
+        Ethernet(
+            device=self.diskshare_device,
+            mac='DEADBEEFCAFE',
+            model=self.cm_ethernet,
+        ).save()
+        DHCPEntry(mac='DEADBEEFCAFE', ip='10.0.0.50').save()
+
+        def search(*queries):
+            return set(Device.objects.filter(
+                _search_ip_ranges(ip_ranges(queries)),
+            ))
+
+        self.assertEqual(
+            search('10.0.0.'),
+            {self.device, self.diskshare_device},
+        )
+        self.assertEqual(search('10.0.0.50/32'), {self.diskshare_device})
+        self.assertEqual(search('10.0.0.1/32'), {self.device})
+        # only the prefixes of the addresses are matched
+        self.assertEqual(search('0.0.1'), set())
+
     def test_remarks_field(self):
         url = '/ui/search/info/%s' % self.device.id
         device_search = self.client.get(url)
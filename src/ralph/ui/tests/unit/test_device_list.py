@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+
+from django.test import TestCase
+
+from ralph.business.models import Venture, VentureRole
+from ralph.discovery.models import (
+    Device,
+    DeviceSummary,
+    DeviceType,
+    IPAddress,
+)
+from ralph.ui.views.devices import prefetch_columns
+from ralph.util.presentation import get_device_icon
+
+
+class PrefetchColumnsTest(TestCase):
+    def setUp(self):
+        venture = Venture(name='Venture', symbol='venture')
+        venture.save()
+        role = VentureRole(name='role', venture=venture)
+        role.save()
+        rack = Device.create(
+            sn='rack',
+            model_name='Rack',
+            model_type=DeviceType.rack,
+        )
+        for i in range(3):
+            device = Device.create(
+                sn='sn%d' % i,
+                model_name='Server',
+                model_type=DeviceType.rack_server,
+                parent=rack,
+                venture=venture,
+                venture_role=role,
+            )
+            for j in range(2):
+                IPAddress(
+                    address='10.0.%d.%d' % (i, j),
+                    device=device,
+                    last_seen=datetime.datetime(2013, 1, j + 1),
+                ).save()
+
+    def test_queries(self):
+        columns = ['venture', 'model', 'position', 'ips', 'lastping', 'cost']
+        devices = list(Device.objects.exclude(sn='rack').order_by('id'))
+        DeviceSummary.refresh()
+        with self.assertNumQueries(11):
+            prefetch_columns(devices, columns)
+        with self.assertNumQueries(0):
+            for device in devices:
+                get_device_icon(device)
+                device.venture.symbol
+                device.venture_role.full_name
+                device.get_model_name()
+                device.parent.model.type
+                self.assertEqual(len(device.ipaddress_set.all()), 2)
+                self.assertEqual(
+                    device.last_ping,
+                    datetime.datetime(2013, 1, 2),
+                )
+                self.assertFalse(device.has_splunk_usage)
+        with self.assertNumQueries(0):
+            prefetch_columns([], columns)
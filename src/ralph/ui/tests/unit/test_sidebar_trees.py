@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from ralph.business.models import Venture
+from ralph.discovery.models import DataCenter, Network
+from ralph.ui.sidebar_trees import NetworkTree, VentureTree
+from ralph.ui.tests.global_utils import login_as_su
+
+
+class NetworkTreeTest(TestCase):
+    def setUp(self):
+        NetworkTree.invalidate()
+        dc = DataCenter(name='dc')
+        dc.save()
+        self.networks = {}
+        for name, address in (
+            ('big', '10.0.0.0/16'),
+            ('small', '10.0.1.0/24'),
+            ('tiny', '10.0.1.0/28'),
+            ('other', '10.1.0.0/24'),
+        ):
+            network = Network(name=name, address=address, data_center=dc)
+            network.save()
+            self.networks[name] = network
+
+    def test_tree(self):
+        tree = NetworkTree.get()
+        big, small, tiny, other = (
+            self.networks[name] for name in ('big', 'small', 'tiny', 'other')
+        )
+        self.assertEqual(
+            [node.name for node in tree.roots],
+            ['big', 'other'],
+        )
+        self.assertEqual(tree.ancestors(tiny.id), [small.id, big.id])
+        filtered = NetworkTree.for_params({'contains': 'T'})
+        self.assertEqual(
+            [node.name for node in filtered.roots],
+            ['tiny', 'other'],
+        )
+        # the cached tree is kept until a network changes
+        with self.assertNumQueries(0):
+            self.assertIs(NetworkTree.get(), tree)
+        other.address = '10.0.2.0/24'
+        other.save()
+        tree = NetworkTree.get()
+        self.assertEqual([node.name for node in tree.roots], ['big'])
+        self.assertEqual(
+            [node.name for node in tree.children[big.id]],
+            ['small', 'other'],
+        )
+
+    def test_menu(self):
+        tree = NetworkTree.get()
+        params = {'details': 'info', 'status': ''}
+        items = tree.menu(tree.roots, params)
+        self.assertEqual(items[0].name, 'big')
+        self.assertTrue(items[0].kwargs['collapsed'])
+        self.assertEqual(len(items[0].subitems), 1)
+        self.assertEqual(
+            items[0].subitems[0].name,
+            'lazy-networks-%d' % self.networks['big'].id,
+        )
+        items = tree.menu(
+            tree.roots,
+            params,
+            expanded=tree.ancestors(self.networks['tiny'].id),
+        )
+        self.assertFalse(items[0].kwargs['collapsed'])
+        self.assertEqual(items[0].subitems[0].name, 'small')
+        self.assertEqual(items[0].subitems[0].subitems[0].name, 'tiny')
+        self.assertIsNone(items[0].subitems[0].subitems[0].subitems)
+
+
+class VentureTreeTest(TestCase):
+    def setUp(self):
+        VentureTree.invalidate()
+        self.client = login_as_su()
+        self.parent = Venture(
+            name='Parent',
+            symbol='parent',
+            show_in_ralph=True,
+        )
+        self.parent.save()
+        self.child = Venture(
+            name='Child',
+            symbol='child',
+            parent=self.parent,
+            show_in_ralph=True,
+        )
+        self.child.save()
+        self.hidden = Venture(
+            name='Hidden',
+            symbol='hidden',
+            parent=self.parent,
+            show_in_ralph=False,
+        )
+        self.hidden.save()
+
+    def test_subtree(self):
+        url = reverse('sidebar-subtree', args=['ventures', self.parent.id])
+        response = self.client.get(url, {'details': 'info'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Child', response.content)
+        self.assertNotIn('Hidden', response.content)
+        response = self.client.get(url, {'details': 'info', 'show_all': '1'})
+        self.assertIn('Hidden', response.content)
+        self.child.name = 'Renamed'
+        self.child.save()
+        response = self.client.get(url, {'details': 'info'})
+        self.assertIn('Renamed', response.content)
+        url = reverse('sidebar-subtree', args=['ventures', 0])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        url = reverse('sidebar-subtree', args=['nothing', self.parent.id])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_subtree_permissions(self):
+        client = login_as_su(
+            username='user',
+            is_staff=False,
+            is_superuser=False,
+        )
+        url = reverse('sidebar-subtree', args=['ventures', self.parent.id])
+        self.assertEqual(client.get(url).status_code, 403)
+        url = reverse('sidebar-subtree', args=['networks', 0])
+        self.assertEqual(client.get(url).status_code, 404)
@@ -10,7 +10,12 @@ from django.views.generic.simple import redirect_to
 
 from ralph.cmdb.views import Search as SearchCmdb
 
-from ralph.ui.views import typeahead_roles, unlock_field, logout
+from ralph.ui.views import (
+    logout,
+    sidebar_subtree,
+    typeahead_roles,
+    unlock_field,
+)
 from ralph.ui.views.common import Home, BulkEdit, ServerMove, ScanStatus, Scan
 from ralph.ui.views.ventures import (
     ReportVenturesDeviceList,
@@ -99,6 +104,8 @@ urlpatterns = patterns('',
     url(r'^logout/$', login_required(logout), {}, 'logout'),
     url(r'^typeahead/roles/$', login_required(typeahead_roles), {}, 'typeahead-roles'),
     url(r'^unlock-field/$', login_required(unlock_field), {}, 'unlock-field'),
+    url(r'^sidebar/(?P<tree>\w+)/(?P<node_id>\d+)/$',
+            login_required(sidebar_subtree), {}, 'sidebar-subtree'),
     url(r'^$', login_required(Home.as_view()), {}, 'home'),
 
     url(r'^(?P<section>\w+)/([^/]*/)?(?P<details>bulkedit)/$',
@@ -5,7 +5,8 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from django.shortcuts import get_object_or_404
-from django.http import Http404
+from django.http import Http404, HttpResponse
+from django.template.loader import render_to_string
 
 from django.views.decorators.csrf import csrf_exempt
 from ralph.util.views import jsonify
@@ -14,6 +15,11 @@ from django.http import HttpResponseRedirect
 
 from ralph.business.models import Venture
 from ralph.discovery.models_device import Device
+from ralph.ui.sidebar_trees import render_subtree
+
+
+SUBTREE_PARAMS = ('details', 'status', 'show_ip', 'show_all', 'contains',
+                  'selected')
 
 
 @csrf_exempt
@@ -50,6 +56,25 @@ def unlock_field(request):
     return {}
 
 
+def sidebar_subtree(request, tree, node_id):
+    """The menu items of a collapsed subtree of a sidebar."""
+    params = dict((key, request.GET.get(key, '')) for key in SUBTREE_PARAMS)
+    items = render_subtree(
+        tree,
+        int(node_id),
+        params,
+        request.user.get_profile(),
+    )
+    if items is None:
+        raise Http404("No such subtree.")
+    return HttpResponse(''.join(
+        render_to_string('bob/menu_item.html', {
+            'item': item,
+            'selected': params['selected'],
+        }) for item in items
+    ))
+
+
 def logout(request):
     auth.logout(request)
     return HttpResponseRedirect('/')
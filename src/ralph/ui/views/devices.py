@@ -4,20 +4,21 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import cStringIO as StringIO
 import datetime
 
-from bob import csvutil
-
 from django.contrib import messages
 from django.core.paginator import InvalidPage
+from django.db.models.query import prefetch_related_objects
 from django.http import Http404
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect
 from django.utils.translation import ugettext as _
 from django.views.generic import ListView
 
 from ralph.account.models import Perm
+from ralph.discovery.models_component import SplunkUsage
 from ralph.discovery.models_device import DeviceType
+from ralph.discovery.models_summary import DeviceSummary
+from ralph.util.views import iter_chunks, csv_response
 
 
 PAGE_SIZE = 25
@@ -46,6 +47,63 @@ DEVICE_SORT_COLUMNS = {
     'reports': ('remarks',),
 }
 
+# the relations used by each column of the device list, the None key is for
+# the name column which is always shown
+COLUMN_RELATIONS = {
+    None: ('model',),
+    'venture': ('venture', 'venture_role__parent__parent'),
+    'model': ('model__group',),
+    'margin': ('margin_kind', 'venture__margin_kind',
+               'venture__parent__margin_kind'),
+    'deprecation': ('deprecation_kind',),
+    'position': ('parent__model', 'parent__parent__model'),
+    'ips': ('ipaddress_set',),
+    'management': ('management',),
+}
+
+
+def _load_last_ping(devices):
+    summaries = DeviceSummary.for_devices(device.id for device in devices)
+    for device in devices:
+        summary = summaries.get(device.id)
+        device.last_ping = summary.last_ping if summary else None
+
+
+def _load_splunk_usage(devices):
+    with_usage = set(SplunkUsage.objects.filter(
+        device__in=[device.id for device in devices],
+    ).values_list('device', flat=True).distinct())
+    for device in devices:
+        device.has_splunk_usage = device.id in with_usage
+
+
+# the values computed for each column, after its relations were loaded
+COLUMN_LOADERS = {
+    'lastping': _load_last_ping,
+    'cost': _load_splunk_usage,
+}
+
+
+# the columns shown in the CSV export
+CSV_COLUMNS = ('venture', 'model', 'position', 'margin', 'deprecation', 'ips',
+               'management')
+
+
+def prefetch_columns(devices, columns):
+    """
+    Load everything shown in the `columns` of the device list for the whole
+    list of `devices`, with a query per relation instead of a few per row.
+    """
+    if not devices:
+        return
+    lookups = set(COLUMN_RELATIONS[None])
+    for column in columns:
+        lookups.update(COLUMN_RELATIONS.get(column, ()))
+    prefetch_related_objects(devices, sorted(lookups))
+    for column in sorted(set(columns)):
+        if column in COLUMN_LOADERS:
+            COLUMN_LOADERS[column](devices)
+
 
 def _get_show_tabs(request, venture, device):
     if device and not venture:
@@ -97,52 +155,60 @@ class BaseDeviceList(ListView):
     def export_csv(self, query=None):
         if query is None:
             query = self.get_queryset()
-        rows = [
-            ['Id', 'Name', 'Venture', 'Role', 'Model', 'Data Center', 'Rack',
-             'Position', 'Barcode', 'SN', 'Margin', 'Deprecation', 'Price',
-             'Monthly Cost', 'Addresses', 'Management', 'Created',
-             'Last Seen', 'Purchased', 'Warranty Expiration',
-             'Support Expiration', 'Support Kind', 'Remarks'],
-        ]
-        for dev in query.all():
-            show_tabs = set(_get_show_tabs(self.request, None, dev))
-            row = [
-                str(dev.id),
-                dev.name or '' if 'info' in show_tabs else '',
-                dev.venture.symbol if
-                    dev.venture and 'info' in show_tabs else '',
-                (dev.venture_role.full_name if dev.venture_role and
-                    'info' in show_tabs else ''),
-                dev.get_model_name() or '' if 'info' in show_tabs else '',
-                dev.dc or '' if 'info' in show_tabs else '',
-                dev.rack or '' if 'info' in show_tabs else '',
-                dev.get_position() if 'info' in show_tabs else '',
-                dev.barcode or '' if 'info' in show_tabs else '',
-                dev.sn or '' if 'info' in show_tabs else '',
-                str(dev.get_margin()) + '%' if 'prices' in show_tabs else '',
-                (dev.deprecation_kind.name if dev.deprecation_kind and
-                    'prices' in show_tabs else ''),
-                str(dev.cached_price) if 'prices' in show_tabs else '',
-                str(dev.cached_cost) if 'costs' in show_tabs else '',
-                ' '.join(ip.address for ip in dev.ipaddress_set.all()
-                    ) if 'info' in show_tabs else '',
-                dev.management or '' if 'info' in show_tabs else '',
-                dev.created or '' if 'history' in show_tabs else '',
-                dev.last_seen or '' if 'history' in show_tabs else '',
-                dev.purchase_date or '' if 'purchase' in show_tabs else '',
-                dev.warranty_expiration_date or
-                    '' if 'purchase' in show_tabs else '',
-                dev.support_expiration_date or '' if
-                    'purchase' in show_tabs else '',
-                dev.support_kind or '' if 'purchase' in show_tabs else '',
-                dev.remarks or '' if 'info' in show_tabs else '',
-            ]
-            rows.append([unicode(r) for r in row])
-        f = StringIO.StringIO()
-        csvutil.UnicodeWriter(f).writerows(rows)
-        response = HttpResponse(f.getvalue(), content_type="application/csv")
-        response['Content-Disposition'] = 'attachment; filename=ralph.csv'
-        return response
+        return csv_response(
+            self.iter_csv_rows(query),
+            filename='ralph.csv',
+        )
+
+    def iter_csv_rows(self, query):
+        """Yield the rows of the CSV export, loading the devices in chunks."""
+        yield ['Id', 'Name', 'Venture', 'Role', 'Model', 'Data Center',
+               'Rack', 'Position', 'Barcode', 'SN', 'Margin', 'Deprecation',
+               'Price', 'Monthly Cost', 'Addresses', 'Management', 'Created',
+               'Last Seen', 'Purchased', 'Warranty Expiration',
+               'Support Expiration', 'Support Kind', 'Remarks']
+        # the tabs shown depend only on the venture of the device
+        venture_tabs = {}
+        for chunk in iter_chunks(query):
+            prefetch_columns(chunk, CSV_COLUMNS)
+            for dev in chunk:
+                if dev.venture_id not in venture_tabs:
+                    venture_tabs[dev.venture_id] = set(
+                        _get_show_tabs(self.request, None, dev),
+                    )
+                show_tabs = venture_tabs[dev.venture_id]
+                yield [
+                    str(dev.id),
+                    dev.name or '' if 'info' in show_tabs else '',
+                    dev.venture.symbol if
+                        dev.venture and 'info' in show_tabs else '',
+                    (dev.venture_role.full_name if dev.venture_role and
+                        'info' in show_tabs else ''),
+                    dev.get_model_name() or '' if 'info' in show_tabs else '',
+                    dev.dc or '' if 'info' in show_tabs else '',
+                    dev.rack or '' if 'info' in show_tabs else '',
+                    dev.get_position() if 'info' in show_tabs else '',
+                    dev.barcode or '' if 'info' in show_tabs else '',
+                    dev.sn or '' if 'info' in show_tabs else '',
+                    str(dev.get_margin()) + '%'
+                        if 'prices' in show_tabs else '',
+                    (dev.deprecation_kind.name if dev.deprecation_kind and
+                        'prices' in show_tabs else ''),
+                    str(dev.cached_price) if 'prices' in show_tabs else '',
+                    str(dev.cached_cost) if 'costs' in show_tabs else '',
+                    ' '.join(ip.address for ip in dev.ipaddress_set.all()
+                        ) if 'info' in show_tabs else '',
+                    dev.management or '' if 'info' in show_tabs else '',
+                    dev.created or '' if 'history' in show_tabs else '',
+                    dev.last_seen or '' if 'history' in show_tabs else '',
+                    dev.purchase_date or '' if 'purchase' in show_tabs else '',
+                    dev.warranty_expiration_date or
+                        '' if 'purchase' in show_tabs else '',
+                    dev.support_expiration_date or '' if
+                        'purchase' in show_tabs else '',
+                    dev.support_kind or '' if 'purchase' in show_tabs else '',
+                    dev.remarks or '' if 'info' in show_tabs else '',
+                ]
 
     def user_allowed(self):
         return False
@@ -165,7 +231,7 @@ class BaseDeviceList(ListView):
         sort_columns = columns.get(sort.strip('-'), ())
         if sort.startswith('-'):
             sort_columns = ['-' + col for col in sort_columns]
-        if queryset and sort:
+        if sort:
             queryset = queryset.order_by(*sort_columns)
         self.sort = sort
         return queryset
@@ -175,20 +241,28 @@ class BaseDeviceList(ListView):
             queryset = super(BaseDeviceList, self).get_queryset()
         return self.sort_queryset(queryset, columns=DEVICE_SORT_COLUMNS)
 
+    def get_columns(self):
+        details = self.kwargs.get('details', 'info')
+        return self.details_columns.get(details, self.details_columns[None])
+
     def get_context_data(self, **kwargs):
         ret = super(BaseDeviceList, self).get_context_data(**kwargs)
-        details = self.kwargs.get('details', 'info')
+        columns = self.get_columns()
+        devices = list(
+            ret.get('object_list') or
+            getattr(ret.get('page_object'), 'object_list', None) or
+            []
+        )
+        prefetch_columns(devices, columns)
+        if ret.get('page_obj'):
+            ret['page_obj'].object_list = devices
         ret.update({
-            'columns': self.details_columns.get(details,
-                                                self.details_columns[None]),
+            'columns': columns,
             'show_tabs': _get_show_tabs(self.request, self.venture, None),
             'sort': self.sort,
             'now': datetime.datetime.now(),
             'device_types': DeviceType,
-            'object_list': (
-                ret.get('object_list') or
-                getattr(ret.get('page_object'), 'object_list', None)
-            ),
+            'object_list': devices,
         })
         return ret
 
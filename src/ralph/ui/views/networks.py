@@ -4,10 +4,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import collections
-
 from bob.menu import MenuItem
-from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from django.contrib import messages
 from django.http import HttpResponseRedirect
@@ -15,6 +12,7 @@ from django.http import HttpResponseRedirect
 from ralph.account.models import Perm
 from ralph.discovery.models import ReadOnlyDevice, Network, IPAddress
 from ralph.ui.forms import NetworksFilterForm
+from ralph.ui.sidebar_trees import NetworkTree
 from ralph.ui.views.common import (
     Addresses,
     Asset,
@@ -29,30 +27,9 @@ from ralph.ui.views.common import (
 )
 from ralph.ui.views.devices import BaseDeviceList
 from ralph.ui.views.reports import Reports, ReportDeviceList
-from ralph.util import presentation
 from ralph.scan import autoscan
 
 
-def network_tree_menu(networks, details, children, show_ip=False, status=''):
-    icon = presentation.get_network_icon
-    items = []
-    for n in networks:
-        items.append(MenuItem(
-            n.address if show_ip else n.name,
-            fugue_icon=icon(n),
-            view_name='networks',
-            indent=' ',
-            name=n.name,
-            view_args=[n.name, details, status],
-            subitems = network_tree_menu(
-                children[n.id], details, children, show_ip, status
-            ),
-            collapsible=True,
-            collapsed=not getattr(n, 'expanded', False),
-        ))
-    return items
-
-
 class SidebarNetworks(object):
     section = 'networks'
 
@@ -76,49 +53,23 @@ class SidebarNetworks(object):
         profile = self.request.user.get_profile()
         has_perm = profile.has_perm
         self.set_network()
-        networks = Network.objects.all()
-        contains =  self.request.GET.get('contains')
-        if contains:
-            networks = networks.filter(
-                    Q(name__contains=contains) |
-                    Q(address__contains=contains)
-                )
-        self.networks = list(networks.order_by('min_ip', '-max_ip'))
-        stack = []
-        children = collections.defaultdict(list)
-        for network in self.networks:
-            network.parent = None
-            while stack:
-                if network in stack[-1]:
-                    network.parent = stack[-1]
-                    children[stack[-1].id].append(network)
-                    break
-                else:
-                    stack.pop()
-            if network.parent:
-                network.depth = network.parent.depth + 1
-            else:
-                network.depth = 0
-            network.indent = ' ' * network.depth
-            stack.append(network)
-            if network == self.network:
-                parent = getattr(network, 'parent', None)
-                while parent:
-                    parent.expanded = True
-                    parent = getattr(parent, 'parent', None)
+        params = {
+            'details': ret['details'],
+            'status': self.status,
+            'show_ip': self.request.GET.get('show_ip'),
+            'contains': self.request.GET.get('contains'),
+            'selected': self.network.name if self.network else '',
+        }
+        tree = NetworkTree.for_params(params)
         sidebar_items = [MenuItem(fugue_icon='fugue-prohibition',
                                   label="None", name='',
                                   view_name='networks',
                                   view_args=['-', ret['details'], self.status])]
-        sidebar_items.extend(
-            network_tree_menu(
-                [n for n in self.networks if n.parent is None],
-                ret['details'],
-                children,
-                show_ip=self.request.GET.get('show_ip'),
-                status=self.status,
-            ),
-        )
+        sidebar_items.extend(tree.menu(
+            tree.roots,
+            params,
+            expanded=tree.ancestors(self.network.id) if self.network else (),
+        ))
         if has_perm(Perm.edit_device_info_generic) and not self.object:
             ret['tab_items'].extend([
                 MenuItem('Autoscan', fugue_icon='fugue-radar',
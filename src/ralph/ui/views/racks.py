@@ -17,6 +17,7 @@ from django.views.generic import CreateView
 from ralph.account.models import Perm
 from ralph.discovery.models import ReadOnlyDevice, Device, DeviceType
 from ralph.ui.forms.devices import DeviceCreateForm
+from ralph.ui.sidebar_trees import RackTree, _get_identifier
 from ralph.ui.views.common import (
     Info,
     Prices,
@@ -33,7 +34,6 @@ from ralph.ui.views.common import (
 )
 from ralph.ui.views.devices import BaseDeviceList
 from ralph.ui.views.reports import Reports, ReportDeviceList
-from ralph.util import presentation
 
 
 class BaseRacksMixin(object):
@@ -69,16 +69,6 @@ class BaseRacksMixin(object):
             self.rack = ''
 
 
-def _slug(sn):
-    return sn.replace(' ', '-').lower()
-
-
-def _get_identifier(asset):
-    if not asset:
-        return asset
-    return 'sn-%s' % _slug(asset.sn) if asset.sn else asset.id
-
-
 class SidebarRacks(BaseRacksMixin):
     section = 'racks'
 
@@ -89,7 +79,11 @@ class SidebarRacks(BaseRacksMixin):
     def get_context_data(self, **kwargs):
         self.set_rack()
         ret = super(SidebarRacks, self).get_context_data(**kwargs)
-        icon = presentation.get_device_icon
+        params = {
+            'details': ret['details'],
+            'selected': _get_identifier(self.rack) or '',
+        }
+        tree = RackTree.get()
         sidebar_items = [
             MenuItem(
                 "Unknown",
@@ -99,45 +93,10 @@ class SidebarRacks(BaseRacksMixin):
                 view_args=['-', ret['details'], '']
             )
         ]
-        for dc in Device.objects.filter(
-                model__type=DeviceType.data_center.id).order_by('name'):
-            subitems = []
-            sidebar_items.append(
-                MenuItem(
-                    dc.name,
-                    name=_get_identifier(dc),
-                    fugue_icon=icon(dc),
-                    view_name='racks',
-                    subitems=subitems,
-                    indent=' ',
-                    view_args=[
-                        _get_identifier(dc), ret['details'], ''
-                    ],
-                    collapsible=True,
-                    collapsed=not (
-                        self.rack and (
-                            self.rack == dc or self.rack.parent == dc
-                        )
-                    )
-                )
-            )
-            for r in Device.objects.filter(
-                model__type=DeviceType.rack.id
-            ).filter(
-                parent=dc
-            ).order_by('name'):
-                subitems.append(
-                    MenuItem(
-                        r.name,
-                        name=_get_identifier(r),
-                        indent=' ',
-                        fugue_icon=icon(r),
-                        view_name='racks',
-                        view_args=[
-                            _get_identifier(r), ret['details'], ''
-                        ]
-                    )
-                )
+        expanded = ()
+        if self.rack:
+            expanded = [self.rack.id] + tree.ancestors(self.rack.id)
+        sidebar_items.extend(tree.menu(tree.roots, params, expanded))
         ret.update({
             'sidebar_items': sidebar_items,
             'sidebar_selected': _get_identifier(self.rack),
@@ -7,19 +7,18 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import itertools
 
 from django.conf import settings
 from django.contrib import messages
 from django.core.cache import DEFAULT_CACHE_ALIAS, get_cache
 from django.db import models as db
-from django.db.models import Q
 from django.http import HttpResponseRedirect
 from django.utils.safestring import mark_safe
 from django.utils.html import escape
 from django.utils.translation import ugettext_lazy as _
 
 from bob.menu import MenuItem
-from bob.csvutil import make_csv_response
 from dj.choices import Choices
 import django_rq
 
@@ -42,6 +41,8 @@ from ralph.discovery.models import (
 )
 from ralph.ui.forms import DateRangeForm, MarginsReportForm
 from ralph.ui.reports import (
+    DeviceCheck,
+    get_device_checks,
     get_total_cores,
     get_total_cost,
     get_total_count,
@@ -58,10 +59,18 @@ from ralph.ui.forms.reports import (
     WarrantyRangeReportForm,
 )
 from ralph.util.async_reports import (
+    ChunkedResult,
+    ChunkExpired,
     get_cache_key,
     async_report_provider,
+    Progress,
 )
 from ralph.util.presentation import get_device_icon, get_venture_icon
+from ralph.util.views import (
+    CSV_BATCH_SIZE,
+    iter_chunks,
+    csv_response,
+)
 
 
 def threshold(days):
@@ -252,6 +261,7 @@ class SidebarReports(object):
 
 class AsyncReportMixin(object):
     data_provider = None
+    report_progress = None
 
     def get_data(self, *args, **kwargs):
         cache_key = get_cache_key(
@@ -264,7 +274,16 @@ class AsyncReportMixin(object):
         )
         data = cache.get(cache_key)
         if data is not None:
-            return None if data == 'in progress' else data
+            if data == 'in progress':
+                self.report_progress = 0
+                return None
+            if getattr(self.data_provider, 'async_report_chunked', False):
+                if not data['finished']:
+                    self.report_progress = int(data['progress'] * 100)
+                    return None
+                return ChunkedResult(cache, cache_key, data)
+            return data
+        self.report_progress = 0
         cache.set(
             cache_key,
             'in progress',
@@ -296,6 +315,11 @@ class AsyncReportMixin(object):
         data = cache.get(cache_key)
         if data is None or data == 'in progress':
             return
+        if getattr(self.data_provider, 'async_report_chunked', False):
+            if not data['finished']:
+                return
+            ChunkedResult(cache, cache_key, data).delete()
+            return
         cache.delete(cache_key)
 
 
@@ -618,8 +642,8 @@ class ReportVentures(SidebarReports, AsyncReportMixin, Base):
             self.venture_data = []
         if (self.request.GET.get('export') == 'csv' and
             self.venture_data is not None):
-            return make_csv_response(
-                data=self.export_csv(self.venture_data, self.extra_types),
+            return csv_response(
+                rows=self.export_csv(self.venture_data, self.extra_types),
                 filename='ReportVentures.csv',
             )
         return super(ReportVentures, self).get(*args, **kwargs)
@@ -633,6 +657,7 @@ class ReportVentures(SidebarReports, AsyncReportMixin, Base):
             'profile': self.request.user.get_profile(),
             'extra_types': self.extra_types,
             'task_in_progress': self.task_in_progress,
+            'report_progress': self.report_progress,
         })
         return context
 
@@ -717,10 +742,12 @@ class ReportDeviceList(object):
         result.update({
             'report_menu_items': report_menu_items,
             'report_selected': report_type.desc.lower(),
-            'columns': report_type.columns,
         })
         return result
 
+    def get_columns(self):
+        return self.get_report_type().columns
+
     def get_queryset(self, queryset=None):
         if queryset is None:
             queryset = super(ReportDeviceList, self).get_queryset()
@@ -744,6 +771,21 @@ class ReportDevices(SidebarReports, Base):
         html = '<a href="/ui/search/info/%s">%s</a> (%s)' % (id, name, id)
         return mark_safe(html)
 
+    def iter_devices(self, devices):
+        for chunk in iter_chunks(devices):
+            for dev in chunk:
+                yield dev
+
+    def iter_devices_by_ids(self, device_ids):
+        device_ids = sorted(device_ids)
+        for offset in xrange(0, len(device_ids), CSV_BATCH_SIZE):
+            for dev in Device.objects.filter(
+                id__in=device_ids[offset:offset + CSV_BATCH_SIZE],
+            ).select_related(
+                'venture', 'venture_role', 'deprecation_kind', 'parent',
+            ).order_by('id'):
+                yield dev
+
     @ralph_permission(perms)
     def get(self, *args, **kwargs):
         self.perm_edit = False
@@ -755,61 +797,25 @@ class ReportDevices(SidebarReports, Base):
         }
         # Filtering of the cross
         self.form_choice = DevicesChoiceReportForm(request)
-        queries = {Q()}
         headers = ['Name']
-        dep = self.request.GET.get('deprecation')
-        no_dep = self.request.GET.get('no_deprecation')
-        no_mar = self.request.GET.get('no_margin')
-        no_sup = self.request.GET.get('no_support')
-        no_pur = self.request.GET.get('no_purchase')
-        no_ven = self.request.GET.get('no_venture')
-        no_rol = self.request.GET.get('no_role')
-        no_par = self.request.GET.get('no_parent')
-        rows = []
-        if dep:
-            headers.append('Depreciation date')
-            queries.update({Q(deprecation_date__lte=datetime.date.today())})
-        if no_dep:
-            headers.append('No depreciation date')
-            queries.update({Q(deprecation_date=None)})
-        if no_mar:
-            headers.append('No depreciation kind')
-            queries.update({Q(deprecation_kind=None)})
-        if no_sup:
-            headers.append('No support')
-            queries.update({Q(support_expiration_date=None)})
-        if no_pur:
-            headers.append('No purchase')
-            queries.update({Q(purchase_date=None)})
-        if no_ven:
-            headers.append('No venture')
-            queries.update({Q(venture=None)})
-        if no_rol:
-            headers.append('No venture role')
-            queries.update({Q(venture_role=None)})
-        if no_par:
-            headers.append('No parent')
-            queries.update({Q(parent=None) | Q(p_deleted=True)})
-        if len(queries) > 1:
-            devices = Device.objects.filter(*queries)
-            for dev in devices:
-                row = []
-                row.append(self.get_name(dev.name, dev.id))
-                if dep:
-                    row.append(dev.deprecation_date)
-                if no_dep:
-                    row.append(dev.deprecation_date)
-                if no_mar:
-                    row.append(dev.deprecation_kind)
-                if no_sup:
-                    row.append(dev.support_expiration_date)
-                if no_pur:
-                    row.append(dev.purchase_date)
-                if no_ven:
-                    row.append(dev.venture)
-                if no_rol:
-                    row.append(dev.venture_role)
-                rows.append(row)
+        sources = []
+        checks = [
+            check for check in DeviceCheck(item=lambda check: check)
+            if request.get(check.name)
+        ]
+        if checks:
+            headers.extend(check.desc for check in checks)
+            failing = get_device_checks()['failing']
+            device_ids = set.intersection(*(
+                failing[check.name] for check in checks
+            ))
+
+            def cross_rows(device_ids):
+                for dev in self.iter_devices_by_ids(device_ids):
+                    row = [self.get_name(dev.name, dev.id)]
+                    row.extend(getattr(dev, check.column) for check in checks)
+                    yield row
+            sources.append(cross_rows(device_ids))
         # Filtering of the range
         # Support range
         s_start = self.request.GET.get('s_start', None)
@@ -818,15 +824,15 @@ class ReportDevices(SidebarReports, Base):
             self.form_support_range = SupportRangeReportForm(request)
             if self.form_support_range.is_valid():
                 headers = ('Name', 'Support expiration date')
-                rows.extend([
+                sources.append((
                     (
                         self.get_name(dev.name, dev.id),
                         dev.support_expiration_date,
-                    ) for dev in Device.objects.filter(
+                    ) for dev in self.iter_devices(Device.objects.filter(
                         support_expiration_date__gte=s_start,
                         support_expiration_date__lte=s_end,
-                    )
-                ])
+                    ))
+                ))
         else:
             self.form_support_range = SupportRangeReportForm(initial={
                 's_start': datetime.date.today() - datetime.timedelta(days=30),
@@ -839,15 +845,15 @@ class ReportDevices(SidebarReports, Base):
             self.form_deprecation_range = DeprecationRangeReportForm(request)
             if self.form_deprecation_range.is_valid():
                 headers = ('Name', 'Depreciation date')
-                rows.extend([
+                sources.append((
                     (
                         self.get_name(dev.name, dev.id),
                         dev.deprecation_date,
-                    ) for dev in Device.objects.filter(
+                    ) for dev in self.iter_devices(Device.objects.filter(
                         deprecation_date__gte=d_start,
                         deprecation_date__lte=d_end,
-                    )
-                ])
+                    ))
+                ))
         else:
             self.form_deprecation_range = DeprecationRangeReportForm(initial={
                 'd_start': datetime.date.today() - datetime.timedelta(days=30),
@@ -860,15 +866,15 @@ class ReportDevices(SidebarReports, Base):
             self.form_warranty_range = WarrantyRangeReportForm(request)
             if self.form_warranty_range.is_valid():
                 headers = ('Name', 'Warranty expiration date')
-                rows.extend([
+                sources.append((
                     (
                         self.get_name(dev.name, dev.id),
                         dev.warranty_expiration_date,
-                    ) for dev in Device.objects.filter(
+                    ) for dev in self.iter_devices(Device.objects.filter(
                         warranty_expiration_date__gte=w_start,
                         warranty_expiration_date__lte=w_end,
-                    )
-                ])
+                    ))
+                ))
         else:
             self.form_warranty_range = WarrantyRangeReportForm(initial={
                 'w_start': datetime.date.today() - datetime.timedelta(days=30),
@@ -905,8 +911,8 @@ class ReportDevices(SidebarReports, Base):
                 'Device', 'Model', 'SN', 'Barcode', 'Auto price', 'Venture',
                 'Role', 'Remarks', 'Verified', 'Deleted',
             ]
-            for dev in show_devices:
-                rows.append([
+            sources.append((
+                [
                     dev.name,
                     dev.model,
                     dev.sn,
@@ -917,15 +923,17 @@ class ReportDevices(SidebarReports, Base):
                     dev.remarks,
                     dev.verified,
                     dev.deleted,
-                ])
+                ] for dev in self.iter_devices(
+                    show_devices.select_related('model', 'venture'),
+                )
+            ))
         if request.get('export') == 'csv':
-            rows.insert(0, headers)
-            return make_csv_response(
-                data=rows,
+            return csv_response(
+                rows=itertools.chain([headers], *sources),
                 filename=csv_conf.get('name'),
             )
         self.headers = headers
-        self.rows = rows
+        self.rows = list(itertools.chain(*sources))
         self.csv_url = csv_conf.get('url')
         self.title = csv_conf.get('title')
         return super(ReportDevices, self).get(*args, **kwargs)
@@ -1002,29 +1010,26 @@ def _prices_per_venture_device_details(device, exclude=[]):
     }
 
 
-@async_report_provider(timeout=3600, cache_alias='bigdata')
+@async_report_provider(timeout=3600, cache_alias='bigdata', chunked=True)
 def _prices_per_venture_data_provider(venture_id=None):
     if venture_id:
         try:
             venture = Venture.objects.get(id=venture_id)
         except Venture.DoesNotExist:
-            return []
-        devices_to_process = []
-        for descendant in venture.find_descendant_ids():
-            devices_to_process.extend(
-                Device.objects.filter(venture_id=descendant),
-            )
+            return
+        devices_to_process = Device.objects.filter(
+            venture_id__in=venture.find_descendant_ids(),
+        )
     else:
         devices_to_process = Device.objects.all()
-    devices = []
-    for device in devices_to_process:
-        devices.append(
-            _prices_per_venture_device_details(
-                device=device,
-                exclude=['software'],
-            ),
+    total = devices_to_process.count()
+    for number, device in enumerate(devices_to_process.iterator(), 1):
+        yield _prices_per_venture_device_details(
+            device=device,
+            exclude=['software'],
         )
-    return devices
+        if number % 100 == 0:
+            yield Progress(number / total)
 
 
 class ReportDevicePricesPerVenture(SidebarReports, AsyncReportMixin, Base):
@@ -1040,7 +1045,18 @@ class ReportDevicePricesPerVenture(SidebarReports, AsyncReportMixin, Base):
 
     def get_csv_data(self, devices):
         """Prepare data to export to CSV"""
-        max_components_count, rows = 0, []
+        max_components_count = max([0] + [
+            len(dev.get('components')) for dev in devices
+        ])
+        headers = [
+            'Venture', 'Venture ID', 'Device', 'Role', 'SN', 'Barcode',
+            'Quoted price (PLN)', 'Deprecated',
+        ]
+        for i in range(max_components_count):
+            headers.extend(
+                ['Component name', 'Component count', 'Component total'],
+            )
+        yield headers
         for dev in devices:
             device = dev.get('device')
             components = dev.get('components')
@@ -1055,7 +1071,6 @@ class ReportDevicePricesPerVenture(SidebarReports, AsyncReportMixin, Base):
                 device['cached_price'] if not deprecated else dev.get('total'),
                 'True' if deprecated else 'False',
             ]
-            max_components_count = max(max_components_count, len(components))
             for component in components:
                 details = [
                     component['model'],
@@ -1063,17 +1078,7 @@ class ReportDevicePricesPerVenture(SidebarReports, AsyncReportMixin, Base):
                     component['price'],
                 ]
                 row.extend(details)
-            rows.append(row)
-        headers = [
-            'Venture', 'Venture ID', 'Device', 'Role', 'SN', 'Barcode',
-            'Quoted price (PLN)', 'Deprecated',
-        ]
-        for i in range(max_components_count):
-            headers.extend(
-                ['Component name', 'Component count', 'Component total'],
-            )
-        rows.insert(0, headers)
-        return rows
+            yield row
 
     @ralph_permission(perms)
     def get(self, *args, **kwargs):
@@ -1115,18 +1120,32 @@ class ReportDevicePricesPerVenture(SidebarReports, AsyncReportMixin, Base):
                 filename = 'report_devices_prices_per_venture-%s-%s.csv' % (
                     venture.symbol, datetime.date.today(),
                 )
-                return make_csv_response(
-                    data=self.get_csv_data(self.devices),
-                    filename=filename,
-                )
-            if not self.task_in_progress and self.export_all:
+            elif not self.task_in_progress and self.export_all:
                 filename = 'report_devices_prices_per_venture-all-%s.csv' % (
                     datetime.date.today()
                 )
-                return make_csv_response(
-                    data=self.get_csv_data(self.devices),
-                    filename=filename,
-                )
+            else:
+                filename = None
+            if filename:
+                rows = self.get_csv_data(self.devices)
+                try:
+                    # the headers need a pass over all the stored chunks, so
+                    # the expired ones are found before anything is sent
+                    headers = next(rows)
+                except ChunkExpired:
+                    # a part of the stored report is gone, compute it again
+                    self.invalidate_data(venture_id=self.venture_id)
+                    self.devices = self.get_data(venture_id=self.venture_id)
+                    self.task_in_progress = True
+                    messages.info(
+                        self.request,
+                        "Report processing in progress. Please wait...",
+                    )
+                else:
+                    return csv_response(
+                        rows=itertools.chain([headers], rows),
+                        filename=filename,
+                    )
         return super(ReportDevicePricesPerVenture, self).get(*args, **kwargs)
 
     def get_context_data(self, **kwargs):
@@ -1138,5 +1157,6 @@ class ReportDevicePricesPerVenture(SidebarReports, AsyncReportMixin, Base):
             'rows': self.devices,
             'venture': self.venture_id,
             'task_in_progress': self.task_in_progress,
+            'report_progress': self.report_progress,
         })
         return context
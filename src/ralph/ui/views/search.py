@@ -4,7 +4,6 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import ipaddr
 import re
 import datetime
 
@@ -16,8 +15,18 @@ from django.http import HttpResponseRedirect
 from powerdns.models import Record
 
 from ralph.account.models import Perm
-from ralph.discovery.models import ReadOnlyDevice, Device, ComponentModel
+from ralph.discovery.models import (
+    ComponentModel,
+    Device,
+    DeviceSearchIndex,
+    Ethernet,
+    IPAddress,
+    ReadOnlyDevice,
+    Software as SoftwareComponent,
+)
+from ralph.dnsedit.models import DHCPEntry
 from ralph.ui.forms.search import SearchForm
+from ralph.util.network import ip_ranges
 from ralph.ui.views.common import (
     Addresses,
     Asset,
@@ -34,6 +43,8 @@ from ralph.ui.views.devices import BaseDeviceList
 from ralph.ui.views.reports import Reports, ReportDeviceList
 
 
+# the number of devices a search indexes itself when the worker lags behind
+SEARCH_REFRESH_LIMIT = 50
 SOFTWARE_RE = re.compile(
     r"^(?P<name>[^<=>^]*)\s*((?P<operator>==|\^=|>=|<=|>|<)\s*"
     "(?P<version1>[^<=>^]*)|(?P<version2>[^<=>^ ]*))$",
@@ -41,6 +52,29 @@ SOFTWARE_RE = re.compile(
 )
 
 
+def _search_ip_ranges(ranges):
+    """
+    Return a filter for devices having an IP address, or a DHCP entry for
+    one of their MAC addresses, in any of the numeric ranges. The addresses
+    are looked up in subqueries, so they never leave the database.
+    """
+
+    q = Q()
+    for min_ip, max_ip in ranges:
+        q |= Q(number__gte=min_ip, number__lte=max_ip)
+    if not q:
+        return Q(id__in=[])
+    return Q(
+        id__in=IPAddress.objects.filter(q).exclude(
+            device=None,
+        ).values('device_id'),
+    ) | Q(
+        id__in=Ethernet.objects.filter(
+            mac__in=DHCPEntry.objects.filter(q).values('mac'),
+        ).values('device_id'),
+    )
+
+
 def _search_fields_or(fields, values):
     q = Q()
     for value in values:
@@ -109,6 +143,9 @@ class SearchDeviceList(SidebarSearch, BaseMixin, BaseDeviceList):
         self.set_searchform()
         if self.searchform.is_valid():
             data = self.searchform.cleaned_data
+            # a few of the devices whose indexed data changed recently, the
+            # rest is indexed by the worker
+            DeviceSearchIndex.refresh(limit=SEARCH_REFRESH_LIMIT)
             if data['deleted']:
                 self.query = Device.admin_objects.all()
             else:
@@ -126,35 +163,27 @@ class SearchDeviceList(SidebarSearch, BaseMixin, BaseDeviceList):
                     Q(name__icontains=name) |
                     Q(name__in=names)
                 ).values_list('content'))
-                q = (_search_fields_or([
-                    'name__contains',
-                    'ipaddress__hostname__icontains',
-                ], name.split()) | Q(
-                    ipaddress__address__in=ips,
-                ))
-                self.query = self.query.filter(q).distinct()
+                q = DeviceSearchIndex.device_filter('name', name.split())
+                if ips:
+                    q |= Q(id__in=IPAddress.objects.filter(
+                        address__in=ips,
+                    ).values_list('device_id', flat=True))
+                self.query = self.query.filter(q)
             if data['address']:
                 if data['address'] == empty_field:
                     self.query = self.query.filter(
                         ipaddress=None
                     )
-                elif '/' in data['address']:
+                else:
                     try:
-                        net = ipaddr.IPNetwork(data['address'])
+                        ranges = ip_ranges(data['address'].split())
                     except ValueError:
-                        pass
-                    else:
-                        min_ip = int(net.network)
-                        max_ip = int(net.broadcast)
-                        self.query = self.query.filter(
-                            ipaddress__number__lte=max_ip,
-                            ipaddress__number__gte=min_ip
+                        q = DeviceSearchIndex.device_filter(
+                            'address', data['address'].split(' '),
                         )
-                else:
-                    q = _search_fields_or([
-                        'ipaddress__address__icontains'
-                    ], data['address'].split(' '))
-                    self.query = self.query.filter(q).distinct()
+                    else:
+                        q = _search_ip_ranges(ranges)
+                    self.query = self.query.filter(q)
             if data['remarks']:
                 if data['remarks'] == empty_field:
                     self.query = self.query.filter(
@@ -170,11 +199,11 @@ class SearchDeviceList(SidebarSearch, BaseMixin, BaseDeviceList):
                         model=None
                     )
                 else:
-                    q = _search_fields_or([
-                        'model__name__icontains',
-                        'model__group__name__icontains',
-                    ], data['model'].split('|'))
-                    self.query = self.query.filter(q).distinct()
+                    self.query = self.query.filter(
+                        DeviceSearchIndex.device_filter(
+                            'model', data['model'].split('|'),
+                        ),
+                    )
             if data['component']:
                 if data['component'].isdigit():
                     q = _search_fields_or([
@@ -189,29 +218,11 @@ class SearchDeviceList(SidebarSearch, BaseMixin, BaseDeviceList):
                     ], data['component'].split('|'))
                     self.query = self.query.filter(q).distinct()
                 else:
-                    q = _search_fields_or([
-                        'genericcomponent__label__icontains',
-                        'genericcomponent__model__name__icontains',
-                        'genericcomponent__model__group__name__icontains',
-                        'ethernet__mac__icontains',
-                        'fibrechannel__label__icontains',
-                        'fibrechannel__model__name__icontains',
-                        'fibrechannel__model__group__name__icontains',
-                        'storage__label__icontains',
-                        'storage__model__name__icontains',
-                        'storage__model__group__name__icontains',
-                        'memory__label__icontains',
-                        'memory__model__name__icontains',
-                        'memory__model__group__name__icontains',
-                        'processor__label__icontains',
-                        'processor__model__name__icontains',
-                        'processor__model__group__name__icontains',
-                        'disksharemount__share__label__icontains',
-                        'disksharemount__share__wwn__icontains',
-                        'disksharemount__share__model__name__icontains',
-                        'operatingsystem__model__name__icontains'
-                    ], data['component'].split('|'))
-                    self.query = self.query.filter(q).distinct()
+                    self.query = self.query.filter(
+                        DeviceSearchIndex.device_filter(
+                            'component', data['component'].split('|'),
+                        ),
+                    )
             if data['software']:
                 if data['software'].isdigit():
                     q = _search_fields_or([
@@ -235,29 +246,16 @@ class SearchDeviceList(SidebarSearch, BaseMixin, BaseDeviceList):
                     # 3) package name + ^= + version - is startswith
                     if not operator:
                         self.query = self.query.filter(
-                            Q(software__label__icontains=name) |
-                            Q(software__model__name__icontains=name) |
-                            Q(software__model__group__name__icontains=name)
-                        ).distinct()
-                    elif name and operator and version:
-                        operators = {
-                            '==': '',
-                            '^=': '__startswith',
-                            '>': '__gt',
-                            '>=': '__gte',
-                            '<': '__lt',
-                            '<=': '__lte',
-                        }
-                        soft_q = Q(
-                            **{'software__version' + operators[operator]: version}
+                            DeviceSearchIndex.device_filter(
+                                'software', [name],
+                            ),
                         )
+                    elif name and operator and version:
                         self.query = self.query.filter(
-                            (Q(software__label__icontains=name) & soft_q) |
-                            (Q(software__model__name__icontains=name) &
-                                soft_q) |
-                            (Q(software__model__group__name__icontains=name) &
-                                soft_q)
-                        ).distinct()
+                            id__in=SoftwareComponent.find(
+                                name, operator, version,
+                            ).values_list('device_id', flat=True),
+                        )
             if data['serial']:
                 if data['serial'] == empty_field:
                     self.query = self.query.filter(
@@ -267,14 +265,11 @@ class SearchDeviceList(SidebarSearch, BaseMixin, BaseDeviceList):
                     )
                 else:
                     serial = data['serial'].replace(':', '')
-                    q = _search_fields_or([
-                        'sn__icontains',
-                        'ethernet__mac__icontains',
-                        'genericcomponent__sn__icontains',
-                        'diskshare__wwn',
-                        'disksharemount__share__wwn',
-                    ], serial.split())
-                    self.query = self.query.filter(q).distinct()
+                    self.query = self.query.filter(
+                        DeviceSearchIndex.device_filter(
+                            'serial', serial.split(),
+                        ),
+                    )
             if data['barcode']:
                 if data['barcode'] == empty_field:
                     self.query = self.query.filter(
@@ -434,7 +429,7 @@ class SearchDeviceList(SidebarSearch, BaseMixin, BaseDeviceList):
         search_url = reverse('search', args=[details or 'info', ''])
         q = self.request.GET.get('q', '')
         if q:
-            if re.match(r'^[\d./]+$', q):
+            if re.match(r'^[\d./-]+$', q):
                 return HttpResponseRedirect('%s?address=%s' % (search_url, q))
             elif re.match(r'^[a-zA-Z.]+\s*/\s*[a-zA-Z.]+$', q):
                 return HttpResponseRedirect('%s?role=%s' % (search_url, q))
@@ -4,7 +4,6 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import re
 import datetime
 import calendar
 
@@ -33,6 +32,7 @@ from ralph.ui.forms import (
     RolePropertyForm,
     VentureFilterForm,
 )
+from ralph.ui.sidebar_trees import VentureTree, _normalize_venture
 from ralph.ui.views.common import (
     Addresses,
     Asset,
@@ -57,14 +57,6 @@ from ralph.ui.reports import (
 from ralph.util import presentation
 
 
-def _normalize_venture(symbol):
-    """
-    >>> _normalize_venture('węgielek,Ziew')
-    u'w.gielek.ziew'
-    """
-    return re.sub(r'[^\w]', '.', symbol).lower()
-
-
 def collect_ventures(parent, ventures, items, depth=0):
     for v in ventures.filter(parent=parent):
         symbol = _normalize_venture(v.symbol)
@@ -79,31 +71,6 @@ def collect_ventures(parent, ventures, items, depth=0):
         collect_ventures(v, ventures, items, depth + 1)
 
 
-def venture_tree_menu(ventures, details, show_all=False):
-    items = []
-    if not show_all:
-        ventures = ventures.filter(show_in_ralph=True)
-    for v in ventures.order_by('-is_infrastructure', 'name'):
-        symbol = _normalize_venture(v.symbol)
-        icon = presentation.get_venture_icon(v)
-        item = MenuItem(
-            v.name, name=symbol,
-            fugue_icon=icon,
-            view_name='ventures',
-            view_args=[symbol, details, ''],
-            indent = ' ',
-            collapsed = True,
-            collapsible = True,
-        )
-        item.venture_id = v.id
-        item.subitems = venture_tree_menu(
-                v.child_set.all(), details, show_all)
-        for subitem in item.subitems:
-            subitem.parent = item
-        items.append(item)
-    return items
-
-
 class SidebarVentures(object):
     section = 'ventures'
 
@@ -132,9 +99,17 @@ class SidebarVentures(object):
         profile = self.request.user.get_profile()
         has_perm = profile.has_perm
         ventures = profile.perm_ventures(Perm.list_devices_generic)
-        show_all = self.request.GET.get('show_all')
-        ventures = ventures.order_by('-is_infrastructure', 'name')
-
+        params = {
+            'details': details,
+            'show_all': self.request.GET.get('show_all'),
+            'selected': (_normalize_venture(self.venture.symbol) if
+                self.venture and self.venture != '*' else ''),
+        }
+        tree = VentureTree.get()
+        root_ids = set()
+        if profile.is_active:
+            root_ids.update(ventures.filter(parent=None).values_list(
+                'id', flat=True))
         sidebar_items = [
             MenuItem(fugue_icon='fugue-prohibition', label="Unknown",
                      name='-', view_name='ventures',
@@ -143,19 +118,15 @@ class SidebarVentures(object):
                      name='*', view_name='ventures',
                      view_args=['*', details, ''])
         ]
-        sidebar_items.extend(venture_tree_menu(
-                ventures.filter(parent=None), details, show_all))
-        if self.venture and self.venture != '*':
-            stack = list(sidebar_items)
-            while stack:
-                item = stack.pop()
-                if getattr(item, 'venture_id', None) == self.venture.id:
-                    parent = getattr(item, 'parent', None)
-                    while parent:
-                        parent.kwargs['collapsed'] = False
-                        parent = getattr(parent, 'parent', None)
-                    break
-                stack.extend(getattr(item, 'subitems', []))
+        sidebar_items.extend(tree.menu(
+            [
+                node for node in tree.roots
+                if node.id in root_ids and tree.is_visible(node, params)
+            ],
+            params,
+            expanded=(tree.ancestors(self.venture.id) if
+                self.venture and self.venture != '*' else ()),
+        ))
 
         self.set_venture()
         tab_items = ret['tab_items']
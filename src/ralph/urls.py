@@ -18,6 +18,7 @@ from ralph.business.api import (
 from ralph.deployment.api import DeploymentResource
 from ralph.discovery.api import (
     BladeServerResource,
+    ChangeFeedResource,
     DeviceWithPricingResource,
     DevResource,
     IPAddressResource,
@@ -67,7 +68,7 @@ for r in (IPAddressResource, NetworksResource, ModelGroupResource,
           ModelResource, PhysicalServerResource, RackServerResource,
           BladeServerResource, VirtualServerResource, DevResource,
           WindowsDeviceResource, DeviceWithPricingResource,
-          NetworkKindsResource):
+          NetworkKindsResource, ChangeFeedResource):
     v09_api.register(r())
 
 # CMDB API
@@ -9,13 +9,38 @@ import datetime
 import re
 
 from ralph.business.models import Venture, VentureExtraCost
-from ralph.discovery.models import Device, DeviceType, DiskShareMount
-
-from django.db import models as db
+from ralph.discovery.models import (
+    Device,
+    DeviceSummary,
+    DeviceType,
+    DiskShareMount,
+)
+from ralph.discovery.models_summary import SUMMARY_CHUNK_SIZE
 
 DEVICE_REPR_RE = re.compile(r'^(?P<name>.*)[(](?P<id>\d+)[)]$')
 
 
+def _with_summaries(devices):
+    """Yield ``(device, summary)`` for the devices, summarized in chunks."""
+
+    def summarize(chunk):
+        summaries = DeviceSummary.for_devices(d.id for d in chunk)
+        for device in chunk:
+            # devices removed in the meantime have no summary
+            if device.id in summaries:
+                yield device, summaries[device.id]
+
+    chunk = []
+    for device in devices.iterator():
+        chunk.append(device)
+        if len(chunk) >= SUMMARY_CHUNK_SIZE:
+            for item in summarize(chunk):
+                yield item
+            chunk = []
+    for item in summarize(chunk):
+        yield item
+
+
 def get_ventures():
     """Yields dicts describing all the ventures to be imported into pricing."""
 
@@ -65,10 +90,10 @@ def get_physical_cores():
         DeviceType.blade_server,
         DeviceType.rack_server,
     }
-    for device in Device.objects.filter(
+    for device, summary in _with_summaries(Device.objects.filter(
         model__type__in=physical_servers,
-    ):
-        cores = device.get_core_count()
+    )):
+        cores = summary.cores
         if not cores:
             for system in device.operatingsystem_set.all():
                 cores = system.cores_count
@@ -86,21 +111,24 @@ def get_physical_cores():
 def get_virtual_usages():
     """Yields dicts reporting the number of virtual cores, memory and disk."""
 
-    for device in Device.objects.filter(model__type=DeviceType.virtual_server):
-        cores = device.get_core_count()
-        memory = device.memory_set.aggregate(db.Sum('size'))['size__sum']
-        disk = device.storage_set.aggregate(db.Sum('size'))['size__sum']
-        shares_size = sum(
-            mount.get_size()
-            for mount in device.disksharemount_set.all()
-        )
-        for system in device.operatingsystem_set.all():
-            if not disk:
-                disk = max((system.storage or 0) - shares_size, 0)
-            if not cores:
-                cores = system.cores_count
-            if not memory:
-                memory = system.memory
+    for device, summary in _with_summaries(Device.objects.filter(
+        model__type=DeviceType.virtual_server,
+    )):
+        cores = summary.cores
+        memory = summary.memory
+        disk = summary.disk
+        if not (cores and memory and disk):
+            shares_size = sum(
+                mount.get_size()
+                for mount in device.disksharemount_set.all()
+            )
+            for system in device.operatingsystem_set.all():
+                if not disk:
+                    disk = max((system.storage or 0) - shares_size, 0)
+                if not cores:
+                    cores = system.cores_count
+                if not memory:
+                    memory = system.memory
         yield {
             'device_id': device.id,
             'venture_id': device.venture_id,
@@ -147,11 +175,11 @@ def devices_history(start_date, end_date):
         DeviceType.cloud_server,
         DeviceType.mogilefs_storage,
     }
-    for device in Device.admin_objects.exclude(
+    for device, summary in _with_summaries(Device.admin_objects.exclude(
         model__type__in=exclude,
-    ):
+    )):
         date = start_date
-        cores = device.get_core_count()
+        cores = summary.cores
         data = {
             'device_id': device.id,
             'id': device.id,
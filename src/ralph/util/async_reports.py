@@ -5,11 +5,16 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from hashlib import md5
+import cPickle as pickle
+import zlib
 
 from django.conf import settings
 from django.core.cache import DEFAULT_CACHE_ALIAS, get_cache
 
 
+CHUNK_SIZE = 1000
+
+
 def get_cache_key(base_name, *args, **kwargs):
     params_str = '%s_%s_%s' % (
         base_name,
@@ -25,25 +30,143 @@ def get_cache_key(base_name, *args, **kwargs):
     return md5_hash.hexdigest()
 
 
-def async_report_provider(timeout, cache_alias=DEFAULT_CACHE_ALIAS):
+class Progress(float):
+    """
+    Yielded by chunked report providers between the rows to tell how much
+    of the report (0.0 - 1.0) is done.
+    """
+
+
+class ChunkedResultWriter(object):
+    """
+    Stores the rows of a report in the cache as they are produced, in
+    compressed chunks of ``chunk_size`` rows. The status of the report is
+    kept under ``key`` and the chunks under ``key`` with their number.
+    """
+
+    def __init__(self, cache, key, timeout, chunk_size=CHUNK_SIZE):
+        self.cache = cache
+        self.key = key
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.status = {
+            'chunked': True,
+            'chunks': 0,
+            'count': 0,
+            'progress': 0.0,
+            'finished': False,
+        }
+        self.save_status()
+
+    def save_status(self):
+        self.cache.set(self.key, self.status, self.timeout)
+
+    def append(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def set_progress(self, progress):
+        self.status['progress'] = min(max(float(progress), 0.0), 1.0)
+        self.save_status()
+
+    def flush(self):
+        if not self.rows:
+            return
+        self.cache.set(
+            '%s_%d' % (self.key, self.status['chunks']),
+            zlib.compress(pickle.dumps(self.rows, pickle.HIGHEST_PROTOCOL)),
+            self.timeout,
+        )
+        self.status['chunks'] += 1
+        self.status['count'] += len(self.rows)
+        self.rows = []
+        self.save_status()
+
+    def close(self):
+        self.flush()
+        self.status['progress'] = 1.0
+        self.status['finished'] = True
+        self.save_status()
+
+
+class ChunkedResult(object):
+    """
+    A finished chunked report read back from the cache. Iterating over it
+    loads a single chunk into memory at a time, so it can be iterated over
+    many times without keeping the whole report around.
+    """
+
+    def __init__(self, cache, key, status):
+        self.cache = cache
+        self.key = key
+        self.status = status
+
+    def __len__(self):
+        return self.status['count']
+
+    def __nonzero__(self):
+        return bool(self.status['count'])
+
+    def __iter__(self):
+        for number in xrange(self.status['chunks']):
+            chunk = self.cache.get('%s_%d' % (self.key, number))
+            if chunk is None:
+                raise ChunkExpired(
+                    "Chunk {} of report {} has expired.".format(
+                        number, self.key,
+                    ),
+                )
+            for row in pickle.loads(zlib.decompress(chunk)):
+                yield row
+
+    def delete(self):
+        self.cache.delete_many([
+            '%s_%d' % (self.key, number)
+            for number in xrange(self.status['chunks'])
+        ])
+        self.cache.delete(self.key)
+
+
+class ChunkExpired(Exception):
+    pass
+
+
+def async_report_provider(timeout, cache_alias=DEFAULT_CACHE_ALIAS,
+                          chunked=False):
+    """
+    Decorate a function computing the data of an asynchronous report, which
+    gets stored in the cache. Functions of chunked reports are generators
+    yielding the rows, and optionally ``Progress`` between them, which get
+    stored in chunks as they come instead of as a single object at the end.
+    """
+
     def _async_report_provider(func):
         def wrapper(*args, **kwargs):
-            result = func(*args, **kwargs)
             cache = get_cache(
                 cache_alias
                 if cache_alias in settings.CACHES else DEFAULT_CACHE_ALIAS,
             )
-            cache.set(
-                get_cache_key(func.func_name, *args, **kwargs),
-                result,
-                timeout,
-            )
+            key = get_cache_key(func.func_name, *args, **kwargs)
+            if chunked:
+                writer = ChunkedResultWriter(cache, key, timeout)
+                for row in func(*args, **kwargs):
+                    if isinstance(row, Progress):
+                        writer.set_progress(row)
+                    else:
+                        writer.append(row)
+                writer.close()
+                return
+            result = func(*args, **kwargs)
+            cache.set(key, result, timeout)
             return result
         wrapper.func_dict.update({
             'async_report_results_expiration': timeout,
             'async_report_cache_alias': cache_alias if (
                 cache_alias in settings.CACHES
-            ) else DEFAULT_CACHE_ALIAS
+            ) else DEFAULT_CACHE_ALIAS,
+            'async_report_chunked': chunked,
         })
         wrapper.__name__ = func.__name__
         wrapper.__module__ = func.__module__
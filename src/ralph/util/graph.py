@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compact directed graphs of integer nodes with labelled edges.
+
+The edges are kept in CSR (compressed sparse row) arrays indexed directly by
+the node numbers, in both directions, so a graph with a million edges takes
+a few dozen megabytes instead of the gigabytes of per-node dicts and tuples.
+Edges added or removed after the arrays were built are kept aside and merged
+into the arrays once there are enough of them.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from array import array
+from collections import defaultdict, deque
+from itertools import izip
+
+
+# merge the pending changes when there are more of them than this fraction
+# of the edges in the arrays
+COMPACT_RATIO = 0.1
+COMPACT_MIN = 1000
+
+
+def _build_csr(size, sources, targets, labels):
+    """
+    Build ``(offsets, targets, labels)`` arrays where the edges going out of
+    node ``n`` are at ``offsets[n]:offsets[n + 1]``. The edges of each node
+    keep the order in which they were given.
+    """
+
+    offsets = array(b'l', [0]) * (size + 1)
+    for source in sources:
+        offsets[source + 1] += 1
+    for node in xrange(size):
+        offsets[node + 1] += offsets[node]
+    position = array(b'l', offsets[:-1])
+    csr_targets = array(b'i', [0]) * len(sources)
+    csr_labels = array(b'i', [0]) * len(sources)
+    for source, target, label in izip(sources, targets, labels):
+        index = position[source]
+        csr_targets[index] = target
+        csr_labels[index] = label
+        position[source] = index + 1
+    return offsets, csr_targets, csr_labels
+
+
+def _sort_rows(csr):
+    """
+    Return an array of the edge indexes where the edges of every node are
+    sorted by ``(target, label)``, so they can be found by a binary search.
+    """
+
+    offsets, targets, labels = csr
+    order = array(b'i')
+    for node in xrange(len(offsets) - 1):
+        row = range(offsets[node], offsets[node + 1])
+        row.sort(key=lambda index: (targets[index], labels[index]))
+        order.extend(row)
+    return order
+
+
+class Graph(object):
+    """
+    A directed multigraph of non-negative integer nodes, with an integer
+    label on every edge. There can be many edges between two nodes as long
+    as their labels differ.
+    """
+
+    def __init__(self, edges=()):
+        sources = array(b'i')
+        targets = array(b'i')
+        labels = array(b'i')
+        for source, target, label in edges:
+            sources.append(source)
+            targets.append(target)
+            labels.append(label)
+        self._build(sources, targets, labels)
+
+    def _build(self, sources, targets, labels):
+        size = max(max(sources or [-1]), max(targets or [-1])) + 1
+        self.size = size
+        self.edge_count = len(sources)
+        self._out = _build_csr(size, sources, targets, labels)
+        self._out_order = _sort_rows(self._out)
+        self._in = _build_csr(size, targets, sources, labels)
+        self._added_out = defaultdict(list)
+        self._added_in = defaultdict(list)
+        self._added = set()
+        self._removed = set()
+        self._changes = 0
+
+    def copy(self):
+        """
+        Return a copy of the graph. The arrays are never changed in place,
+        so they are shared, only the pending changes are copied.
+        """
+
+        other = self.__class__.__new__(self.__class__)
+        other.__dict__.update(self.__dict__)
+        other._added_out = defaultdict(list, (
+            (node, list(edges)) for node, edges in self._added_out.iteritems()
+        ))
+        other._added_in = defaultdict(list, (
+            (node, list(edges)) for node, edges in self._added_in.iteritems()
+        ))
+        other._added = set(self._added)
+        other._removed = set(self._removed)
+        return other
+
+    def _base_edges(self, csr, node):
+        offsets, targets, labels = csr
+        if node >= self.size:
+            return
+        for index in xrange(offsets[node], offsets[node + 1]):
+            yield targets[index], labels[index]
+
+    def successors(self, node):
+        """Return a list of ``(target, label)`` of edges going out of node."""
+
+        result = [
+            (target, label)
+            for target, label in self._base_edges(self._out, node)
+            if (node, target, label) not in self._removed
+        ]
+        result.extend(self._added_out.get(node, ()))
+        return result
+
+    def predecessors(self, node):
+        """Return a list of ``(source, label)`` of edges coming into node."""
+
+        result = [
+            (source, label)
+            for source, label in self._base_edges(self._in, node)
+            if (source, node, label) not in self._removed
+        ]
+        result.extend(self._added_in.get(node, ()))
+        return result
+
+    def targets(self, node):
+        """Return a list of the nodes the edges going out of node lead to."""
+
+        return [target for target, label in self.successors(node)]
+
+    def _has_base_edge(self, source, target, label):
+        if source >= self.size:
+            return False
+        offsets, targets, labels = self._out
+        key = (target, label)
+        low, high = offsets[source], offsets[source + 1]
+        while low < high:
+            middle = (low + high) // 2
+            index = self._out_order[middle]
+            if (targets[index], labels[index]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == offsets[source + 1]:
+            return False
+        index = self._out_order[low]
+        return (targets[index], labels[index]) == key
+
+    def has_edge(self, source, target, label):
+        edge = (source, target, label)
+        if edge in self._added:
+            return True
+        if edge in self._removed:
+            return False
+        return self._has_base_edge(source, target, label)
+
+    def edges(self):
+        """Iterate over all the ``(source, target, label)`` edges."""
+
+        for node in xrange(self.size):
+            for target, label in self.successors(node):
+                yield node, target, label
+        for node, targets in self._added_out.items():
+            if node < self.size:
+                continue
+            for target, label in targets:
+                yield node, target, label
+
+    def add_edge(self, source, target, label):
+        if self.has_edge(source, target, label):
+            return
+        if (source, target, label) in self._removed:
+            self._removed.discard((source, target, label))
+        else:
+            self._added.add((source, target, label))
+            self._added_out[source].append((target, label))
+            self._added_in[target].append((source, label))
+        self.edge_count += 1
+        self._changed()
+
+    def remove_edge(self, source, target, label):
+        if not self.has_edge(source, target, label):
+            return
+        if (source, target, label) in self._added:
+            self._added.discard((source, target, label))
+            self._added_out[source].remove((target, label))
+            self._added_in[target].remove((source, label))
+        else:
+            self._removed.add((source, target, label))
+        self.edge_count -= 1
+        self._changed()
+
+    def _changed(self):
+        self._changes += 1
+        if self._changes > max(COMPACT_MIN, self.edge_count * COMPACT_RATIO):
+            self.compact()
+
+    def compact(self):
+        """Merge the pending changes into the arrays."""
+
+        sources = array(b'i')
+        targets = array(b'i')
+        labels = array(b'i')
+        for source, target, label in self.edges():
+            sources.append(source)
+            targets.append(target)
+            labels.append(label)
+        self._build(sources, targets, labels)
+
+
+def breadth_first_search(root, neighbors):
+    """
+    Visit the nodes reachable from ``root``, where ``neighbors(node)``
+    returns the nodes adjacent to ``node``. Returns the spanning tree as
+    a dict of ``{node: parent}`` and the list of nodes in the visiting order,
+    like ``pygraph.algorithms.searching.breadth_first_search`` does.
+    """
+
+    spanning_tree = {root: None}
+    ordering = [root]
+    queue = deque([root])
+    while queue:
+        node = queue.popleft()
+        for other in neighbors(node):
+            if other not in spanning_tree:
+                spanning_tree[other] = node
+                ordering.append(other)
+                queue.append(other)
+    return spanning_tree, ordering
+
+
+def depth_first_search(roots, neighbors):
+    """
+    Visit the nodes reachable from the ``roots`` without recursion, where
+    ``neighbors(node)`` returns the nodes adjacent to ``node``. Returns the
+    spanning forest as a dict of ``{node: parent}`` and the lists of nodes in
+    pre-order and post-order, like
+    ``pygraph.algorithms.searching.depth_first_search`` does.
+    """
+
+    spanning_tree = {}
+    preorder = []
+    postorder = []
+    for root in roots:
+        if root in spanning_tree:
+            continue
+        spanning_tree[root] = None
+        preorder.append(root)
+        stack = [(root, iter(neighbors(root)))]
+        while stack:
+            node, others = stack[-1]
+            for other in others:
+                if other not in spanning_tree:
+                    spanning_tree[other] = node
+                    preorder.append(other)
+                    stack.append((other, iter(neighbors(other))))
+                    break
+            else:
+                stack.pop()
+                postorder.append(node)
+    return spanning_tree, preorder, postorder
+
+
+def find_cycle(nodes, neighbors):
+    """
+    Return a list of the nodes forming a cycle in the directed graph, in the
+    order of the edges, or an empty list if there are no cycles. The search
+    starts from the ``nodes`` in the given order, so the result is the same
+    as the one of ``pygraph.algorithms.cycles.find_cycle``.
+    """
+
+    parents = {}
+    # nodes on the current search path
+    active = set()
+    for root in nodes:
+        if root in parents:
+            continue
+        parents[root] = None
+        active.add(root)
+        stack = [(root, iter(neighbors(root)))]
+        while stack:
+            node, others = stack[-1]
+            for other in others:
+                if other in active:
+                    cycle = [node]
+                    while node != other:
+                        node = parents[node]
+                        cycle.append(node)
+                    cycle.reverse()
+                    return cycle
+                if other not in parents:
+                    parents[other] = node
+                    active.add(other)
+                    stack.append((other, iter(neighbors(other))))
+                    break
+            else:
+                stack.pop()
+                active.discard(node)
+    return []
+
+
+def strongly_connected_components(nodes, neighbors):
+    """
+    Return the strongly connected components of the directed graph as a list
+    of lists of nodes, using Tarjan's algorithm without recursion. The
+    components come in reverse topological order: no component has edges
+    into the components after it.
+    """
+
+    index = {}
+    lowlink = {}
+    path = []
+    on_path = set()
+    components = []
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        path.append(root)
+        on_path.add(root)
+        stack = [(root, iter(neighbors(root)))]
+        while stack:
+            node, others = stack[-1]
+            for other in others:
+                if other not in index:
+                    index[other] = lowlink[other] = len(index)
+                    path.append(other)
+                    on_path.add(other)
+                    stack.append((other, iter(neighbors(other))))
+                    break
+                if other in on_path and index[other] < lowlink[node]:
+                    lowlink[node] = index[other]
+            else:
+                stack.pop()
+                if stack and lowlink[node] < lowlink[stack[-1][0]]:
+                    lowlink[stack[-1][0]] = lowlink[node]
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        other = path.pop()
+                        on_path.discard(other)
+                        component.append(other)
+                        if other == node:
+                            break
+                    components.append(component)
+    return components
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Middleware which leaves the streamed responses alone.
+
+Django 1.4 has no streaming responses, so the middleware reads
+``response.content``, which drains an iterator body before the first byte
+is sent. The responses marked with ``streaming = True``, like the CSV
+exports of `ralph.util.views.csv_response`, are passed through as they are,
+the way Django 1.5 does it for ``StreamingHttpResponse``.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.middleware import gzip
+from lck.django.common import middleware as lck_middleware
+
+
+def is_streaming(response):
+    return getattr(response, 'streaming', False)
+
+
+class GZipMiddleware(gzip.GZipMiddleware):
+    def process_response(self, request, response):
+        if is_streaming(response):
+            return response
+        return super(GZipMiddleware, self).process_response(
+            request,
+            response,
+        )
+
+
+class TimingMiddleware(lck_middleware.TimingMiddleware):
+    def process_response(self, request, response):
+        if is_streaming(response):
+            return response
+        return super(TimingMiddleware, self).process_response(
+            request,
+            response,
+        )
@@ -8,12 +8,28 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from django.db import models as db
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import models as db, DEFAULT_DB_ALIAS
+from django.db.models.deletion import ProtectedError
+from django.db.models.sql import DeleteQuery
 from django.db.utils import DatabaseError
 from django.contrib.auth.models import User
 from tastypie.models import create_api_key
 
 
+BULK_DELETE_CHUNK_SIZE = 1000
+# the ``on_delete`` handlers which `bulk_delete` can run without the objects
+BULK_ON_DELETE = {
+    db.CASCADE,
+    db.DO_NOTHING,
+    db.PROTECT,
+    db.SET_DEFAULT,
+    db.SET_NULL,
+}
+
+
 def create_api_key_ignore_dberrors(*args, **kwargs):
     try:
         return create_api_key(*args, **kwargs)
@@ -25,6 +41,97 @@ def create_api_key_ignore_dberrors(*args, **kwargs):
 db.signals.post_save.connect(create_api_key_ignore_dberrors, sender=User)
 
 
+def bulk_delete(model, pk_list, using=DEFAULT_DB_ALIAS):
+    """
+    Delete the rows of ``model`` with the given primary keys, together with
+    everything that depends on them according to ``on_delete``, using one
+    DELETE per table and chunk of keys. Unlike ``QuerySet.delete()`` it
+    never loads the objects and sends no signals, so the caller has to take
+    care of their side effects. The models with dependents using a custom
+    ``on_delete`` are deleted with ``QuerySet.delete()`` instead, without
+    counting those dependents. Returns ``{model: number of deleted rows}``.
+    """
+
+    counts = defaultdict(int)
+    _bulk_delete(model, list(pk_list), using, counts)
+    return counts
+
+
+def _bulk_delete(model, pk_list, using, counts):
+    related_objects = model._meta.get_all_related_objects(
+        include_hidden=True,
+        include_proxy_eq=True,
+    )
+    # the generic relations, cascaded like in ``Collector.collect``
+    generic_relations = [
+        relation for relation in model._meta.many_to_many
+        if not relation.rel.through
+    ]
+    if any(
+        related.field.rel.on_delete not in BULK_ON_DELETE
+        for related in related_objects
+    ):
+        # the custom handlers need the objects, leave them to the ORM
+        for offset in xrange(0, len(pk_list), BULK_DELETE_CHUNK_SIZE):
+            chunk = pk_list[offset:offset + BULK_DELETE_CHUNK_SIZE]
+            model._base_manager.using(using).filter(pk__in=chunk).delete()
+            counts[model] += len(chunk)
+        return
+    for offset in xrange(0, len(pk_list), BULK_DELETE_CHUNK_SIZE):
+        chunk = pk_list[offset:offset + BULK_DELETE_CHUNK_SIZE]
+        for related in related_objects:
+            field = related.field
+            on_delete = field.rel.on_delete
+            if on_delete is db.DO_NOTHING:
+                continue
+            dependent = related.model._base_manager.using(using).filter(
+                **{'%s__in' % field.name: chunk}
+            )
+            if on_delete is db.CASCADE:
+                _bulk_delete(
+                    related.model,
+                    list(dependent.values_list('pk', flat=True)),
+                    using,
+                    counts,
+                )
+            elif on_delete is db.SET_NULL:
+                dependent.update(**{field.name: None})
+            elif on_delete is db.SET_DEFAULT:
+                dependent.update(**{field.name: field.get_default()})
+            elif on_delete is db.PROTECT:
+                if dependent.exists():
+                    raise ProtectedError(
+                        "Cannot delete some instances of model '%s' because "
+                        "they are referenced through a protected foreign key: "
+                        "'%s.%s'" % (
+                            model.__name__,
+                            related.model.__name__,
+                            field.name,
+                        ),
+                        dependent,
+                    )
+        for relation in generic_relations:
+            dependent = relation.rel.to._base_manager.using(using).filter(**{
+                relation.content_type_field_name:
+                    ContentType.objects.db_manager(using).get_for_model(
+                        model,
+                    ),
+                '%s__in' % relation.object_id_field_name: chunk,
+            })
+            _bulk_delete(
+                relation.rel.to,
+                list(dependent.values_list('pk', flat=True)),
+                using,
+                counts,
+            )
+        DeleteQuery(model).delete_batch(chunk, using)
+        counts[model] += len(chunk)
+        # the rows of the parent tables of multi-table inheritance share
+        # the primary keys
+        for parent in model._meta.parents:
+            _bulk_delete(parent, chunk, using, counts)
+
+
 # workaround for a unit test bug in Django 1.4.x
 
 from django.contrib.auth.tests import models as auth_test_models
@@ -113,3 +113,109 @@ def validate_ip(address):
         raise ValueError("Local, unspecified or loopback address: {}"
             "".format(address))
     return unicode(ip)
+
+
+def _octet_ranges(prefix):
+    """
+    Return the ranges of octet values whose decimal form starts with the
+    given digits, e.g. ``'2'`` gives 2, 20-29 and 200-255.
+    """
+
+    if not prefix:
+        return [(0, 255)]
+    value = int(prefix)
+    if value > 255:
+        raise ValueError("Invalid octet: {}".format(prefix))
+    if prefix.startswith('0'):
+        if len(prefix) > 1:
+            raise ValueError("Invalid octet: {}".format(prefix))
+        return [(0, 0)]
+    ranges = []
+    for digits in xrange(len(prefix), 4):
+        scale = 10 ** (digits - len(prefix))
+        low = value * scale
+        if low > 255:
+            break
+        ranges.append((low, min(low + scale - 1, 255)))
+    return ranges
+
+
+def _prefix_ranges(text):
+    """
+    Return the numeric ranges of IPv4 addresses starting with ``text``,
+    e.g. ``'10.20.'`` or ``'10.20.3'``.
+    """
+
+    parts = text.split('.')
+    if len(parts) > 4 or not all(part.isdigit() for part in parts[:-1]):
+        raise ValueError("Invalid address prefix: {}".format(text))
+    if parts[-1] and not parts[-1].isdigit():
+        raise ValueError("Invalid address prefix: {}".format(text))
+    base = 0
+    for part in parts[:-1]:
+        octet = int(part)
+        if octet > 255:
+            raise ValueError("Invalid address prefix: {}".format(text))
+        base = (base << 8) | octet
+    shift = 8 * (4 - len(parts))
+    ranges = []
+    for low, high in _octet_ranges(parts[-1]):
+        ranges.append((
+            (((base << 8) | low) << shift),
+            (((base << 8) | high) << shift) | ((1 << shift) - 1),
+        ))
+    return ranges
+
+
+def ip_ranges(queries):
+    """
+    Parse the address queries into a sorted list of ``(min, max)`` ranges of
+    the numeric IP addresses they match, so that they can be looked up with
+    range scans over indexed ``number`` columns. Accepted are addresses,
+    networks (``10.20.30.0/22``), ranges (``10.1.1.5-10.1.1.90`` or
+    ``10.1.1.5-90``) and IPv4 prefixes (``10.20.``). Raises ``ValueError``
+    for anything else.
+
+    Unlike the substring search this replaces, the queries only match from
+    the start of the address: a fragment such as ``168.1`` is read as the
+    prefix of ``168.1.x.x`` and no longer matches ``192.168.1.x``. A query
+    without a trailing dot or a mask is still a textual prefix, so
+    a complete address such as ``10.0.0.1`` also matches
+    ``10.0.0.10``-``10.0.0.19`` and ``10.0.0.100``-``10.0.0.199``. Use
+    ``10.0.0.1/32`` for the exact address.
+    """
+
+    ranges = []
+    for query in queries:
+        query = query.strip()
+        if not query:
+            continue
+        if '/' in query:
+            net = ipaddr.IPNetwork(query)
+            ranges.append((int(net.network), int(net.broadcast)))
+        elif '-' in query:
+            start, end = query.split('-', 1)
+            start = ipaddr.IPv4Address(start.strip())
+            end = end.strip()
+            missing = 4 - len(end.split('.'))
+            if missing > 0:
+                end = '.'.join(
+                    unicode(start).split('.')[:missing] + [end]
+                )
+            end = ipaddr.IPv4Address(end)
+            if end < start:
+                start, end = end, start
+            ranges.append((int(start), int(end)))
+        elif ':' in query:
+            number = int(ipaddr.IPv6Address(query))
+            ranges.append((number, number))
+        else:
+            ranges.extend(_prefix_ranges(query))
+    ranges.sort()
+    merged = []
+    for low, high in ranges:
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
@@ -6,9 +6,14 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import re
+
 from django.utils.datastructures import MultiValueDict
 
 
+VERSION_PART_RE = re.compile(r'[0-9]+|[a-zA-Z]+')
+
+
 def get_indent(line):
     for indent, c in enumerate(line):
         if c not in ' \t\r\n\v':
@@ -109,3 +114,26 @@ def tree(text='', lines=None):
                 break
         levels[indent] = node
     return levels[-1]
+
+
+def version_key(version, max_length=255):
+    r"""
+        Build a key for a version string which sorts like the versions do.
+        Numbers are compared numerically, letters alphabetically, a number
+        is newer than letters in the same place and a longer version is newer
+        than its prefix.
+
+        >>> version_key('1.10') > version_key('1.9')
+        True
+        >>> version_key('1.0.1g') > version_key('1.0.1')
+        True
+    """
+
+    key = []
+    for part in VERSION_PART_RE.findall(version or ''):
+        if part.isdigit():
+            digits = part.lstrip('0') or '0'
+            key.append('1%02d%s' % (min(len(digits), 99), digits[:99]))
+        else:
+            key.append('0%s.' % part.lower())
+    return ''.join(key)[:max_length]
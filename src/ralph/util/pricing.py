@@ -18,6 +18,7 @@ from django.conf import settings
 from ralph.discovery.models import (
     ComponentModelGroup,
     Device,
+    DeviceSummary,
     DeviceType,
     DiskShare,
     EthernetSpeed,
@@ -294,8 +295,10 @@ def device_update_cached(device):
 
 @commit_on_success
 def _update_batch(device_ids, rack, dc):
+    summaries = DeviceSummary.for_devices(device_ids)
     for d in Device.objects.filter(id__in=device_ids):
-        name = d.get_name()
+        summary = summaries.get(d.id)
+        name = summary.name if summary else d.get_name()
         if name != 'unknown':
             d.name = name
         d.cached_price = get_device_price(d)
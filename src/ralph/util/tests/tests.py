@@ -22,6 +22,8 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.test import TestCase
+import ipaddr
+from lck.django.tags.models import Language, Tag
 from tastypie.models import ApiKey
 from unittest import skip
 
@@ -44,6 +46,8 @@ from ralph.discovery.models import (
     PricingVariable,
 )
 from ralph.util import pricing
+from ralph.util.models import bulk_delete
+from ralph.util.network import ip_ranges
 from ralph.util.pricing import get_device_raw_price
 
 
@@ -91,6 +95,46 @@ class NetworkTest(TestCase):
         self.assertIsNone(hostname(NON_EXISTENT_HOST_IP))
 
 
+class IPRangesTest(TestCase):
+    def _ranges(self, *queries):
+        return [
+            (unicode(ipaddr.IPAddress(low)), unicode(ipaddr.IPAddress(high)))
+            for low, high in ip_ranges(queries)
+        ]
+
+    def test_prefix(self):
+        self.assertEqual(self._ranges('10.20.'), [
+            ('10.20.0.0', '10.20.255.255'),
+        ])
+        self.assertEqual(self._ranges('10.20.3'), [
+            ('10.20.3.0', '10.20.3.255'),
+            ('10.20.30.0', '10.20.39.255'),
+        ])
+
+    def test_network_and_range(self):
+        self.assertEqual(self._ranges('10.20.30.0/22'), [
+            ('10.20.28.0', '10.20.31.255'),
+        ])
+        self.assertEqual(self._ranges('10.1.1.5-90', '10.1.1.50-10.1.1.99'), [
+            ('10.1.1.5', '10.1.1.99'),
+        ])
+
+    def test_full_address_is_a_prefix(self):
+        # like the substring search it replaces, a complete address also
+        # matches the longer addresses it is a prefix of
+        self.assertEqual(self._ranges('10.0.0.1'), [
+            ('10.0.0.1', '10.0.0.1'),
+            ('10.0.0.10', '10.0.0.19'),
+            ('10.0.0.100', '10.0.0.199'),
+        ])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            ip_ranges(['host.local'])
+        with self.assertRaises(ValueError):
+            ip_ranges(['10.300.'])
+
+
 class PricingTest(TestCase):
     def test_rack_server(self):
         dev = Device.create(sn='device', model_type=DeviceType.rack_server,
@@ -374,3 +418,104 @@ class UncompressBase64DataTest(TestCase):
         encoded = base64.b64encode(raw)
         compressed = zlib.compress(encoded)
         self.assertEqual(uncompress_base64_data(compressed), encoded)
+
+
+class BulkDeleteTest(TestCase):
+    def test_generic_relations(self):
+        user = User.objects.create_user('ralph', 'ralph@local', 'ralph')
+        device = Device.create(
+            sn='sn-123',
+            model_name='xxx',
+            model_type=DeviceType.unknown,
+        )
+        device.tag('tag1', Language.en, user)
+        self.assertEqual(Tag.objects.filter(object_id=device.id).count(), 1)
+        counts = bulk_delete(Device, [device.id])
+        self.assertEqual(counts[Device], 1)
+        self.assertEqual(counts[Tag], 1)
+        self.assertFalse(Device.admin_objects.filter(id=device.id).exists())
+        self.assertFalse(Tag.objects.filter(object_id=device.id).exists())
+
+
+class ChunkedReportTest(TestCase):
+    def test_chunks(self):
+        from ralph.util.async_reports import (
+            ChunkedResult,
+            ChunkedResultWriter,
+        )
+
+        writer = ChunkedResultWriter(cache, 'test_report', 60, chunk_size=2)
+        for number in xrange(5):
+            writer.append({'number': number})
+        writer.set_progress(0.5)
+        status = cache.get('test_report')
+        self.assertFalse(status['finished'])
+        self.assertEqual(status['progress'], 0.5)
+        self.assertEqual(status['chunks'], 2)
+        writer.close()
+        result = ChunkedResult(cache, 'test_report', cache.get('test_report'))
+        self.assertEqual(len(result), 5)
+        self.assertEqual(
+            [row['number'] for row in result],
+            [0, 1, 2, 3, 4],
+        )
+        result.delete()
+        self.assertIsNone(cache.get('test_report'))
+        self.assertIsNone(cache.get('test_report_0'))
+
+
+class StreamingExportTest(TestCase):
+    def test_iter_chunks(self):
+        from ralph.util.views import iter_chunks
+
+        for name in ('c', 'a', 'd', 'b', 'e'):
+            Venture(name=name, symbol=name).save()
+        ventures = Venture.objects.order_by('-name')
+        with self.assertNumQueries(2):
+            chunks = iter_chunks(ventures, chunk_size=2)
+            first = next(chunks)
+        self.assertEqual([v.name for v in first], ['e', 'd'])
+        Venture.objects.get(name='b').delete()
+        with self.assertNumQueries(2):
+            rest = list(chunks)
+        self.assertEqual([[v.name for v in c] for c in rest], [['c'], ['a']])
+
+    def test_csv_response(self):
+        from django.test.client import RequestFactory
+        from ralph.util.middleware import GZipMiddleware, TimingMiddleware
+        from ralph.util.views import csv_response
+
+        encoded = []
+
+        def rows():
+            for number in xrange(1000):
+                encoded.append(number)
+                yield [number, 'row']
+
+        response = csv_response(rows(), filename='rows.csv')
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        response = GZipMiddleware().process_response(request, response)
+        response = TimingMiddleware().process_response(request, response)
+        # nothing is encoded until the response is sent
+        self.assertEqual(encoded, [])
+        self.assertFalse(response.has_header('Content-Encoding'))
+        first = next(iter(response))
+        self.assertEqual(len(first.splitlines()), 500)
+        self.assertEqual(len(encoded), 500)
+        rest = ''.join(response)
+        self.assertEqual(rest.splitlines()[-1], '999;row')
+        self.assertEqual(len(encoded), 1000)
+
+    def test_csvify(self):
+        from ralph.util.views import csvify
+
+        @csvify
+        def view():
+            return ([number, 'row'] for number in xrange(1000))
+
+        response = view()
+        self.assertTrue(response.streaming)
+        # a streamed body can only be read once
+        lines = response.content.splitlines()
+        self.assertEqual(lines[-1], '999;row')
+        self.assertEqual(len(lines), 1000)
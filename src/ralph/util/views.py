@@ -15,6 +15,9 @@ from django.utils import simplejson as json
 from bob import csvutil
 
 
+CSV_BATCH_SIZE = 500
+
+
 def jsonify(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
@@ -32,7 +35,53 @@ def csvify(func):
         reply = func(*args, **kwargs)
         if isinstance(reply, HttpResponseRedirect):
             return reply
-        f = StringIO.StringIO()
-        csvutil.UnicodeWriter(f).writerows(reply)
-        return HttpResponse(f.getvalue(), mimetype="application/csv")
+        response = HttpResponse(iter_csv(reply), mimetype="application/csv")
+        response.streaming = True
+        return response
     return wrapper
+
+
+def iter_chunks(queryset, chunk_size=CSV_BATCH_SIZE):
+    """
+    Yield the objects of the queryset in lists of `chunk_size`, keeping its
+    order. Only the primary keys are fetched up front, each chunk is loaded
+    with a separate query when it's needed.
+    """
+
+    ids = list(queryset.values_list('pk', flat=True))
+    for offset in xrange(0, len(ids), chunk_size):
+        window = ids[offset:offset + chunk_size]
+        objects = dict(
+            (obj.pk, obj) for obj in queryset.filter(pk__in=window)
+        )
+        # objects removed in the meantime are skipped
+        yield [objects[pk] for pk in window if pk in objects]
+
+
+def iter_csv(rows, batch_size=CSV_BATCH_SIZE):
+    """Encode the rows as CSV, yielding the output every few hundred rows."""
+
+    f = StringIO.StringIO()
+    writer = csvutil.UnicodeWriter(f)
+    for number, row in enumerate(rows, 1):
+        writer.writerow([unicode(item) for item in row])
+        if number % batch_size == 0:
+            yield f.getvalue()
+            f.seek(0)
+            f.truncate()
+    if f.tell():
+        yield f.getvalue()
+
+
+def csv_response(rows, filename='export.csv'):
+    """
+    Like ``bob.csvutil.make_csv_response``, but the rows can come from
+    a generator and are sent a batch at a time while they are encoded.
+    The response is marked as streaming, so that the middleware from
+    `ralph.util.middleware` doesn't read the whole body first.
+    """
+
+    response = HttpResponse(iter_csv(rows), content_type='application/csv')
+    response.streaming = True
+    response['Content-Disposition'] = 'attachment; filename=%s' % filename
+    return response